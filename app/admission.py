@@ -0,0 +1,242 @@
+import asyncio
+import math
+import os
+import time
+from typing import Callable, Hashable
+
+from fastapi.responses import ORJSONResponse
+from starlette.routing import Match
+
+from .cache import MISSING, TTLCache
+from .metrics import RATE_LIMITED, SHED, route_label
+
+
+def parse_limits(value: str) -> dict:
+    """'GET /tweets=16,POST /medias=4' -> {'GET /tweets': 16, ...}"""
+    limits = {}
+    for item in filter(None, value.split(",")):
+        route, _, limit = item.rpartition("=")
+        limits[" ".join(route.split())] = int(limit)
+    return limits
+
+
+def parse_routes(value: str) -> frozenset:
+    """'GET /tweets/stream, GET /x' -> {'GET /tweets/stream', 'GET /x'}"""
+    return frozenset(
+        " ".join(route.split()) for route in value.split(",") if route.strip()
+    )
+
+
+# Сколько запросов маршрута выполняется одновременно в одном воркере:
+# "МЕТОД путь=лимит" через запятую, путь - как в объявлении маршрута
+ADMISSION_LIMITS = parse_limits(os.getenv("ADMISSION_LIMITS", ""))
+# Лимит маршрутов, которых нет в ADMISSION_LIMITS, 0 - без ограничения
+ADMISSION_DEFAULT_LIMIT = int(os.getenv("ADMISSION_DEFAULT_LIMIT", 0))
+# Маршруты, на которые ADMISSION_DEFAULT_LIMIT не действует: поток
+# событий держит соединение открытым всё время жизни клиента и занимал
+# бы место в лимите, ничего не делая. Ограничение частоты запросов
+# на них действует
+ADMISSION_EXEMPT = parse_routes(
+    os.getenv("ADMISSION_EXEMPT", "GET /tweets/stream")
+)
+# Сколько запросов маршрута может ждать своей очереди и сколько секунд,
+# остальные получают 503
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", 50))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", 5))
+# Запросов в секунду на один api-key и запас для всплесков, 0 - без
+# ограничения
+RATE_LIMIT = float(os.getenv("RATE_LIMIT", 0))
+RATE_BURST = float(os.getenv("RATE_BURST", 20))
+
+
+class ConcurrencyLimit:
+    """
+    Ограничение одновременно выполняемых запросов с очередью
+    ограниченной длины.
+
+    ### Parameters:
+        - **limit**: `int` - сколько запросов выполняется одновременно.
+        - **queue_size**: `int` - сколько запросов может ждать.
+        - **timeout**: `float` - сколько секунд запрос может ждать.
+    """
+
+    def __init__(self, limit: int, queue_size: int, timeout: float):
+        self.limit = limit
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.waiting = 0
+        self._semaphore = asyncio.Semaphore(limit)
+
+    async def acquire(self) -> bool:
+        """
+        ### Returns:
+            - `True`, если запрос можно выполнять, `False`, если очередь
+            заполнена или время ожидания истекло.
+        """
+        if not self._semaphore.locked():
+            await self._semaphore.acquire()
+            return True
+        if self.waiting >= self.queue_size:
+            return False
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self.waiting -= 1
+        return True
+
+    def release(self):
+        self._semaphore.release()
+
+
+class RateLimiter:
+    """
+    Ограничение частоты запросов по ключу (token bucket): у каждого
+    ключа запас из burst запросов, который пополняется со скоростью rate
+    запросов в секунду.
+
+    ### Parameters:
+        - **rate**: `float` - запросов в секунду.
+        - **burst**: `float` - размер запаса.
+        - **maxsize**: `int` - сколько ключей помнить.
+        - **timer**: `Callable[[], float]` - источник времени.
+    """
+
+    def __init__(
+            self,
+            rate: float,
+            burst: float,
+            maxsize: int = 100000,
+            timer: Callable[[], float] = time.monotonic,
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.timer = timer
+        # Запас, который не трогали burst / rate секунд, снова полный,
+        # поэтому такие записи можно забыть
+        self.buckets = TTLCache(maxsize=maxsize, ttl=burst / rate, timer=timer)
+
+    def take(self, key: Hashable) -> float:
+        """
+        ### Returns:
+            - `float` - 0, если запрос разрешён, иначе через сколько
+            секунд появится следующий.
+        """
+        now = self.timer()
+        bucket = self.buckets.get(key)
+        if bucket is MISSING:
+            tokens = self.burst
+        else:
+            tokens, updated = bucket
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        if tokens < 1:
+            self.buckets.set(key, (tokens, now))
+            return (1 - tokens) / self.rate
+        self.buckets.set(key, (tokens - 1, now))
+        return 0.0
+
+
+def error_response(message: str, status_code: int, retry_after: float):
+    return ORJSONResponse(
+        content={
+            "result": False,
+            "error_type": "Exception",
+            "error_message": message,
+        },
+        status_code=status_code,
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+    )
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware перед маршрутами API: ограничивает частоту запросов
+    одного api-key (429) и количество одновременно выполняемых запросов
+    каждого маршрута, лишние запросы ждут в очереди ограниченной длины
+    или сразу получают 503. Так один клиент или один тяжёлый маршрут
+    не занимают весь пул соединений с базой.
+
+    ### Parameters:
+        - **limits**: `dict` - лимиты маршрутов {"GET /tweets": 16}.
+        - **default_limit**: `int` - лимит остальных маршрутов, 0 - без
+        ограничения.
+        - **exempt**: `frozenset` - маршруты, на которые default_limit
+        не действует (долгие потоки событий).
+        - **queue_size**: `int` - длина очереди маршрута.
+        - **queue_timeout**: `float` - сколько секунд ждать в очереди.
+        - **rate**: `float` - запросов в секунду на api-key, 0 - без
+        ограничения.
+        - **burst**: `float` - запас запросов api-key для всплесков.
+    """
+
+    def __init__(
+            self,
+            app,
+            limits: dict = ADMISSION_LIMITS,
+            default_limit: int = ADMISSION_DEFAULT_LIMIT,
+            exempt: frozenset = ADMISSION_EXEMPT,
+            queue_size: int = ADMISSION_QUEUE_SIZE,
+            queue_timeout: float = ADMISSION_QUEUE_TIMEOUT,
+            rate: float = RATE_LIMIT,
+            burst: float = RATE_BURST,
+    ):
+        self.app = app
+        self.limits = limits
+        self.default_limit = default_limit
+        self.exempt = exempt
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.rate_limiter = RateLimiter(rate, burst) if rate > 0 else None
+        self._routes: dict = {}
+
+    def route_limit(self, scope: dict) -> ConcurrencyLimit | None:
+        """Находит маршрут запроса и его ограничение. Маршрут
+        записывается в scope, чтобы метрики отказов знали маршрут."""
+        for route in scope["app"].router.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                scope["route"] = route
+                key = f"{scope['method']} {route.path}"
+                if key not in self._routes:
+                    default = 0 if key in self.exempt else self.default_limit
+                    limit = self.limits.get(key, default)
+                    self._routes[key] = None
+                    if limit > 0:
+                        self._routes[key] = ConcurrencyLimit(
+                            limit, self.queue_size, self.queue_timeout
+                        )
+                return self._routes[key]
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        limit = self.route_limit(scope)
+        if self.rate_limiter is not None:
+            api_key = dict(scope["headers"]).get(b"api-key")
+            retry_after = api_key and self.rate_limiter.take(api_key)
+            if retry_after:
+                RATE_LIMITED.labels(route_label(scope)).inc()
+                response = error_response(
+                    "Too many requests. Please retry later.", 429,
+                    retry_after,
+                )
+                await response(scope, receive, send)
+                return
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+        if not await limit.acquire():
+            SHED.labels(route_label(scope)).inc()
+            response = error_response(
+                "Server is busy. Please retry later.", 503, limit.timeout
+            )
+            await response(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limit.release()
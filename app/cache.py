@@ -0,0 +1,76 @@
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+MISSING = object()
+
+
+class TTLCache:
+    """
+    LRU-кэш ограниченного размера, в котором у каждой записи есть
+    время жизни. Кэш живёт в памяти процесса, поэтому у каждого
+    воркера gunicorn он свой.
+
+    ### Parameters:
+        - **maxsize**: `int` - максимальное количество записей, при
+        переполнении вытесняется запись, которую дольше всех не читали.
+        - **ttl**: `float` - время жизни записи в секундах по умолчанию.
+        - **timer**: `Callable[[], float]` - источник времени.
+    """
+
+    def __init__(
+            self,
+            maxsize: int,
+            ttl: float,
+            timer: Callable[[], float] = time.monotonic,
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = MISSING) -> Any:
+        """Возвращает значение по ключу или default, если записи нет
+        или её время жизни истекло."""
+        item = self._data.get(key)
+        if item is not None:
+            expires_at, value = item
+            if expires_at > self.timer():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._data[key]
+        self.misses += 1
+        return default
+
+    def set(self, key: Hashable, value: Any, ttl: float | None = None):
+        """Сохраняет значение, ttl переопределяет время жизни записи."""
+        expires_at = self.timer() + (self.ttl if ttl is None else ttl)
+        self._data[key] = (expires_at, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key: Hashable):
+        """Удаляет запись по ключу, если она есть."""
+        self._data.pop(key, None)
+
+    def invalidate_value(self, value: Any):
+        """Удаляет все записи с указанным значением."""
+        for key in [k for k, (_, v) in self._data.items() if v == value]:
+            del self._data[key]
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
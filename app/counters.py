@@ -0,0 +1,79 @@
+import asyncio
+
+from sqlalchemy import func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .models import (
+    Followers,
+    Likes,
+    Media,
+    MediaBlob,
+    Tweets,
+    User,
+    async_session,
+    engine,
+)
+
+
+async def repair_counters(session: AsyncSession):
+    """
+    Пересчитывает денормализованные счётчики подписчиков, подписок,
+    лайков и ссылок на файлы по таблицам followers, likes и media.
+    Обновляются только строки, в которых счётчик разошёлся с реальным
+    значением.
+
+    ### Parameters:
+        - **session**: `AsyncSession` - Сессия с текущей базой данных.
+    """
+    followers = (
+        select(func.count())
+        .where(Followers.following_id == User.id)
+        .scalar_subquery()
+    )
+    following = (
+        select(func.count())
+        .where(Followers.followers_id == User.id)
+        .scalar_subquery()
+    )
+    likes = (
+        select(func.count())
+        .where(Likes.tweet_id == Tweets.id)
+        .scalar_subquery()
+    )
+    await session.execute(
+        update(User)
+        .where(
+            User.followers_count.is_distinct_from(followers)
+            | User.following_count.is_distinct_from(following)
+        )
+        .values(followers_count=followers, following_count=following)
+        .execution_options(synchronize_session=False)
+    )
+    await session.execute(
+        update(Tweets)
+        .where(Tweets.like_count.is_distinct_from(likes))
+        .values(like_count=likes)
+        .execution_options(synchronize_session=False)
+    )
+    references = (
+        select(func.count())
+        .where(Media.checksum == MediaBlob.checksum)
+        .scalar_subquery()
+    )
+    await session.execute(
+        update(MediaBlob)
+        .where(MediaBlob.refcount.is_distinct_from(references))
+        .values(refcount=references)
+        .execution_options(synchronize_session=False)
+    )
+    await session.commit()
+
+
+async def main():  # pragma: no cover
+    async with async_session() as session:
+        await repair_counters(session)
+    await engine.dispose()
+
+
+if __name__ == "__main__":  # pragma: no cover
+    asyncio.run(main())
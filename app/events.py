@@ -0,0 +1,234 @@
+import asyncio
+import json
+import os
+from collections import deque
+from typing import Awaitable, Callable, NamedTuple
+
+from sqlalchemy import Integer, Text, cast, func, literal
+
+# Канал NOTIFY с событиями ленты: новый твит и лайк
+FEED_CHANNEL = "feed_events"
+# Раз в сколько секунд отправлять комментарий, чтобы прокси и клиент
+# не закрыли соединение без событий
+SSE_HEARTBEAT = float(os.getenv("SSE_HEARTBEAT", 15))
+# Сколько событий может ждать отправки одному клиенту. Если клиент
+# не успевает их читать, события сбрасываются и клиент получает reset
+SSE_QUEUE_SIZE = int(os.getenv("SSE_QUEUE_SIZE", 100))
+# Сколько последних событий воркер помнит для переподключения
+# с Last-Event-ID
+SSE_REPLAY_SIZE = int(os.getenv("SSE_REPLAY_SIZE", 1000))
+SSE_RETRY_MS = int(os.getenv("SSE_RETRY_MS", 3000))
+
+# Маркеры в очереди подписчика
+RESET = "reset"
+REFOLLOW = "refollow"
+
+
+class Event(NamedTuple):
+    id: str
+    type: str
+    author_id: int
+    data: str
+
+
+def feed_event(event_type: str, tweet_id, author_id, user_id=None):
+    """
+    Выражение pg_notify с событием ленты. Его нужно добавить в запрос,
+    который создаёт твит или лайк: событие уходит только после commit.
+    id события - случайный uuid, одинаковый во всех воркерах.
+
+    ### Parameters:
+        - **event_type**: `str` - "tweet" или "like".
+        - **tweet_id**, **author_id** - id твита и его автора, колонки
+        или значения.
+        - **user_id** - id пользователя, который лайкнул.
+    """
+    return func.pg_notify(
+        FEED_CHANNEL,
+        cast(
+            func.json_build_object(
+                "id",
+                func.gen_random_uuid(),
+                "type",
+                cast(literal(event_type), Text),
+                "tweet_id",
+                cast(tweet_id, Integer),
+                "author_id",
+                cast(author_id, Integer),
+                "user_id",
+                cast(literal(user_id), Integer),
+            ),
+            Text,
+        ),
+    )
+
+
+def format_event(event: Event) -> str:
+    return f"id: {event.id}\nevent: {event.type}\ndata: {event.data}\n\n"
+
+
+class Subscriber:
+    """Клиент потока событий: очередь неотправленных событий и авторы,
+    события которых ему нужны (подписки и он сам)."""
+
+    def __init__(self, user_id: int, authors: set, queue_size: int):
+        self.user_id = user_id
+        self.authors = authors
+        self.queue: asyncio.Queue = asyncio.Queue(queue_size)
+        self.refollow = False
+
+    def put(self, item):
+        """Кладёт событие в очередь. Переполненная очередь
+        сбрасывается, клиент получает reset и перечитывает ленту."""
+        try:
+            self.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RESET)
+
+
+class FeedBroker:
+    """
+    Раздаёт события ленты из одного LISTEN-соединения воркера
+    (NotifyListener) подписчикам в памяти. Подписчики проиндексированы
+    по авторам, поэтому событие обходит только тех, кому оно нужно.
+    Последние события хранятся для переподключения с Last-Event-ID.
+
+    ### Parameters:
+        - **queue_size**: `int` - размер очереди подписчика.
+        - **replay_size**: `int` - сколько событий помнить.
+    """
+
+    def __init__(
+            self,
+            queue_size: int = SSE_QUEUE_SIZE,
+            replay_size: int = SSE_REPLAY_SIZE,
+    ):
+        self.queue_size = queue_size
+        self.by_author: dict = {}
+        self.by_user: dict = {}
+        self.recent: deque = deque(maxlen=replay_size)
+
+    def __len__(self) -> int:
+        return sum(len(subscribers) for subscribers in self.by_user.values())
+
+    def subscribe(self, user_id: int, following: set) -> Subscriber:
+        subscriber = Subscriber(
+            user_id, set(following) | {user_id}, self.queue_size
+        )
+        self.by_user.setdefault(user_id, set()).add(subscriber)
+        self._index(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        self._unindex(subscriber)
+        subscribers = self.by_user.get(subscriber.user_id)
+        if subscribers is not None:
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self.by_user[subscriber.user_id]
+
+    def set_following(self, subscriber: Subscriber, following: set):
+        self._unindex(subscriber)
+        subscriber.authors = set(following) | {subscriber.user_id}
+        self._index(subscriber)
+
+    def _index(self, subscriber: Subscriber):
+        for author_id in subscriber.authors:
+            self.by_author.setdefault(author_id, set()).add(subscriber)
+
+    def _unindex(self, subscriber: Subscriber):
+        for author_id in subscriber.authors:
+            subscribers = self.by_author.get(author_id)
+            if subscribers is not None:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self.by_author[author_id]
+
+    def publish(self, payload: str):
+        """Обработчик FEED_CHANNEL: payload - JSON из feed_event."""
+        data = json.loads(payload)
+        event = Event(data["id"], data["type"], data["author_id"], payload)
+        self.recent.append(event)
+        for subscriber in self.by_author.get(event.author_id, ()):
+            subscriber.put(event)
+
+    def following_changed(self, payload: str):
+        """Обработчик PROFILE_CHANNEL: подписчики из payload (id через
+        запятую) перечитают свои подписки."""
+        for user_id in payload.split(","):
+            for subscriber in self.by_user.get(int(user_id or 0), ()):
+                subscriber.refollow = True
+                if not subscriber.queue.full():
+                    subscriber.queue.put_nowait(REFOLLOW)
+
+    def reset(self):
+        """Вызывается после переподключения LISTEN: уведомления за время
+        обрыва потеряны, все клиенты перечитывают ленту."""
+        self.recent.clear()
+        for subscribers in self.by_user.values():
+            for subscriber in subscribers:
+                subscriber.put(RESET)
+
+    def replay(self, subscriber: Subscriber, last_event_id: str):
+        """
+        ### Returns:
+            - `list` событий для подписчика после last_event_id или
+            `None`, если такого события воркер не помнит.
+        """
+        events = list(self.recent)
+        for index in range(len(events) - 1, -1, -1):
+            if events[index].id == last_event_id:
+                return [
+                    event
+                    for event in events[index + 1:]
+                    if event.author_id in subscriber.authors
+                ]
+        return None
+
+
+async def event_stream(
+        broker: FeedBroker,
+        subscriber: Subscriber,
+        missed: list | None,
+        load_following: Callable[[], Awaitable[set]],
+        heartbeat: float = SSE_HEARTBEAT,
+):
+    """
+    Поток Server-Sent Events подписчика. Подписчик отписывается, когда
+    клиент закрывает соединение.
+
+    ### Parameters:
+        - **broker**: `FeedBroker` - источник событий.
+        - **subscriber**: `Subscriber` - подписчик клиента.
+        - **missed**: `list | None` - события, пропущенные за время
+        переподключения, `None` - пропущенные события неизвестны.
+        - **load_following**: `Callable` - загружает id авторов,
+        на которых подписан пользователь.
+        - **heartbeat**: `float` - пауза между комментариями-пингами.
+    """
+    try:
+        yield f"retry: {SSE_RETRY_MS}\n\n"
+        if missed is None:
+            yield f"event: {RESET}\ndata: {{}}\n\n"
+        else:
+            for event in missed:
+                yield format_event(event)
+        while True:
+            try:
+                item = await asyncio.wait_for(
+                    subscriber.queue.get(), heartbeat
+                )
+            except asyncio.TimeoutError:
+                yield ": ping\n\n"
+                continue
+            if subscriber.refollow:
+                subscriber.refollow = False
+                broker.set_following(subscriber, await load_following())
+            if item == RESET:
+                yield f"event: {RESET}\ndata: {{}}\n\n"
+            elif isinstance(item, Event):
+                yield format_event(item)
+    finally:
+        broker.unsubscribe(subscriber)
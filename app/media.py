@@ -0,0 +1,421 @@
+import asyncio
+import hashlib
+import logging
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, NamedTuple
+
+import aiofiles
+from fastapi import Request
+from multipart.multipart import MultipartParser, parse_options_header
+from sqlalchemy import (
+    delete,
+    false,
+    insert,
+    literal,
+    literal_column,
+    select,
+    update,
+)
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .models import Media, MediaBlob
+from .variants import make_variants, variant_files
+
+logger = logging.getLogger(__name__)
+
+MAX_UPLOAD_SIZE = int(os.getenv("MAX_UPLOAD_SIZE", 10 * 1024 * 1024))
+# Сколько байт тела запроса сверх MAX_UPLOAD_SIZE можно потратить на
+# границы и заголовки частей multipart/form-data
+UPLOAD_FORM_OVERHEAD = 16 * 1024
+VARIANT_WORKERS = int(os.getenv("VARIANT_WORKERS", 2))
+
+# Статусы генерации уменьшенных копий (Media.variants_status)
+VARIANTS_PENDING = "pending"
+VARIANTS_READY = "ready"
+VARIANTS_FAILED = "failed"
+
+# Сигнатуры (magic bytes) поддерживаемых форматов картинок
+SIGNATURES = (
+    (b"\xff\xd8\xff", "jpg"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+)
+# Сколько первых байт нужно detect_image_type
+SIGNATURE_SIZE = 12
+
+
+class StoredUpload(NamedTuple):
+    """Загруженный файл, сохранённый во временный файл."""
+    path: str
+    size: int
+    checksum: str
+    extension: str
+
+
+def detect_image_type(head: bytes) -> str | None:
+    """
+    Определяет формат картинки по первым байтам файла.
+
+    ### Parameters:
+        - **head**: `bytes` - начало файла.
+
+    ### Returns:
+        - `str` с расширением файла или `None`, если формат
+        не поддерживается.
+    """
+    for signature, extension in SIGNATURES:
+        if head.startswith(signature):
+            return extension
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+
+class _MultipartEvents:
+    """Callbacks MultipartParser: складывают события разбора в список,
+    который обрабатывается после каждого куска тела запроса."""
+
+    def __init__(self):
+        self.events: list = []
+        self.field = b""
+        self.value = b""
+
+    def callbacks(self) -> dict:
+        return {
+            "on_part_begin": lambda: self.events.append(("begin", None)),
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_part_data": self.on_part_data,
+            "on_part_end": lambda: self.events.append(("end", None)),
+        }
+
+    def on_header_field(self, data: bytes, start: int, end: int):
+        self.field += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int):
+        self.value += data[start:end]
+
+    def on_header_end(self):
+        self.events.append(("header", (self.field.lower(), self.value)))
+        self.field = self.value = b""
+
+    def on_part_data(self, data: bytes, start: int, end: int):
+        self.events.append(("data", bytes(data[start:end])))
+
+
+async def receive_upload(
+        request: Request, directory: str, field: str = "file"
+) -> StoredUpload:
+    """
+    Потоково принимает файл из тела multipart/form-data запроса
+    и сохраняет его во временный файл в directory. Тело читается
+    по кускам прямо из request.stream(), без разбора формы Starlette,
+    поэтому в памяти одновременно находится не больше одного куска,
+    а файл записывается на диск один раз. Запрос с Content-Length
+    больше допустимого отклоняется до чтения тела, а чтение
+    прекращается, как только файл или тело превысили лимит.
+    Одновременно считается sha256 и определяется формат. Временный
+    файл нужно переименовать в итоговый через os.replace, при ошибке
+    он удаляется.
+
+    ### Parameters:
+        - **request**: `Request` - запрос с файлом.
+        - **directory**: `str` - папка для загруженных файлов.
+        - **field**: `str` - имя поля формы с файлом.
+
+    ### Returns:
+        - `StoredUpload` с путём к временному файлу, размером,
+        контрольной суммой и расширением, определённым по содержимому.
+    """
+    body_limit = MAX_UPLOAD_SIZE + UPLOAD_FORM_OVERHEAD
+    content_length = request.headers.get("content-length", "")
+    if content_length.isdigit() and int(content_length) > body_limit:
+        raise Exception("Can't add new media. File is too large.")
+    content_type, options = parse_options_header(
+        request.headers.get("content-type", "")
+    )
+    boundary = options.get(b"boundary")
+    if content_type != b"multipart/form-data" or not boundary:
+        raise Exception("Can't add new media. Please check your data.")
+    events = _MultipartEvents()
+    parser = MultipartParser(boundary, events.callbacks())
+
+    fd, path = tempfile.mkstemp(dir=directory, prefix=".upload-")
+    os.close(fd)
+    checksum = hashlib.sha256()
+    size = received = 0
+    extension = None
+    # Начало файла копится, пока его не хватит для определения формата
+    head = b""
+    in_file = found = False
+    try:
+        async with aiofiles.open(path, "wb") as f:
+            async for chunk in request.stream():
+                received += len(chunk)
+                if received > body_limit:
+                    raise Exception("Can't add new media. File is too large.")
+                parser.write(chunk)
+                for event, data in events.events:
+                    if event == "begin":
+                        in_file = False
+                    elif event == "header":
+                        name, value = data
+                        if name == b"content-disposition":
+                            _, params = parse_options_header(value)
+                            in_file = not found and (
+                                params.get(b"name") == field.encode()
+                            )
+                    elif event == "data" and in_file:
+                        size += len(data)
+                        if size > MAX_UPLOAD_SIZE:
+                            raise Exception(
+                                "Can't add new media. File is too large."
+                            )
+                        checksum.update(data)
+                        if extension is None:
+                            head += data
+                            if len(head) < SIGNATURE_SIZE:
+                                continue
+                            extension = detect_image_type(head)
+                            if extension is None:
+                                raise Exception(
+                                    "Can't add new media. "
+                                    "Unsupported file type."
+                                )
+                            data, head = head, b""
+                        await f.write(data)
+                    elif event == "end" and in_file:
+                        in_file = False
+                        found = True
+                events.events.clear()
+            if not found:
+                raise Exception(
+                    "Can't add new media. Please check your data."
+                )
+            if extension is None:
+                # Файл короче SIGNATURE_SIZE байт
+                extension = detect_image_type(head)
+                if extension is None:
+                    raise Exception(
+                        "Can't add new media. Unsupported file type."
+                    )
+                await f.write(head)
+    except BaseException:
+        os.remove(path)
+        raise
+    return StoredUpload(path, size, checksum.hexdigest(), extension)
+
+
+async def store_media(
+        session: AsyncSession,
+        upload: StoredUpload,
+        directory: str,
+        uploader_id: int,
+) -> tuple:
+    """
+    Кладёт загруженный файл в хранилище под именем sha256 содержимого
+    и добавляет запись media одним запросом. Если такой файл уже есть,
+    временный файл удаляется, а у файла увеличивается счётчик ссылок.
+    Запись в media_blobs остаётся заблокированной до конца транзакции,
+    поэтому файл не может быть одновременно удалён в release_blobs.
+
+    ### Parameters:
+        - **session**: `AsyncSession` - Сессия с текущей базой данных.
+        - **upload**: `StoredUpload` - результат receive_upload.
+        - **directory**: `str` - папка для загруженных файлов.
+        - **uploader_id**: `int` - id загрузившего пользователя.
+
+    ### Returns:
+        - `tuple` (id записи media, имя файла в хранилище).
+    """
+    file_name = f"{upload.checksum}.{upload.extension}"
+    try:
+        blob = (
+            pg_insert(MediaBlob)
+            .values(checksum=upload.checksum, file=file_name, size=upload.size)
+            .on_conflict_do_update(
+                index_elements=[MediaBlob.checksum],
+                # Без параметра: SQLAlchemy 1.4 ставит параметры
+                # ON CONFLICT внутри CTE не на своё место
+                set_={"refcount": MediaBlob.refcount + literal_column("1")},
+            )
+            .returning(MediaBlob.checksum)
+            .cte("blob")
+        )
+        result = await session.execute(
+            insert(Media)
+            .from_select(
+                [
+                    "file",
+                    "checksum",
+                    "uploader_id",
+                    "variants_status",
+                    "attached",
+                ],
+                select(
+                    literal(file_name),
+                    blob.c.checksum,
+                    literal(uploader_id),
+                    literal(VARIANTS_PENDING),
+                    false(),
+                ),
+            )
+            .returning(Media.id)
+        )
+        media_id = result.scalar_one()
+        path = os.path.join(directory, file_name)
+        if os.path.exists(path):
+            os.remove(upload.path)
+        else:
+            os.replace(upload.path, path)
+    except BaseException:
+        if os.path.exists(upload.path):
+            os.remove(upload.path)
+        raise
+    return media_id, file_name
+
+
+async def release_blobs(session: AsyncSession, media: list) -> list:
+    """
+    Уменьшает счётчики ссылок у файлов удалённых записей media и
+    удаляет записи файлов, на которые больше никто не ссылается.
+
+    ### Parameters:
+        - **session**: `AsyncSession` - Сессия с текущей базой данных.
+        - **media**: `list` - пары (checksum, file) удалённых записей media.
+
+    ### Returns:
+        - `list` с именами файлов, которые можно удалить с диска.
+        Удалять их нужно до commit, пока записи заблокированы.
+    """
+    released: dict = {}
+    # Файлы, загруженные до появления media_blobs, ни с кем не делятся
+    files = [file for checksum, file in media if checksum is None]
+    for checksum, _ in media:
+        if checksum is not None:
+            released[checksum] = released.get(checksum, 0) + 1
+    for checksum, count in released.items():
+        await session.execute(
+            update(MediaBlob)
+            .where(MediaBlob.checksum == checksum)
+            .values(refcount=MediaBlob.refcount - count)
+        )
+    if released:
+        unused = await session.execute(
+            delete(MediaBlob)
+            .where(
+                MediaBlob.checksum.in_(released), MediaBlob.refcount <= 0
+            )
+            .returning(MediaBlob.file)
+        )
+        for file in unused.scalars():
+            files.append(file)
+            files.extend(variant_files(file.rsplit(".", 1)[0]).values())
+    return files
+
+
+def remove_files(directory: str, names: list) -> tuple:
+    """
+    Удаляет файлы из папки, пропуская те, которых уже нет. Функция
+    блокирующая, из event loop её нужно вызывать через asyncio.to_thread.
+
+    ### Returns:
+        - `tuple` (количество удалённых файлов, освобождённые байты).
+    """
+    removed = reclaimed = 0
+    for name in names:
+        path = os.path.join(directory, name)
+        try:
+            size = os.stat(path).st_size
+            os.remove(path)
+        except FileNotFoundError:
+            continue
+        removed += 1
+        reclaimed += size
+    return removed, reclaimed
+
+
+_executor: ProcessPoolExecutor | None = None
+_variant_tasks: set = set()
+
+
+def get_executor() -> ProcessPoolExecutor:
+    """Пул процессов для генерации уменьшенных копий, создаётся при
+    первой загрузке картинки."""
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=VARIANT_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _executor
+
+
+def shutdown_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(cancel_futures=True)
+        _executor = None
+
+
+async def generate_variants(
+        session_factory: Callable,
+        media_id: int,
+        file: str,
+        checksum: str,
+        directory: str,
+):
+    """
+    Генерирует уменьшенные копии картинки в пуле процессов, не блокируя
+    event loop, и записывает результат в Media.variants_status. Если
+    копии этого файла уже есть, повторно они не создаются. При ошибке
+    в ленте остаётся исходная картинка.
+
+    ### Parameters:
+        - **session_factory**: `Callable` - фабрика сессий базы данных.
+        - **media_id**: `int` - id загруженной картинки.
+        - **file**: `str` - имя файла в хранилище.
+        - **checksum**: `str` - sha256 содержимого файла.
+        - **directory**: `str` - папка для загруженных файлов.
+    """
+    names = variant_files(checksum).values()
+    status = VARIANTS_READY
+    if not all(os.path.exists(os.path.join(directory, n)) for n in names):
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(
+                get_executor(),
+                make_variants,
+                os.path.join(directory, file),
+                directory,
+                checksum,
+            )
+        except Exception:
+            logger.exception("Can't make variants of media %s", media_id)
+            status = VARIANTS_FAILED
+    async with session_factory() as session:
+        await session.execute(
+            update(Media)
+            .where(Media.id == media_id)
+            .values(variants_status=status)
+        )
+        await session.commit()
+
+
+def schedule_variants(session_factory: Callable, *args):
+    """Ставит generate_variants в фон, ответ на загрузку его не ждёт."""
+    task = asyncio.create_task(generate_variants(session_factory, *args))
+    _variant_tasks.add(task)
+    task.add_done_callback(_variant_tasks.discard)
+
+
+async def wait_for_variants():
+    """Дожидается всех запущенных генераций уменьшенных копий."""
+    while _variant_tasks:
+        await asyncio.gather(*_variant_tasks, return_exceptions=True)
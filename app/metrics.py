@@ -0,0 +1,218 @@
+import asyncio
+import os
+import time
+from contextvars import ContextVar
+from typing import Any, MutableMapping
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+# Папка, в которой воркеры gunicorn складывают свои метрики, чтобы
+# /metrics отдавал их сумму (см. gunicorn_conf.py). Без неё метрики
+# относятся только к текущему процессу.
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", 0.5))
+
+REQUESTS = Counter(
+    "http_requests_total", "HTTP requests", ["method", "route", "status"]
+)
+EXCEPTIONS = Counter(
+    "http_exceptions_total",
+    "Exceptions returned as error responses",
+    ["route", "error_type"],
+)
+SHED = Counter(
+    "http_requests_shed_total",
+    "Requests rejected with 503 because the route queue was full",
+    ["route"],
+)
+RATE_LIMITED = Counter(
+    "http_requests_throttled_total",
+    "Requests rejected with 429 by the per api-key rate limit",
+    ["route"],
+)
+LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency",
+    ["method", "route"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+DB_STATEMENTS = Histogram(
+    "http_request_db_statements",
+    "SQL statements executed per HTTP request",
+    ["route"],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89),
+)
+DB_TIME = Histogram(
+    "http_request_db_seconds",
+    "Time spent in SQL statements per HTTP request",
+    ["route"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5),
+)
+POOL_CHECKED_OUT = Gauge(
+    "db_pool_checked_out",
+    "Connections checked out from the pool",
+    ["database"],
+    multiprocess_mode="livesum",
+)
+POOL_OVERFLOW = Gauge(
+    "db_pool_overflow",
+    "Connections opened over pool_size",
+    ["database"],
+    multiprocess_mode="livesum",
+)
+LOOP_LAG = Gauge(
+    "event_loop_lag_seconds",
+    "How late a timer callback ran on the event loop",
+    multiprocess_mode="livemax",
+)
+
+
+class DBStats:
+    """Количество и суммарное время SQL-запросов одного HTTP-запроса."""
+    __slots__ = ("statements", "seconds")
+
+    def __init__(self):
+        self.statements = 0
+        self.seconds = 0.0
+
+
+# Статистика текущего HTTP-запроса. Объект изменяемый, поэтому его видят
+# и задачи, запущенные внутри запроса (asyncio.gather, call_next)
+request_db: ContextVar = ContextVar("request_db", default=None)
+
+
+def instrument_engine(engine: AsyncEngine, database: str):
+    """
+    Подключает к engine подсчёт SQL-запросов текущего HTTP-запроса
+    и показатели пула соединений.
+
+    ### Parameters:
+        - **engine**: `AsyncEngine` - engine базы данных.
+        - **database**: `str` - значение метки database у метрик пула.
+    """
+    sync_engine = engine.sync_engine
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_execute(conn, cursor, statement, parameters, context, many):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_execute(conn, cursor, statement, parameters, context, many):
+        started = conn.info["query_started"].pop()
+        stats = request_db.get()
+        if stats is not None:
+            stats.statements += 1
+            stats.seconds += time.perf_counter() - started
+
+    @event.listens_for(sync_engine, "handle_error")
+    def on_error(context):
+        conn = context.connection
+        if conn is not None and conn.info.get("query_started"):
+            conn.info["query_started"].pop()
+
+    pool = sync_engine.pool
+    checked_out = POOL_CHECKED_OUT.labels(database)
+    overflow = POOL_OVERFLOW.labels(database)
+
+    def update_pool(*args):
+        # У NullPool нет ни размера, ни переполнения
+        if hasattr(pool, "checkedout"):
+            checked_out.set(pool.checkedout())
+            overflow.set(max(0, pool.overflow()))
+
+    event.listen(pool, "checkout", update_pool)
+    event.listen(pool, "checkin", update_pool)
+
+
+def route_label(scope: MutableMapping[str, Any]) -> str:
+    """Шаблон пути маршрута (/api/users/{id}), чтобы у метрик было
+    ограниченное количество меток."""
+    route = scope.get("route")
+    if route is None:
+        return "unmatched"
+    return scope.get("root_path", "") + route.path
+
+
+def record_exception(scope: MutableMapping[str, Any], error: Exception):
+    EXCEPTIONS.labels(route_label(scope), type(error).__name__).inc()
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware, которое считает запросы, их длительность и SQL-запросы
+    каждого запроса. Сделано без BaseHTTPMiddleware, чтобы не мешать
+    отдаче файлов через sendfile.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        stats = DBStats()
+        token = request_db.set(stats)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            request_db.reset(token)
+            route = route_label(scope)
+            method = scope["method"]
+            REQUESTS.labels(method, route, str(status)).inc()
+            LATENCY.labels(method, route).observe(elapsed)
+            DB_STATEMENTS.labels(route).observe(stats.statements)
+            DB_TIME.labels(route).observe(stats.seconds)
+
+
+async def measure_loop_lag(interval: float = LOOP_LAG_INTERVAL) -> float:
+    """Засыпает на interval секунд и записывает, насколько позже
+    event loop вернул управление."""
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    await asyncio.sleep(interval)
+    lag = max(0.0, loop.time() - started - interval)
+    LOOP_LAG.set(lag)
+    return lag
+
+
+async def monitor_loop_lag(
+        interval: float = LOOP_LAG_INTERVAL,
+):  # pragma: no cover
+    while True:
+        await measure_loop_lag(interval)
+
+
+def render_metrics() -> tuple:
+    """
+    ### Returns:
+        - `tuple` с текстом метрик в формате Prometheus и его
+        content-type. С PROMETHEUS_MULTIPROC_DIR метрики собираются со
+        всех воркеров.
+    """
+    registry = REGISTRY
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
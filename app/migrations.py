@@ -0,0 +1,421 @@
+import asyncio
+from typing import NamedTuple
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from .models import SEARCH_CONFIG, engine
+
+# Ключ advisory lock, под которым выполняются миграции, чтобы два
+# одновременно запущенных процесса не применяли их параллельно
+LOCK_KEY = 7_310_412
+
+
+class Migration(NamedTuple):
+    """
+    Ревизия схемы базы данных.
+
+    ### Parameters:
+        - **version**: `int` - номер ревизии, ревизии применяются по
+        возрастанию номера.
+        - **name**: `str` - короткое описание.
+        - **statements**: `tuple` - SQL-команды ревизии.
+        - **transactional**: `bool` - выполнять ли команды в одной
+        транзакции. Ревизии с CREATE INDEX CONCURRENTLY выполняются
+        без транзакции, чтобы не блокировать запись в таблицы.
+    """
+    version: int
+    name: str
+    statements: tuple
+    transactional: bool = True
+
+
+MIGRATIONS = (
+    Migration(
+        1,
+        "baseline schema",
+        (
+            """
+            CREATE TABLE IF NOT EXISTS "user" (
+                id SERIAL NOT NULL,
+                api_key VARCHAR NOT NULL,
+                name VARCHAR NOT NULL,
+                PRIMARY KEY (id),
+                UNIQUE (api_key)
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS media (
+                id SERIAL NOT NULL,
+                file VARCHAR NOT NULL,
+                uploader_id INTEGER NOT NULL,
+                PRIMARY KEY (id),
+                FOREIGN KEY (uploader_id)
+                    REFERENCES "user" (id) ON DELETE CASCADE
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS followers (
+                id SERIAL NOT NULL,
+                followers_id INTEGER NOT NULL,
+                following_id INTEGER NOT NULL,
+                PRIMARY KEY (id),
+                CONSTRAINT uix_1 UNIQUE (followers_id, following_id),
+                FOREIGN KEY (followers_id)
+                    REFERENCES "user" (id) ON DELETE CASCADE,
+                FOREIGN KEY (following_id)
+                    REFERENCES "user" (id) ON DELETE CASCADE
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS tweets (
+                id SERIAL NOT NULL,
+                content VARCHAR NOT NULL,
+                attachments INTEGER[],
+                author_id INTEGER NOT NULL,
+                PRIMARY KEY (id),
+                FOREIGN KEY (author_id)
+                    REFERENCES "user" (id) ON DELETE CASCADE
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS likes (
+                id SERIAL NOT NULL,
+                tweet_id INTEGER NOT NULL,
+                likers_id INTEGER NOT NULL,
+                PRIMARY KEY (id),
+                FOREIGN KEY (tweet_id)
+                    REFERENCES tweets (id) ON DELETE CASCADE,
+                FOREIGN KEY (likers_id)
+                    REFERENCES "user" (id) ON DELETE CASCADE
+            )
+            """,
+        ),
+    ),
+    Migration(
+        2,
+        "home timeline",
+        (
+            """
+            ALTER TABLE tweets
+                ADD COLUMN IF NOT EXISTS fanned_out BOOLEAN
+                DEFAULT false NOT NULL
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS timeline (
+                user_id INTEGER NOT NULL,
+                tweet_id INTEGER NOT NULL,
+                author_id INTEGER NOT NULL,
+                PRIMARY KEY (user_id, tweet_id),
+                FOREIGN KEY (user_id)
+                    REFERENCES "user" (id) ON DELETE CASCADE,
+                FOREIGN KEY (tweet_id)
+                    REFERENCES tweets (id) ON DELETE CASCADE,
+                FOREIGN KEY (author_id)
+                    REFERENCES "user" (id) ON DELETE CASCADE
+            )
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS ix_timeline_user_author
+                ON timeline (user_id, author_id)
+            """,
+        ),
+    ),
+    Migration(
+        3,
+        "like, follower and following counters",
+        (
+            """
+            ALTER TABLE "user"
+                ADD COLUMN IF NOT EXISTS followers_count INTEGER
+                DEFAULT '0' NOT NULL,
+                ADD COLUMN IF NOT EXISTS following_count INTEGER
+                DEFAULT '0' NOT NULL
+            """,
+            """
+            ALTER TABLE tweets
+                ADD COLUMN IF NOT EXISTS like_count INTEGER
+                DEFAULT '0' NOT NULL
+            """,
+            """
+            UPDATE "user" SET
+                followers_count = (
+                    SELECT count(*) FROM followers
+                    WHERE followers.following_id = "user".id
+                ),
+                following_count = (
+                    SELECT count(*) FROM followers
+                    WHERE followers.followers_id = "user".id
+                )
+            """,
+            """
+            UPDATE tweets SET like_count = (
+                SELECT count(*) FROM likes WHERE likes.tweet_id = tweets.id
+            )
+            """,
+        ),
+    ),
+    Migration(
+        4,
+        "performance indexes",
+        (
+            """
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_followers_following
+                ON followers (following_id, followers_id)
+            """,
+            """
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_tweets_author
+                ON tweets (author_id, id)
+            """,
+            """
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_media_uploader
+                ON media (uploader_id)
+            """,
+            """
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_likes_likers
+                ON likes (likers_id)
+            """,
+            # Повторные лайки раньше отсекались только проверкой в
+            # приложении, поэтому перед уникальным индексом убираем дубли
+            """
+            DELETE FROM likes a USING likes b
+            WHERE a.tweet_id = b.tweet_id
+                AND a.likers_id = b.likers_id
+                AND a.id > b.id
+            """,
+            """
+            CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS uix_likes
+                ON likes (tweet_id, likers_id)
+            """,
+            """
+            CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS uix_followers
+                ON followers (followers_id, following_id)
+            """,
+        ),
+        transactional=False,
+    ),
+    Migration(
+        5,
+        "composite primary keys for likes and followers",
+        (
+            "ALTER TABLE likes DROP COLUMN id",
+            """
+            ALTER TABLE likes
+                ADD CONSTRAINT likes_pkey PRIMARY KEY USING INDEX uix_likes
+            """,
+            "ALTER TABLE followers DROP COLUMN id",
+            "ALTER TABLE followers DROP CONSTRAINT uix_1",
+            """
+            ALTER TABLE followers
+                ADD CONSTRAINT followers_pkey
+                PRIMARY KEY USING INDEX uix_followers
+            """,
+            # Количество лайков могло измениться после удаления дублей
+            """
+            UPDATE tweets SET like_count = (
+                SELECT count(*) FROM likes WHERE likes.tweet_id = tweets.id
+            )
+            WHERE like_count <> (
+                SELECT count(*) FROM likes WHERE likes.tweet_id = tweets.id
+            )
+            """,
+        ),
+    ),
+    Migration(
+        6,
+        "content-addressed media blobs",
+        (
+            """
+            CREATE TABLE IF NOT EXISTS media_blobs (
+                checksum VARCHAR NOT NULL,
+                file VARCHAR NOT NULL,
+                size BIGINT NOT NULL,
+                refcount INTEGER DEFAULT '1' NOT NULL,
+                PRIMARY KEY (checksum)
+            )
+            """,
+            """
+            ALTER TABLE media
+                ADD COLUMN IF NOT EXISTS checksum VARCHAR
+                REFERENCES media_blobs (checksum)
+            """,
+            "CREATE INDEX IF NOT EXISTS ix_media_checksum ON media (checksum)",
+        ),
+    ),
+    Migration(
+        7,
+        "media variants status",
+        (
+            """
+            ALTER TABLE media
+                ADD COLUMN IF NOT EXISTS variants_status VARCHAR
+            """,
+        ),
+    ),
+    Migration(
+        8,
+        "media garbage collection columns",
+        (
+            """
+            ALTER TABLE media
+                ADD COLUMN IF NOT EXISTS created_at TIMESTAMP WITH TIME ZONE
+                DEFAULT now() NOT NULL,
+                ADD COLUMN IF NOT EXISTS deleted_at TIMESTAMP WITH TIME ZONE,
+                ADD COLUMN IF NOT EXISTS attached BOOLEAN
+                DEFAULT false NOT NULL
+            """,
+            """
+            UPDATE media SET attached = true
+            WHERE EXISTS (
+                SELECT 1 FROM tweets WHERE media.id = ANY(tweets.attachments)
+            )
+            """,
+        ),
+    ),
+    Migration(
+        9,
+        "media garbage collection indexes",
+        (
+            """
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_media_deleted
+                ON media (deleted_at) WHERE deleted_at IS NOT NULL
+            """,
+            """
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_media_unattached
+                ON media (created_at) WHERE NOT attached
+            """,
+        ),
+        transactional=False,
+    ),
+    # Вычисляемая колонка переписывает таблицу tweets под блокировкой,
+    # на большой базе миграцию лучше применять в окно обслуживания
+    Migration(
+        10,
+        "tweets full-text search column",
+        (
+            f"""
+            ALTER TABLE tweets
+                ADD COLUMN IF NOT EXISTS search TSVECTOR
+                GENERATED ALWAYS AS (to_tsvector('{SEARCH_CONFIG}', content))
+                STORED
+            """,
+        ),
+    ),
+    Migration(
+        11,
+        "tweets full-text search index",
+        (
+            """
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_tweets_search
+                ON tweets USING gin (search)
+            """,
+        ),
+        transactional=False,
+    ),
+    Migration(
+        12,
+        "follow backfill boundary",
+        (
+            """
+            ALTER TABLE followers
+                ADD COLUMN IF NOT EXISTS backfilled_from INTEGER
+            """,
+        ),
+    ),
+    # Заполнение ранга обновляет каждую строку tweets, на большой базе
+    # миграцию лучше применять в окно обслуживания
+    Migration(
+        13,
+        "tweets feed rank",
+        (
+            """
+            ALTER TABLE tweets
+                ADD COLUMN IF NOT EXISTS author_rank INTEGER
+                DEFAULT '0' NOT NULL
+            """,
+            """
+            UPDATE tweets SET author_rank = "user".followers_count
+            FROM "user"
+            WHERE "user".id = tweets.author_id
+                AND "user".followers_count <> 0
+            """,
+        ),
+    ),
+)
+
+
+async def applied_versions(conn: AsyncConnection) -> set:
+    await conn.execute(
+        text(
+            """
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                name VARCHAR NOT NULL,
+                applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            )
+            """
+        )
+    )
+    result = await conn.execute(text("SELECT version FROM schema_migrations"))
+    return set(result.scalars())
+
+
+async def migrate(engine_: AsyncEngine = engine) -> list:
+    """
+    Применяет к базе ревизии, которые ещё не были применены.
+    Запускается один раз при деплое, а не при старте каждого воркера.
+
+    ### Parameters:
+        - **engine_**: `AsyncEngine` - engine базы данных.
+
+    ### Returns:
+        - `list` с номерами применённых ревизий.
+    """
+    applied = []
+    async with engine_.connect() as lock_conn:
+        lock_conn = await lock_conn.execution_options(
+            isolation_level="AUTOCOMMIT"
+        )
+        await lock_conn.execute(
+            text("SELECT pg_advisory_lock(:key)"), {"key": LOCK_KEY}
+        )
+        try:
+            async with engine_.begin() as conn:
+                done = await applied_versions(conn)
+            for migration in sorted(MIGRATIONS):
+                if migration.version in done:
+                    continue
+                async with engine_.connect() as conn:
+                    if not migration.transactional:
+                        conn = await conn.execution_options(
+                            isolation_level="AUTOCOMMIT"
+                        )
+                    async with conn.begin():
+                        for statement in migration.statements:
+                            await conn.execute(text(statement))
+                        await conn.execute(
+                            text(
+                                "INSERT INTO schema_migrations (version, name)"
+                                " VALUES (:version, :name)"
+                            ),
+                            {
+                                "version": migration.version,
+                                "name": migration.name,
+                            },
+                        )
+                applied.append(migration.version)
+        finally:
+            await lock_conn.execute(
+                text("SELECT pg_advisory_unlock(:key)"), {"key": LOCK_KEY}
+            )
+    return applied
+
+
+async def main():  # pragma: no cover
+    applied = await migrate()
+    print(f"Applied migrations: {applied or 'none'}")
+    await engine.dispose()
+
+
+if __name__ == "__main__":  # pragma: no cover
+    asyncio.run(main())
@@ -1,37 +1,58 @@
-import os
-
 from dotenv import load_dotenv
+from fastapi import Depends, Request
 from sqlalchemy import (
     ARRAY,
+    BigInteger,
+    Boolean,
     Column,
+    Computed,
+    DateTime,
     ForeignKey,
+    Index,
     Integer,
     String,
-    UniqueConstraint,
+    false,
+    func,
+    text,
 )
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship, sessionmaker
+from sqlalchemy.orm import deferred, relationship, sessionmaker
+
+from .metrics import instrument_engine
+from .querylog import QUERY_LOG, watch_engine
+from .replicas import ReplicaSet
+from .settings import DatabaseSettings, create_engine
 
 load_dotenv()
 
-db_user = os.getenv("DB_USER")
-db_password = os.getenv("DB_PASSWORD")
-db_name = os.getenv("DB_NAME")
-db_port = os.getenv("DB_PORT")
+# Конфигурация полнотекстового поиска по твитам. Она зашита в колонку
+# tweets.search (миграция 10), поэтому при смене нужна новая миграция
+SEARCH_CONFIG = "simple"
 
-DATABASE_URL = (
-    f"postgresql+asyncpg://{db_user}:{db_password}@db:{db_port}/{db_name}"
-)
-engine = create_async_engine(DATABASE_URL, echo=True, pool_pre_ping=True)
+db_settings = DatabaseSettings.from_env("DB_")
+engine = create_engine(db_settings)
 
 async_session = sessionmaker(
     engine, expire_on_commit=False, class_=AsyncSession
 )
+replicas = ReplicaSet.from_env(db_settings)
+instrument_engine(engine, "primary")
+for index, replica_engine in enumerate(replicas.engines):
+    instrument_engine(replica_engine, f"replica{index}")
+if QUERY_LOG:
+    for watched_engine in (engine, *replicas.engines):
+        watch_engine(watched_engine)
 Base = declarative_base()
 
 
+def get_session_factory():  # pragma: no cover
+    """Фабрика сессий для фоновых задач, которые живут дольше запроса."""
+    return async_session
+
+
 async def get_db_session():  # pragma: no cover
     session = async_session()
     try:
@@ -44,40 +65,121 @@ async def get_db_session():  # pragma: no cover
         await session.close()
 
 
+def get_replica_set():  # pragma: no cover
+    return replicas
+
+
+def get_read_session_factory(
+        request: Request,
+        replica_set: ReplicaSet = Depends(get_replica_set),
+        session_factory=Depends(get_session_factory),
+):
+    """Фабрика сессий для чтения: реплика, если её можно использовать
+    для этого запроса, иначе основная база."""
+    return replica_set.session_factory(request) or session_factory
+
+
+async def get_read_session(
+        session: AsyncSession = Depends(get_db_session),
+        read_factory=Depends(get_read_session_factory),
+        session_factory=Depends(get_session_factory),
+):
+    """
+    Сессия для маршрутов, которые только читают данные. Без реплик
+    или если реплики отстают, отдаётся сессия основной базы. У сессий
+    реплик в info есть отметка replica.
+    """
+    if read_factory is session_factory:
+        yield session
+        return
+    async with read_factory() as replica_session:
+        yield replica_session
+
+
 class User(Base):
     __tablename__ = "user"
     id = Column(Integer, primary_key=True)
     api_key = Column(String, nullable=False, unique=True)
     name = Column(String, nullable=False)
+    # Счётчики, которые поддерживаются вместе с таблицей followers
+    followers_count = Column(
+        Integer, nullable=False, default=0, server_default="0"
+    )
+    following_count = Column(
+        Integer, nullable=False, default=0, server_default="0"
+    )
     # Отношения
     media = relationship("Media", back_populates="user")
     tweets = relationship("Tweets", back_populates="user")
     likes = relationship("Likes", back_populates="user")
 
 
+class MediaBlob(Base):
+    """Файл в хранилище DOWNLOADS, имя которого - sha256 содержимого.
+    Одинаковые загрузки ссылаются на один файл, refcount - количество
+    записей media, которые на него ссылаются."""
+    __tablename__ = "media_blobs"
+    checksum = Column(String, primary_key=True)
+    file = Column(String, nullable=False)
+    size = Column(BigInteger, nullable=False)
+    refcount = Column(Integer, nullable=False, default=1, server_default="1")
+
+
 class Media(Base):
     __tablename__ = "media"
     id = Column(Integer, primary_key=True)
     file = Column(String, nullable=False)
+    # Пустой у файлов, загруженных до появления media_blobs
+    checksum = Column(String, ForeignKey("media_blobs.checksum"))
+    # Статус генерации уменьшенных копий: pending, ready или failed
+    variants_status = Column(String)
     uploader_id = Column(
         Integer, ForeignKey("user.id", ondelete="CASCADE"), nullable=False
     )
+    created_at = Column(
+        DateTime(timezone=True), nullable=False, server_default=func.now()
+    )
+    # Прикреплена ли картинка к твиту. Неприкреплённые картинки старше
+    # MEDIA_ORPHAN_TTL и помеченные удалёнными (deleted_at) удаляются
+    # фоновой очисткой (api.reaper)
+    attached = Column(
+        Boolean, nullable=False, default=False, server_default=false()
+    )
+    deleted_at = Column(DateTime(timezone=True))
     # Отношения
     user = relationship("User", back_populates="media")
+    __table_args__ = (
+        Index("ix_media_uploader", "uploader_id"),
+        Index("ix_media_checksum", "checksum"),
+        Index(
+            "ix_media_deleted",
+            "deleted_at",
+            postgresql_where=text("deleted_at IS NOT NULL"),
+        ),
+        Index(
+            "ix_media_unattached",
+            "created_at",
+            postgresql_where=text("NOT attached"),
+        ),
+    )
 
 
 class Followers(Base):
     __tablename__ = "followers"
-    id = Column(Integer, primary_key=True)
+    # Составной первичный ключ предотвращает дублирование подписок
     followers_id = Column(
-        Integer, ForeignKey("user.id", ondelete="CASCADE"), nullable=False
+        Integer, ForeignKey("user.id", ondelete="CASCADE"), primary_key=True
     )
     following_id = Column(
-        Integer, ForeignKey("user.id", ondelete="CASCADE"), nullable=False
+        Integer, ForeignKey("user.id", ondelete="CASCADE"), primary_key=True
     )
-    # Уникальный составной индекс для предотвращения дублирования подписок
+    # id самого старого твита автора, добавленного в ленту при подписке,
+    # если добавлены не все его разосланные твиты. Более старые
+    # разосланные твиты автора подмешиваются в ленту при чтении
+    backfilled_from = Column(Integer)
+    # Индекс для выборки подписчиков пользователя
     __table_args__ = (
-        UniqueConstraint("followers_id", "following_id", name="uix_1"),
+        Index("ix_followers_following", "following_id", "followers_id"),
     )
 
 
@@ -89,20 +191,70 @@ class Tweets(Base):
     author_id = Column(
         Integer, ForeignKey("user.id", ondelete="CASCADE"), nullable=False
     )
+    # Разослан ли твит в ленты подписчиков (timeline). Твиты авторов с
+    # большим количеством подписчиков не рассылаются, а подмешиваются
+    # в ленту при чтении.
+    fanned_out = Column(
+        Boolean, nullable=False, default=False, server_default=false()
+    )
+    # Счётчик лайков, который поддерживается вместе с таблицей likes
+    like_count = Column(Integer, nullable=False, default=0, server_default="0")
+    # Ранг твита в ленте: количество подписчиков автора на момент
+    # публикации. В отличие от User.followers_count он не меняется,
+    # поэтому пригоден для ключа курсора ленты
+    author_rank = Column(
+        Integer, nullable=False, default=0, server_default="0"
+    )
+    # Лексемы текста для полнотекстового поиска, вычисляются базой.
+    # Колонка не загружается вместе с твитом
+    search = deferred(
+        Column(
+            TSVECTOR,
+            Computed(
+                f"to_tsvector('{SEARCH_CONFIG}', content)", persisted=True
+            ),
+        )
+    )
     # Отношения
     user = relationship("User", back_populates="tweets")
     likes = relationship("Likes", back_populates="tweets")
+    # Индекс для выборки твитов автора и GIN-индекс для поиска
+    __table_args__ = (
+        Index("ix_tweets_author", "author_id", "id"),
+        Index("ix_tweets_search", "search", postgresql_using="gin"),
+    )
 
 
 class Likes(Base):
     __tablename__ = "likes"
-    id = Column(Integer, primary_key=True)
+    # Составной первичный ключ не даёт лайкнуть твит дважды
     tweet_id = Column(
-        Integer, ForeignKey("tweets.id", ondelete="CASCADE"), nullable=False
+        Integer, ForeignKey("tweets.id", ondelete="CASCADE"), primary_key=True
     )
     likers_id = Column(
-        Integer, ForeignKey("user.id", ondelete="CASCADE"), nullable=False
+        Integer, ForeignKey("user.id", ondelete="CASCADE"), primary_key=True
     )
     # Отношения
     user = relationship("User", back_populates="likes")
     tweets = relationship("Tweets", back_populates="likes")
+    # Индекс для выборки лайков пользователя
+    __table_args__ = (Index("ix_likes_likers", "likers_id"),)
+
+
+class Timeline(Base):
+    """Материализованная лента: твиты авторов, на которых подписан
+    пользователь, заполняется при публикации твита (fan-out on write)."""
+    __tablename__ = "timeline"
+    user_id = Column(
+        Integer, ForeignKey("user.id", ondelete="CASCADE"), primary_key=True
+    )
+    tweet_id = Column(
+        Integer, ForeignKey("tweets.id", ondelete="CASCADE"), primary_key=True
+    )
+    author_id = Column(
+        Integer, ForeignKey("user.id", ondelete="CASCADE"), nullable=False
+    )
+    # Индекс для удаления твитов автора из ленты при отписке
+    __table_args__ = (
+        Index("ix_timeline_user_author", "user_id", "author_id"),
+    )
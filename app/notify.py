@@ -0,0 +1,91 @@
+import asyncio
+import logging
+from typing import Callable
+
+import asyncpg
+from sqlalchemy.engine import URL
+
+logger = logging.getLogger(__name__)
+
+
+def asyncpg_dsn(url: URL) -> str:
+    """DSN для asyncpg из URL engine SQLAlchemy (postgresql+asyncpg)."""
+    return url.set(drivername="postgresql").render_as_string(
+        hide_password=False
+    )
+
+
+class NotifyListener:
+    """
+    Слушает каналы Postgres (LISTEN) через одно отдельное соединение
+    на воркер и вызывает обработчики для каждого NOTIFY. Уведомления
+    доставляются только после commit транзакции, в которой вызван
+    pg_notify. При обрыве соединение переустанавливается, а так как
+    уведомления за время обрыва теряются, после каждого подключения
+    вызываются обработчики on_reconnect.
+
+    ### Parameters:
+        - **dsn**: `str` - строка подключения asyncpg.
+        - **reconnect_delay**: `float` - пауза перед повторным
+        подключением в секундах.
+    """
+
+    def __init__(self, dsn: str, reconnect_delay: float = 1.0):
+        self.dsn = dsn
+        self.reconnect_delay = reconnect_delay
+        self.handlers: dict = {}
+        self.reconnect_handlers: list = []
+        self.connected = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    def subscribe(self, channel: str, handler: Callable[[str], None]):
+        """Добавляет обработчик канала, handler получает payload.
+        Подписываться нужно до start."""
+        self.handlers.setdefault(channel, []).append(handler)
+
+    def on_reconnect(self, handler: Callable[[], None]):
+        self.reconnect_handlers.append(handler)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def _dispatch(self, conn, pid: int, channel: str, payload: str):
+        for handler in self.handlers.get(channel, ()):
+            try:
+                handler(payload)
+            except Exception:
+                logger.exception("NOTIFY handler failed on %s", channel)
+
+    async def _run(self):
+        while True:
+            conn = None
+            try:
+                conn = await asyncpg.connect(self.dsn)
+                closed = asyncio.Event()
+                conn.add_termination_listener(lambda c: closed.set())
+                for channel in self.handlers:
+                    await conn.add_listener(channel, self._dispatch)
+                for handler in self.reconnect_handlers:
+                    handler()
+                self.connected.set()
+                await closed.wait()
+                logger.warning("LISTEN connection lost, reconnecting")
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("LISTEN connection failed")
+            finally:
+                self.connected.clear()
+                if conn is not None and not conn.is_closed():
+                    await conn.close()
+            await asyncio.sleep(self.reconnect_delay)
@@ -0,0 +1,39 @@
+import base64
+import binascii
+import json
+
+
+def encode_cursor(*position) -> str:
+    """
+    Упаковывает позицию последней строки страницы в непрозрачный курсор.
+
+    ### Parameters:
+        - **position**: значения ключа сортировки последней строки.
+
+    ### Returns:
+        - `str` - курсор, безопасный для передачи в query-параметре.
+    """
+    raw = json.dumps(list(position), separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, size: int) -> tuple:
+    """
+    Распаковывает курсор, полученный от клиента.
+
+    ### Parameters:
+        - **cursor**: `str` - курсор из ответа на предыдущий запрос.
+        - **size**: `int` - ожидаемое количество значений в ключе сортировки.
+
+    ### Returns:
+        - `tuple` с позицией, после которой начинается следующая страница,
+        или исключение, если курсор повреждён.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        position = json.loads(raw)
+    except (binascii.Error, ValueError):
+        raise Exception("Wrong cursor. Please check your data.")
+    if not isinstance(position, list) or len(position) != size:
+        raise Exception("Wrong cursor. Please check your data.")
+    return tuple(position)
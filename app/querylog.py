@@ -0,0 +1,171 @@
+import logging
+import os
+import re
+import time
+from collections import Counter
+from contextvars import ContextVar
+from typing import NamedTuple
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+logger = logging.getLogger(__name__)
+
+# Журнал SQL-запросов для разработки: с QUERY_LOG=1 каждый HTTP-запрос
+# записывает свои SQL-запросы и предупреждает в логе о повторах (N+1)
+# и медленных запросах
+QUERY_LOG = os.getenv("QUERY_LOG", "").lower() in ("1", "true", "yes")
+# Сколько одинаковых по форме запросов за один HTTP-запрос считается N+1
+QUERY_REPEAT_THRESHOLD = int(os.getenv("QUERY_REPEAT_THRESHOLD", 3))
+QUERY_SLOW_MS = float(os.getenv("QUERY_SLOW_MS", 100))
+
+_SHAPE_RULES = (
+    (re.compile(r"'(?:[^']|'')*'"), "?"),
+    (re.compile(r"\$\d+|%s|%\(\w+\)s"), "?"),
+    (re.compile(r"\b\d+(?:\.\d+)?\b"), "?"),
+    # Списки IN (?, ?, ?) и VALUES разной длины дают одну форму
+    (re.compile(r"\?(?:\s*,\s*\?)+"), "?"),
+    (re.compile(r"\s+"), " "),
+)
+
+_active_logs: ContextVar = ContextVar("active_query_logs", default=())
+
+
+class Query(NamedTuple):
+    statement: str
+    shape: str
+    seconds: float
+
+
+def statement_shape(statement: str) -> str:
+    """Запрос без значений параметров и литералов: запросы, которые
+    отличаются только значениями, имеют одну форму."""
+    for pattern, replacement in _SHAPE_RULES:
+        statement = pattern.sub(replacement, statement)
+    return statement.strip()
+
+
+def _before_execute(conn, cursor, statement, parameters, context, many):
+    if _active_logs.get():
+        conn.info.setdefault("query_log_started", []).append(
+            time.perf_counter()
+        )
+
+
+def _after_execute(conn, cursor, statement, parameters, context, many):
+    logs = _active_logs.get()
+    if logs and conn.info.get("query_log_started"):
+        seconds = time.perf_counter() - conn.info["query_log_started"].pop()
+        query = Query(statement, statement_shape(statement), seconds)
+        for log in logs:
+            log.queries.append(query)
+
+
+def _on_error(context):
+    conn = context.connection
+    if conn is not None and conn.info.get("query_log_started"):
+        conn.info["query_log_started"].pop()
+
+
+def watch_engine(engine: AsyncEngine):
+    """Подключает к engine запись запросов в активные QueryLog."""
+    sync_engine = engine.sync_engine
+    if event.contains(sync_engine, "before_cursor_execute", _before_execute):
+        return
+    event.listen(sync_engine, "before_cursor_execute", _before_execute)
+    event.listen(sync_engine, "after_cursor_execute", _after_execute)
+    event.listen(sync_engine, "handle_error", _on_error)
+
+
+class QueryLog:
+    """
+    Записывает SQL-запросы, выполненные внутри with (в том числе
+    в задачах, запущенных внутри), через engine, подключённые
+    watch_engine.
+
+    ### Parameters:
+        - **repeat_threshold**: `int` - сколько одинаковых по форме
+        запросов считать повтором (N+1).
+        - **slow_ms**: `float | None` - порог медленного запроса
+        в миллисекундах, `None` - не проверять.
+    """
+
+    def __init__(
+            self,
+            repeat_threshold: int = QUERY_REPEAT_THRESHOLD,
+            slow_ms: float | None = QUERY_SLOW_MS,
+    ):
+        self.repeat_threshold = repeat_threshold
+        self.slow_ms = slow_ms
+        self.queries: list = []
+        self._token = None
+
+    def __enter__(self):
+        self._token = _active_logs.set(_active_logs.get() + (self,))
+        return self
+
+    def __exit__(self, *exc):
+        _active_logs.reset(self._token)
+
+    @property
+    def statements(self) -> list:
+        return [query.statement for query in self.queries]
+
+    def repeated(self) -> dict:
+        """Формы запросов, выполненных repeat_threshold и больше раз."""
+        counts = Counter(query.shape for query in self.queries)
+        return {
+            shape: count
+            for shape, count in counts.items()
+            if count >= self.repeat_threshold
+        }
+
+    def slow(self) -> list:
+        if self.slow_ms is None:
+            return []
+        return [
+            query
+            for query in self.queries
+            if query.seconds * 1000 >= self.slow_ms
+        ]
+
+    def problems(self, max_statements: int | None = None) -> list:
+        """
+        ### Parameters:
+            - **max_statements**: `int | None` - сколько запросов можно
+            выполнить, `None` - не ограничено.
+
+        ### Returns:
+            - `list` с описаниями нарушений, пустой, если их нет.
+        """
+        problems = [
+            f"{count} x {shape}" for shape, count in self.repeated().items()
+        ]
+        problems += [
+            f"slow {query.seconds * 1000:.1f} ms: {query.shape}"
+            for query in self.slow()
+        ]
+        if max_statements is not None and len(self.queries) > max_statements:
+            problems.append(
+                f"{len(self.queries)} statements, budget {max_statements}"
+            )
+        return problems
+
+
+class QueryLogMiddleware:
+    """ASGI middleware для разработки: пишет в лог повторяющиеся
+    и медленные SQL-запросы каждого HTTP-запроса."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        with QueryLog() as log:
+            await self.app(scope, receive, send)
+        for problem in log.problems():
+            logger.warning(
+                "%s %s: %s", scope["method"], scope["path"], problem
+            )
@@ -0,0 +1,146 @@
+import asyncio
+import logging
+import os
+from typing import Callable, NamedTuple
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .media import VARIANTS_PENDING, release_blobs, remove_files
+from .models import Media, async_session, engine
+
+logger = logging.getLogger(__name__)
+
+# Через сколько секунд неприкреплённая к твиту картинка считается
+# брошенной и удаляется
+MEDIA_ORPHAN_TTL = float(os.getenv("MEDIA_ORPHAN_TTL", 24 * 60 * 60))
+MEDIA_GC_BATCH_SIZE = int(os.getenv("MEDIA_GC_BATCH_SIZE", 500))
+MEDIA_GC_INTERVAL = float(os.getenv("MEDIA_GC_INTERVAL", 60))
+
+# Сколько всего удалено этим процессом с момента запуска
+reaper_stats = {"runs": 0, "media": 0, "files": 0, "bytes": 0}
+
+
+class ReapResult(NamedTuple):
+    """Результат одного прохода очистки."""
+    media: int = 0
+    files: int = 0
+    bytes: int = 0
+
+    def __add__(self, other):
+        return ReapResult(*(a + b for a, b in zip(self, other)))
+
+
+def reapable_media(orphan_ttl: float, batch_size: int):
+    """
+    Запрос id картинок, которые можно удалить: помеченные удалёнными
+    вместе с твитом и брошенные, то есть не прикреплённые к твиту дольше
+    orphan_ttl секунд. У только что загруженных картинок ещё могут
+    генерироваться уменьшенные копии, такие картинки ждут orphan_ttl.
+    Строки блокируются с SKIP LOCKED, поэтому очистку можно запускать
+    в нескольких воркерах сразу, а картинки, которые прямо сейчас
+    прикрепляются к твиту (add_new_tweet блокирует их строки),
+    пропускаются.
+    """
+    # make_interval(years, months, weeks, days, hours, mins, secs)
+    ttl = func.make_interval(0, 0, 0, 0, 0, 0, orphan_ttl)
+    expired = Media.created_at < func.now() - ttl
+    deleted = select(Media.id).where(
+        Media.deleted_at.isnot(None),
+        Media.variants_status.is_distinct_from(VARIANTS_PENDING) | expired,
+    )
+    orphaned = select(Media.id).where(~Media.attached, expired)
+    return [
+        query.limit(batch_size).with_for_update(skip_locked=True)
+        for query in (deleted, orphaned)
+    ]
+
+
+async def reap_media(
+        session: AsyncSession,
+        directory: str,
+        orphan_ttl: float = MEDIA_ORPHAN_TTL,
+        batch_size: int = MEDIA_GC_BATCH_SIZE,
+) -> ReapResult:
+    """
+    Удаляет картинки удалённых твитов и брошенные загрузки пачками по
+    batch_size записей, каждая пачка в своей транзакции. Файлы удаляются
+    в отдельном потоке, чтобы не блокировать event loop, и до commit,
+    пока записи media_blobs заблокированы (см. release_blobs).
+
+    ### Parameters:
+        - **session**: `AsyncSession` - Сессия с текущей базой данных.
+        - **directory**: `str` - папка для загруженных файлов.
+        - **orphan_ttl**: `float` - сколько секунд ждать прикрепления
+        загруженной картинки к твиту.
+        - **batch_size**: `int` - сколько записей удалять за транзакцию.
+
+    ### Returns:
+        - `ReapResult` с количеством удалённых записей media, файлов
+        и освобождённых байт.
+    """
+    total = ReapResult()
+    for candidates in reapable_media(orphan_ttl, batch_size):
+        while True:
+            result = await session.execute(
+                delete(Media)
+                .where(Media.id.in_(candidates.scalar_subquery()))
+                .returning(Media.checksum, Media.file)
+                .execution_options(synchronize_session=False)
+            )
+            media = result.all()
+            if not media:
+                await session.commit()
+                break
+            names = await release_blobs(session, media)
+            files, size = await asyncio.to_thread(
+                remove_files, directory, names
+            )
+            await session.commit()
+            total += ReapResult(len(media), files, size)
+            if len(media) < batch_size:
+                break
+    reaper_stats["runs"] += 1
+    for key, value in total._asdict().items():
+        reaper_stats[key] += value
+    if total.media:
+        logger.info(
+            "Reaped %s media, %s files, %s bytes",
+            total.media,
+            total.files,
+            total.bytes,
+        )
+    return total
+
+
+async def run_reaper(
+        session_factory: Callable,
+        directory: str,
+        interval: float = MEDIA_GC_INTERVAL,
+):  # pragma: no cover
+    """Запускает reap_media раз в interval секунд, пока задачу не
+    отменят. Ошибки логируются, очистка продолжается."""
+    while True:
+        try:
+            async with session_factory() as session:
+                await reap_media(session, directory)
+        except Exception:
+            logger.exception("Media garbage collection failed")
+        await asyncio.sleep(interval)
+
+
+async def main():  # pragma: no cover
+    directory = os.getenv("DOWNLOADS")
+    if directory is None:
+        raise Exception("Check DOWNLOADS in .env")
+    async with async_session() as session:
+        result = await reap_media(session, directory)
+    print(
+        f"Reaped {result.media} media, {result.files} files, "
+        f"{result.bytes} bytes"
+    )
+    await engine.dispose()
+
+
+if __name__ == "__main__":  # pragma: no cover
+    asyncio.run(main())
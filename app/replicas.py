@@ -0,0 +1,156 @@
+import asyncio
+import itertools
+import logging
+import math
+import os
+import time
+
+from fastapi import Request, Response
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from .cache import MISSING, TTLCache
+from .settings import DatabaseSettings, create_engine
+
+logger = logging.getLogger(__name__)
+
+# Реплики для чтения: "host[:port]" через запятую, остальные настройки
+# подключения берутся у основной базы
+REPLICA_HOSTS = os.getenv("REPLICA_HOSTS", "")
+# Насколько (в секундах) реплика может отставать, чтобы с неё читали
+REPLICA_MAX_LAG = float(os.getenv("REPLICA_MAX_LAG", 1))
+# Сколько секунд после изменения данных пользователь читает с основной
+# базы, чтобы увидеть свои изменения
+REPLICA_STICKY_SECONDS = float(os.getenv("REPLICA_STICKY_SECONDS", 5))
+REPLICA_CHECK_INTERVAL = float(os.getenv("REPLICA_CHECK_INTERVAL", 1))
+STICKY_COOKIE = "read_primary_until"
+
+# Отставание реплики. Если реплика не в режиме восстановления (отдельная
+# база) или применила всё полученное, отставания нет.
+LAG_QUERY = text(
+    """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(
+            extract(epoch FROM now() - pg_last_xact_replay_timestamp()),
+            'Infinity'
+        )
+    END
+    """
+)
+
+
+class ReplicaSet:
+    """
+    Реплики для чтения и выбор реплики для запроса. Отставание реплик
+    проверяет фоновая задача run, пока проверки не было или реплика
+    недоступна, чтение идёт с основной базы. После изменения данных
+    пользователь на REPLICA_STICKY_SECONDS закрепляется за основной
+    базой: в этом воркере по api-key, в остальных - по cookie.
+
+    ### Parameters:
+        - **engines**: `list` - engine реплик.
+        - **max_lag**: `float` - допустимое отставание в секундах.
+        - **sticky_seconds**: `float` - сколько секунд после изменения
+        данных читать с основной базы.
+    """
+
+    def __init__(
+            self,
+            engines: list,
+            max_lag: float = REPLICA_MAX_LAG,
+            sticky_seconds: float = REPLICA_STICKY_SECONDS,
+    ):
+        self.engines = engines
+        self.max_lag = max_lag
+        self.sticky_seconds = sticky_seconds
+        self.factories = [
+            sessionmaker(
+                engine,
+                expire_on_commit=False,
+                class_=AsyncSession,
+                info={"replica": True},
+            )
+            for engine in engines
+        ]
+        self.lags = [math.inf] * len(engines)
+        self.sticky = TTLCache(maxsize=100000, ttl=sticky_seconds)
+        self._next = itertools.count()
+
+    @classmethod
+    def from_env(cls, primary: DatabaseSettings) -> "ReplicaSet":
+        engines = []
+        for address in filter(None, REPLICA_HOSTS.split(",")):
+            host, _, port = address.strip().partition(":")
+            settings = primary.model_copy(
+                update={"host": host, "port": int(port or primary.port)}
+            )
+            engines.append(create_engine(settings))
+        return cls(engines)
+
+    def is_sticky(self, request: Request) -> bool:
+        api_key = request.headers.get("api-key")
+        if api_key and self.sticky.get(api_key) is not MISSING:
+            return True
+        try:
+            until = float(request.cookies.get(STICKY_COOKIE, 0))
+        except ValueError:
+            return False
+        return time.time() < until <= time.time() + self.sticky_seconds
+
+    def mark_write(self, api_key: str | None, response: Response):
+        """Закрепляет пользователя за основной базой после изменения
+        данных."""
+        if not self.engines:
+            return
+        if api_key:
+            self.sticky.set(api_key, True)
+        response.set_cookie(
+            STICKY_COOKIE,
+            str(time.time() + self.sticky_seconds),
+            max_age=math.ceil(self.sticky_seconds),
+            httponly=True,
+        )
+
+    def session_factory(self, request: Request):
+        """
+        Фабрика сессий реплики для запроса.
+
+        ### Returns:
+            - `sessionmaker` одной из реплик, отстающих не больше
+            max_lag, по кругу, или `None`, если читать нужно с основной
+            базы.
+        """
+        if not self.engines or self.is_sticky(request):
+            return None
+        start = next(self._next)
+        for offset in range(len(self.engines)):
+            index = (start + offset) % len(self.engines)
+            if self.lags[index] <= self.max_lag:
+                return self.factories[index]
+        return None
+
+    async def check(self):
+        """Обновляет отставание реплик, недоступная реплика считается
+        бесконечно отстающей."""
+        for index, engine in enumerate(self.engines):
+            try:
+                async with engine.connect() as conn:
+                    lag = (await conn.execute(LAG_QUERY)).scalar()
+                self.lags[index] = float(lag)
+            except Exception:
+                logger.exception("Replica %s check failed", engine.url)
+                self.lags[index] = math.inf
+
+    async def run(
+            self, interval: float = REPLICA_CHECK_INTERVAL
+    ):  # pragma: no cover
+        while True:
+            await self.check()
+            await asyncio.sleep(interval)
+
+    async def dispose(self):
+        for engine in self.engines:
+            await engine.dispose()
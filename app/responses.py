@@ -0,0 +1,186 @@
+import os
+import re
+from email.utils import formatdate
+
+import aiofiles
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+# Загруженные файлы хранятся под именем sha256 содержимого и никогда не
+# меняются, поэтому браузер и CDN могут кэшировать их без проверки
+CACHE_IMMUTABLE = "public, max-age=31536000, immutable"
+CACHE_REVALIDATE = "no-cache"
+
+SEND_CHUNK_SIZE = int(os.getenv("SEND_CHUNK_SIZE", 256 * 1024))
+
+_RANGE = re.compile(r"^\s*(\d*)\s*-\s*(\d*)\s*$")
+
+
+class RangeNotSatisfiable(Exception):
+    """Запрошенный диапазон байт лежит за пределами файла."""
+
+
+def parse_range(header: str | None, size: int) -> tuple | None:
+    """
+    Разбирает заголовок Range вида `bytes=start-end`, `bytes=start-`
+    или `bytes=-suffix`.
+
+    ### Parameters:
+        - **header**: `str | None` - значение заголовка Range.
+        - **size**: `int` - размер файла.
+
+    ### Returns:
+        - `tuple` (start, end) с включительными границами или `None`,
+        если нужно отдать файл целиком: заголовка нет, он неверный или
+        в нём несколько диапазонов (multipart/byteranges не
+        поддерживается).
+    """
+    if not header:
+        return None
+    unit, _, ranges = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in ranges:
+        return None
+    match = _RANGE.match(ranges)
+    if match is None:
+        return None
+    start, end = match.groups()
+    if not start:
+        if not end:
+            return None
+        suffix = int(end)
+        if suffix == 0:
+            raise RangeNotSatisfiable()
+        return max(size - suffix, 0), size - 1
+    start = int(start)
+    if start >= size:
+        raise RangeNotSatisfiable()
+    end = int(end) if end else size - 1
+    if end < start:
+        return None
+    return start, min(end, size - 1)
+
+
+def etag_matches(header: str | None, etag: str) -> bool:
+    """Проверяет If-None-Match: совпадает ли один из тегов с etag.
+    Сравнение слабое, как требует RFC 9110 для If-None-Match."""
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    tags = (tag.strip().removeprefix("W/") for tag in header.split(","))
+    return etag.removeprefix("W/") in tags
+
+
+class AccelRedirectResponse(Response):
+    """
+    Пустой ответ с заголовком X-Accel-Redirect: файл по внутреннему
+    адресу uri отправляет nginx через sendfile, он же обрабатывает
+    Range и If-Range. Content-Type и Cache-Control ответа nginx
+    передаёт клиенту сам, ETag - по настройке в nginx.conf.
+
+    ### Parameters:
+        - **uri**: `str` - внутренний адрес файла в nginx.
+        - **headers**: `dict | None` - дополнительные заголовки.
+        - **media_type**: `str | None` - Content-Type файла.
+    """
+
+    def __init__(
+            self,
+            uri: str,
+            headers: dict | None = None,
+            media_type: str | None = None,
+    ):
+        super().__init__(headers=headers, media_type=media_type)
+        self.headers["x-accel-redirect"] = uri
+
+
+class MediaFileResponse(Response):
+    """
+    Отдаёт файл или диапазон байт файла. Если сервер поддерживает
+    расширение ASGI `http.response.zerocopysend`, файл отправляется
+    через sendfile и не копируется в память процесса; целиком файл
+    также может быть отправлен через `http.response.pathsend`. Иначе
+    файл читается кусками по SEND_CHUNK_SIZE байт: uvicorn не
+    поддерживает ни одно из расширений, поэтому за nginx файлы
+    отдаются через AccelRedirectResponse.
+
+    ### Parameters:
+        - **path**: `str` - путь к файлу.
+        - **stat_result**: `os.stat_result` - результат os.stat файла.
+        - **byte_range**: `tuple | None` - включительный диапазон
+        (start, end), для него отдаётся ответ 206.
+        - **headers**: `dict | None` - дополнительные заголовки.
+        - **media_type**: `str | None` - Content-Type файла.
+    """
+
+    def __init__(
+            self,
+            path: str,
+            stat_result: os.stat_result,
+            byte_range: tuple | None = None,
+            headers: dict | None = None,
+            media_type: str | None = None,
+    ):
+        size = stat_result.st_size
+        self.path = path
+        self.media_type = media_type
+        self.background = None
+        if byte_range is None:
+            self.status_code = 200
+            self.offset, self.count = 0, size
+        else:
+            start, end = byte_range
+            self.status_code = 206
+            self.offset, self.count = start, end - start + 1
+        self.init_headers(headers)
+        self.headers["accept-ranges"] = "bytes"
+        self.headers["content-length"] = str(self.count)
+        self.headers.setdefault(
+            "last-modified", formatdate(stat_result.st_mtime, usegmt=True)
+        )
+        if byte_range is not None:
+            self.headers["content-range"] = (
+                f"bytes {self.offset}-{self.offset + self.count - 1}/{size}"
+            )
+        self.whole_file = self.count == size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        await send(
+            {
+                "type": "http.response.start",
+                "status": self.status_code,
+                "headers": self.raw_headers,
+            }
+        )
+        extensions = scope.get("extensions") or {}
+        if scope["method"].upper() == "HEAD" or self.count == 0:
+            await send({"type": "http.response.body", "body": b""})
+        elif "http.response.zerocopysend" in extensions:
+            with open(self.path, "rb") as file:
+                await send(
+                    {
+                        "type": "http.response.zerocopysend",
+                        "file": file,
+                        "offset": self.offset,
+                        "count": self.count,
+                    }
+                )
+        elif "http.response.pathsend" in extensions and self.whole_file:
+            await send({"type": "http.response.pathsend", "path": self.path})
+        else:
+            async with aiofiles.open(self.path, "rb") as file:
+                await file.seek(self.offset)
+                remaining = self.count
+                while remaining:
+                    chunk = await file.read(min(SEND_CHUNK_SIZE, remaining))
+                    if not chunk:
+                        # Файл укоротился после stat, дальше слать нечего
+                        remaining = 0
+                    remaining -= len(chunk)
+                    await send(
+                        {
+                            "type": "http.response.body",
+                            "body": chunk,
+                            "more_body": remaining > 0,
+                        }
+                    )
@@ -1,50 +1,271 @@
+import asyncio
+import mimetypes
 import os
 from contextlib import asynccontextmanager
-from datetime import datetime
+from urllib.parse import quote
 
-import aiofiles
 from dotenv import load_dotenv
-from fastapi import Depends, FastAPI, File, Header, Request, UploadFile
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi import (
+    Depends,
+    FastAPI,
+    Header,
+    Query,
+    Request,
+)
+from fastapi.responses import (
+    HTMLResponse,
+    JSONResponse,
+    ORJSONResponse,
+    Response,
+    StreamingResponse,
+)
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from sqlalchemy import case, delete, func, insert, select
+from sqlalchemy import (
+    ARRAY,
+    JSON,
+    Integer,
+    String,
+    case,
+    cast,
+    column,
+    delete,
+    exists,
+    func,
+    insert,
+    literal,
+    literal_column,
+    null,
+    or_,
+    select,
+    true,
+    tuple_,
+    union_all,
+    update,
+    values,
+)
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import aliased
-from sqlalchemy.sql.expression import and_, any_, or_
+from sqlalchemy.sql.expression import any_
 
 from .models import (
-    Base,
     Followers,
     Likes,
     Media,
+    SEARCH_CONFIG,
+    Timeline,
     Tweets,
     User,
+    async_session,
     engine,
     get_db_session,
+    get_read_session,
+    get_replica_set,
+    get_session_factory,
+    replicas,
+)
+from .admission import AdmissionMiddleware
+from .cache import MISSING, TTLCache
+from .events import FEED_CHANNEL, FeedBroker, event_stream, feed_event
+from .media import (
+    VARIANTS_READY,
+    receive_upload,
+    schedule_variants,
+    shutdown_executor,
+    store_media,
+)
+from .metrics import (
+    MetricsMiddleware,
+    monitor_loop_lag,
+    record_exception,
+    render_metrics,
+)
+from .notify import NotifyListener, asyncpg_dsn
+from .pagination import decode_cursor, encode_cursor
+from .querylog import QUERY_LOG, QueryLogMiddleware
+from .reaper import run_reaper
+from .replicas import ReplicaSet
+from .responses import (
+    CACHE_IMMUTABLE,
+    CACHE_REVALIDATE,
+    AccelRedirectResponse,
+    MediaFileResponse,
+    RangeNotSatisfiable,
+    etag_matches,
+    parse_range,
 )
-from .shemas import TweetCreate
+from .shemas import (
+    Feed,
+    FollowsBatch,
+    FollowsBatchResult,
+    LikesBatch,
+    LikesBatchResult,
+    MediaCreated,
+    Profile,
+    Result,
+    SearchFeed,
+    TweetCreate,
+    TweetCreated,
+    TweetsBatch,
+    TweetsBatchResult,
+)
+from .variants import VARIANT_WIDTHS, variant_files
 
 static = os.path.abspath("static")
 
 DOWNLOADS: str | None = os.getenv("DOWNLOADS")
+# Внутренний адрес nginx, по которому доступна папка DOWNLOADS. Если
+# задан, /media/{id} не отправляет файл сам, а отвечает заголовком
+# X-Accel-Redirect, и файл через sendfile отдаёт nginx (см. nginx.conf)
+MEDIA_ACCEL_PREFIX: str | None = os.getenv("MEDIA_ACCEL_PREFIX")
+
+FEED_PAGE_SIZE = int(os.getenv("FEED_PAGE_SIZE", 20))
+FEED_MAX_PAGE_SIZE = int(os.getenv("FEED_MAX_PAGE_SIZE", 100))
+# Максимальная длина поискового запроса /tweets/search
+SEARCH_MAX_LENGTH = int(os.getenv("SEARCH_MAX_LENGTH", 256))
+# Среди скольких самых новых найденных твитов ранжировать результаты
+# поиска: ранжирование всех совпадений частого слова читает всю таблицу
+SEARCH_RANK_WINDOW = int(os.getenv("SEARCH_RANK_WINDOW", 2000))
+# Твиты авторов, у которых подписчиков не меньше порога, не рассылаются
+# по лентам при публикации, а подмешиваются в ленту при чтении
+FANOUT_THRESHOLD = int(os.getenv("FANOUT_THRESHOLD", 10000))
+# Сколько последних разосланных твитов автора добавляется в ленту
+# при подписке на него
+FOLLOW_BACKFILL_LIMIT = int(os.getenv("FOLLOW_BACKFILL_LIMIT", 1000))
+# Ранг твитов ленты от авторов, на которых пользователь не подписан:
+# ниже любого ранга твитов подписок (Tweets.author_rank >= 0)
+FEED_REST_RANK = -1
+# Размер страницы подписчиков и подписок в профиле
+FOLLOWS_PAGE_SIZE = int(os.getenv("FOLLOWS_PAGE_SIZE", 100))
+FOLLOWS_MAX_PAGE_SIZE = int(os.getenv("FOLLOWS_MAX_PAGE_SIZE", 1000))
+# Сколько записей можно передать в одном пакетном запросе (*:batch)
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", 1000))
+
+# Кэш api-key -> id пользователя, неверные ключи тоже кэшируются,
+# но на более короткое время
+api_key_cache = TTLCache(
+    maxsize=int(os.getenv("API_KEY_CACHE_SIZE", 10000)),
+    ttl=float(os.getenv("API_KEY_CACHE_TTL", 60)),
+)
+API_KEY_CACHE_MISS_TTL = float(os.getenv("API_KEY_CACHE_MISS_TTL", 5))
+
+# Кэш профилей пользователей (/users/me и /users/{id}). Записи
+# сбрасываются при подписке и отписке, в остальных воркерах - через
+# NOTIFY в канал PROFILE_CHANNEL. TTL ограничивает устаревание, если
+# уведомление потерялось.
+profile_cache = TTLCache(
+    maxsize=int(os.getenv("PROFILE_CACHE_SIZE", 10000)),
+    ttl=float(os.getenv("PROFILE_CACHE_TTL", 300)),
+)
+PROFILE_CHANNEL = "profile_changed"
+# Счётчик сбросов профилей, см. info_user
+profile_generation = [0]
+# Подписчики потока событий ленты (/tweets/stream) этого воркера
+feed_broker = FeedBroker()
+
+
+def count_of(cte):
+    """Количество строк в CTE. Ссылка на изменяющий данные CTE нужна,
+    чтобы SQLAlchemy включил его в запрос."""
+    return select(func.count()).select_from(cte).scalar_subquery()
+
+
+async def lock_users(
+        session: AsyncSession, user_ids, share: bool = False
+) -> dict:
+    """
+    Блокирует строки пользователей до конца транзакции отдельным
+    запросом, до запроса, который меняет подписки или рассылает твиты.
+    Публикация твита блокирует автора на чтение (FOR SHARE), подписка
+    и отписка - на запись (FOR NO KEY UPDATE), поэтому они ждут друг
+    друга, и следующий запрос видит то, что сделала другая транзакция:
+    иначе твит, опубликованный одновременно с подпиской, не попадёт
+    ни в рассылку, ни в добавление твитов автора в ленту. Строки
+    блокируются по порядку id, чтобы встречные подписки не
+    взаимоблокировались.
+
+    ### Parameters:
+        - **session**: `AsyncSession` - Сессия с текущей базой данных.
+        - **user_ids** - id пользователей.
+        - **share**: `bool` - блокировка на чтение.
+
+    ### Returns:
+        - `dict` {id: followers_count} найденных пользователей.
+    """
+    result = await session.execute(
+        select(User.id, User.followers_count)
+        .where(User.id.in_(set(user_ids)))
+        .order_by(User.id)
+        .with_for_update(read=share, key_share=not share)
+    )
+    return {row.id: row.followers_count for row in result}
+
+
+def backfill_boundary(author_id):
+    """
+    id самого старого из FOLLOW_BACKFILL_LIMIT последних разосланных
+    твитов автора, которые добавляются в ленту при подписке. NULL, если
+    у автора их не больше: тогда в ленту добавляются все.
+
+    ### Parameters:
+        - **author_id** - id автора или колонка с ним.
+
+    ### Returns:
+        - скалярный подзапрос для Followers.backfilled_from.
+    """
+    return (
+        select(Tweets.id)
+        .where(Tweets.author_id == author_id, Tweets.fanned_out.is_(True))
+        .order_by(Tweets.id.desc())
+        .offset(FOLLOW_BACKFILL_LIMIT - 1)
+        .limit(1)
+        .scalar_subquery()
+    )
 
 
 @asynccontextmanager
-async def lifespan(
-        app: FastAPI, session: AsyncSession = Depends(get_db_session)
-):  # pragma: no cover
-    """Создаёт таблицу если её небыло,
-    открывает и закрывает session и engine"""
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+async def lifespan(app: FastAPI):  # pragma: no cover
+    """Запускает фоновую очистку картинок, прослушивание уведомлений
+    об изменении профилей, проверку отставания реплик и замер задержки
+    event loop, закрывает engine при остановке приложения.
+    Схема базы данных создаётся и обновляется миграциями (api.migrations)
+    до запуска воркеров."""
+    reaper = None
+    if DOWNLOADS is not None:
+        reaper = asyncio.create_task(run_reaper(async_session, DOWNLOADS))
+    listener = NotifyListener(asyncpg_dsn(engine.url))
+    listener.subscribe(PROFILE_CHANNEL, invalidate_profiles)
+    listener.subscribe(PROFILE_CHANNEL, feed_broker.following_changed)
+    listener.subscribe(FEED_CHANNEL, feed_broker.publish)
+    # Пока соединения не было, уведомления могли потеряться
+    listener.on_reconnect(clear_profiles)
+    listener.on_reconnect(feed_broker.reset)
+    listener.start()
+    loop_lag = asyncio.create_task(monitor_loop_lag())
+    replica_check = None
+    if replicas.engines:
+        replica_check = asyncio.create_task(replicas.run())
     yield
-    await session.close()
+    loop_lag.cancel()
+    if replica_check is not None:
+        replica_check.cancel()
+        await replicas.dispose()
+    await listener.stop()
+    if reaper is not None:
+        reaper.cancel()
+    shutdown_executor()
     await engine.dispose()
 
 
 app = FastAPI(lifespan=lifespan, title="main")
-app_api = FastAPI(title="api")
+app.add_middleware(MetricsMiddleware)
+if QUERY_LOG:
+    app.add_middleware(QueryLogMiddleware)
+# Ответы описаны моделями из shemas: FastAPI сериализует их через
+# pydantic-core без jsonable_encoder, а ORJSONResponse кодирует в JSON
+app_api = FastAPI(title="api", default_response_class=ORJSONResponse)
 
 app.mount("/api", app_api, name="api")
 app.mount("/static", StaticFiles(directory=static, html=True), name="static")
@@ -57,13 +278,125 @@ async def index(request: Request):  # pragma: no cover
     return templates.TemplateResponse("index.html", {"request": request})
 
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Метрики в формате Prometheus: запросы, задержки, SQL-запросы
+    на запрос, пул соединений и задержка event loop."""
+    content, media_type = render_metrics()
+    return Response(content, media_type=media_type)
+
+
+def media_error(message: str, status_code: int) -> JSONResponse:
+    """Ошибка в том же формате, что у catch_exceptions_middleware."""
+    return JSONResponse(
+        content={
+            "result": False,
+            "error_type": "Exception",
+            "error_message": message,
+        },
+        status_code=status_code,
+    )
+
+
+# Маршрут подключён к app, а не к app_api: BaseHTTPMiddleware из
+# app_api пропускает через себя только http.response.body и не дал бы
+# отправить файл через sendfile
+@app.api_route("/media/{id}", methods=["GET", "HEAD"])
+async def get_media(
+        id: int,
+        request: Request,
+        width: int | None = None,
+        session: AsyncSession = Depends(get_db_session),
+):
+    """
+    Отдать загруженную картинку. Ключ авторизации не нужен, картинки
+    показываются в ленте через <img>. Поддерживаются If-None-Match
+    (ответ 304) и запросы диапазона байт через Range (ответ 206).
+    Если задан MEDIA_ACCEL_PREFIX, файл отдаёт nginx.
+
+    ### Parameters:
+        - **id**: `int` - ID картинки.
+        - **request**: `Request` - текущий запрос.
+        - **width**: `int | None` - ширина уменьшенной копии из
+        VARIANT_WIDTHS. Пока копия не готова, отдаётся исходный файл.
+        - **session**: `AsyncSession` - Сессия с текущей базой данных.
+
+    ### Returns:
+        - `Response` с содержимым файла или сообщением об ошибке.
+    """
+    if width is not None and width not in VARIANT_WIDTHS:
+        return media_error("Can't show media. Wrong width.", 400)
+    row = (
+        await session.execute(
+            select(Media.file, Media.checksum, Media.variants_status).where(
+                Media.id == id, Media.deleted_at.is_(None)
+            )
+        )
+    ).first()
+    if row is None or DOWNLOADS is None:
+        return media_error("Can't show media. Please check your data.", 404)
+
+    file, etag, cache_control = row.file, None, CACHE_IMMUTABLE
+    if row.checksum is not None:
+        etag = f'"{row.checksum}"'
+        if width is not None:
+            if row.variants_status == VARIANTS_READY:
+                file = variant_files(row.checksum)[width]
+                etag = f'"{row.checksum}_{width}"'
+            else:
+                # Копия появится позже, поэтому клиент должен
+                # перепроверить ответ при следующем запросе
+                cache_control = CACHE_REVALIDATE
+    path = os.path.join(DOWNLOADS, file)
+    try:
+        stat_result = os.stat(path)
+    except FileNotFoundError:
+        return media_error("Can't show media. Please check your data.", 404)
+    if etag is None:
+        # Файлы, загруженные до появления media_blobs, могут быть
+        # перезаписаны, для них тег строится по времени изменения и размеру
+        etag = f'"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"'
+        cache_control = CACHE_REVALIDATE
+    headers = {"etag": etag, "cache-control": cache_control}
+
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    media_type = mimetypes.guess_type(file)[0]
+    if MEDIA_ACCEL_PREFIX:
+        return AccelRedirectResponse(
+            MEDIA_ACCEL_PREFIX + quote(file),
+            headers=headers,
+            media_type=media_type,
+        )
+    if_range = request.headers.get("if-range")
+    byte_range = None
+    if if_range is None or if_range.strip() == etag:
+        try:
+            byte_range = parse_range(
+                request.headers.get("range"), stat_result.st_size
+            )
+        except RangeNotSatisfiable:
+            return Response(
+                status_code=416,
+                headers={"content-range": f"bytes */{stat_result.st_size}"},
+            )
+    return MediaFileResponse(
+        path,
+        stat_result,
+        byte_range=byte_range,
+        headers=headers,
+        media_type=media_type,
+    )
+
+
 async def catch_exceptions_middleware(request: Request, call_next):
     # pragma: no cover
     """отлавливает ошибки оформляет по нужному формату"""
     try:
         return await call_next(request)
     except Exception as e:
-        return JSONResponse(
+        record_exception(request.scope, e)
+        return ORJSONResponse(
             content={
                 "result": False,
                 "error_type": type(e).__name__,
@@ -74,34 +407,94 @@ async def catch_exceptions_middleware(request: Request, call_next):
 
 
 app_api.middleware("http")(catch_exceptions_middleware)
+# Ограничения частоты и одновременных запросов проверяются раньше
+# остальных middleware, чтобы отказ стоил как можно меньше
+app_api.add_middleware(AdmissionMiddleware)
 
 
 async def check_api_key(
+        request: Request,
+        response: Response,
         api_key: str | None = Header("api-key"),
         session: AsyncSession = Depends(get_db_session),
+        replica_set: ReplicaSet = Depends(get_replica_set),
 ):
     """
-    Проверяет существует ли api-key.
+    Проверяет существует ли api-key. Результат проверки кэшируется
+    в api_key_cache, чтобы не ходить в базу на каждый запрос. Запросы,
+    которые меняют данные, закрепляют пользователя за основной базой,
+    чтобы следующие чтения видели его изменения.
 
     ### Parameters:
         - **api_key**: `str | None` - API-ключ текущего пользователя.
         - **session**: `AsyncSession` - Сессия с текущей базой данных.
+        - **replica_set**: `ReplicaSet` - реплики для чтения.
         ### Returns:
         - `id текущего пользователя или сообщение об ошибке.
 
     """
+    if request.method not in ("GET", "HEAD"):
+        replica_set.mark_write(api_key, response)
     if api_key:
-        check_api_k = await session.execute(
-            select(User.id).where(User.api_key == api_key)
-        )
-        res = check_api_k.scalars().first()
+        res = api_key_cache.get(api_key)
+        if res is MISSING:
+            check_api_k = await session.execute(
+                select(User.id).where(User.api_key == api_key)
+            )
+            res = check_api_k.scalars().first()
+            api_key_cache.set(
+                api_key, res, ttl=None if res else API_KEY_CACHE_MISS_TTL
+            )
         if res:
             return res
         raise Exception("Wrong api-key. Please check your data.")
     raise Exception("Wrong api-key. Please check your data.")
 
 
-@app_api.post("/tweets")
+def invalidate_api_key(
+        api_key: str | None = None, user_id: int | None = None
+):
+    """
+    Сбрасывает закэшированный api-key. Нужно вызывать при смене
+    api-key или удалении пользователя, без аргументов очищает весь кэш.
+
+    ### Parameters:
+        - **api_key**: `str | None` - api-key, который нужно сбросить.
+        - **user_id**: `int | None` - id пользователя, все api-key
+        которого нужно сбросить.
+    """
+    if api_key is None and user_id is None:
+        api_key_cache.clear()
+    if api_key is not None:
+        api_key_cache.invalidate(api_key)
+    if user_id is not None:
+        api_key_cache.invalidate_value(user_id)
+
+
+def notify_profiles(*user_ids):
+    """
+    Выражение pg_notify, которое сообщает всем воркерам об изменении
+    профилей. Его нужно добавить в запрос, меняющий подписки: уведомление
+    уходит только после commit.
+    """
+    return func.pg_notify(PROFILE_CHANNEL, ",".join(map(str, user_ids)))
+
+
+def clear_profiles():
+    profile_generation[0] += 1
+    profile_cache.clear()
+
+
+def invalidate_profiles(payload: str):
+    """Сбрасывает профили из уведомления PROFILE_CHANNEL (id через
+    запятую)."""
+    profile_generation[0] += 1
+    for user_id in payload.split(","):
+        if user_id:
+            profile_cache.invalidate(int(user_id))
+
+
+@app_api.post("/tweets", response_model=TweetCreated)
 async def add_new_tweet(
         data: TweetCreate,
         session: AsyncSession = Depends(get_db_session),
@@ -123,48 +516,121 @@ async def add_new_tweet(
     - `Response` объект с успешным статусом или неуспешным
     и сообщением об ошибке.
     """
-    if data.tweet_media_ids:
-        media_ids_query = select(Media.id).where(
-            (Media.id.in_(data.tweet_media_ids))
-            & (Media.uploader_id == user_id)
+    media_ids = data.tweet_media_ids or []
+    followers_count = (await lock_users(session, [user_id], share=True))[
+        user_id
+    ]
+    new_tweet = select(
+        literal(data.tweet_data),
+        literal(media_ids, ARRAY(Integer)),
+        literal(user_id),
+        literal(followers_count < FANOUT_THRESHOLD),
+        literal(0),
+        literal(followers_count),
+    )
+    if media_ids:
+        # Отмечаем картинки прикреплёнными, чтобы фоновая очистка их не
+        # удалила. Твит добавляется, только если все картинки найдены.
+        attached = (
+            update(Media)
+            .where(
+                Media.id.in_(media_ids),
+                Media.uploader_id == user_id,
+                Media.deleted_at.is_(None),
+            )
+            .values(attached=True)
+            .returning(Media.id)
+            .cte("attached")
         )
-        media_ids_result = await session.execute(media_ids_query)
-        media_ids = media_ids_result.scalars().all()
-
-        if len(media_ids) != len(data.tweet_media_ids):
-            raise Exception("Can't add new tweet. Please check your data.")
-
-    tweet_insert = (
+        new_tweet = new_tweet.where(count_of(attached) == len(media_ids))
+    tweet = (
         insert(Tweets)
-        .values(
-            content=data.tweet_data,
-            attachments=data.tweet_media_ids if data.tweet_media_ids else [],
-            author_id=user_id,
+        .from_select(
+            [
+                "content",
+                "attachments",
+                "author_id",
+                "fanned_out",
+                "like_count",
+                "author_rank",
+            ],
+            new_tweet,
         )
-        .returning(Tweets.id)
+        .returning(Tweets.id, Tweets.fanned_out)
+        .cte("tweet")
     )
-
-    result = await session.execute(tweet_insert)
+    # Рассылаем твит в ленты всех подписчиков автора
+    fanned_out = (
+        insert(Timeline)
+        .from_select(
+            ["user_id", "tweet_id", "author_id"],
+            select(Followers.followers_id, tweet.c.id, literal(user_id))
+            .join(tweet, tweet.c.fanned_out)
+            .where(Followers.following_id == user_id),
+        )
+        .returning(Timeline.user_id)
+        .cte("fanned_out")
+    )
+    result = await session.execute(
+        select(
+            tweet.c.id,
+            count_of(fanned_out),
+            feed_event("tweet", tweet.c.id, user_id),
+        )
+    )
+    tweet_id = result.scalar()
+    if tweet_id is None:
+        await session.rollback()
+        raise Exception("Can't add new tweet. Please check your data.")
     await session.commit()
 
-    return {"result": True, "tweet_id": result.scalars().first()}
+    return {"result": True, "tweet_id": tweet_id}
+
+
+# Тело /api/medias читается вручную (receive_upload), поэтому схема
+# формы для документации описана явно
+MEDIA_REQUEST_BODY = {
+    "required": True,
+    "content": {
+        "multipart/form-data": {
+            "schema": {
+                "type": "object",
+                "required": ["file"],
+                "properties": {
+                    "file": {"type": "string", "format": "binary"},
+                },
+            },
+        },
+    },
+}
 
 
-@app_api.post("/medias")
+@app_api.post(
+    "/medias",
+    response_model=MediaCreated,
+    openapi_extra={"requestBody": MEDIA_REQUEST_BODY},
+)
 async def add_new_media(
-        file: UploadFile = File(...),
+        request: Request,
         session: AsyncSession = Depends(get_db_session),
         user_id: int = Depends(check_api_key),
+        session_factory=Depends(get_session_factory),
 ):
     """
-    Загрузить картинку для твита.
+    Загрузить картинку для твита (поле формы file). Тело запроса
+    читается потоково без разбора формы FastAPI, размер файла
+    ограничен MAX_UPLOAD_SIZE, а формат (jpg, png, gif, webp)
+    определяется по содержимому. Уменьшенные копии для ленты создаются
+    в фоне после ответа.
 
     ### Parameters:
-    - **file**: `UploadFile` - Загружаемый файл.
+    - **request**: `Request` - Запрос с загружаемым файлом.
     - **session**: `AsyncSession` - Сессия с текущей
     базой данных.
     - **user_id**: `int` - id текущего пользователя, возвращёный
     из check_api_key
+    - **session_factory** - фабрика сессий для фоновой генерации
+    уменьшенных копий.
 
     ### Returns:
     - `Response` объект с успешным статусом и id загруженной картинки
@@ -173,33 +639,33 @@ async def add_new_media(
     if DOWNLOADS is not None:
         if not os.path.exists(DOWNLOADS):
             os.makedirs(DOWNLOADS)
-        if file:
-            # Используем временную метку для создания уникального имени файла
-            timestamp = datetime.now()
-            file_name = (
-                f"{file.filename.rsplit('.', 1)[0]}_{timestamp}."
-                f"{file.filename.rsplit('.', 1)[-1]}"
-            )
-            file_path = os.path.join(DOWNLOADS, file_name)
-            contents = await file.read()
-            await file.close()
-            async with aiofiles.open(file_path, "wb") as f:
-                await f.write(contents)
-            new_media = Media(file=file_name, uploader_id=user_id)
-            session.add(new_media)
-            await session.commit()
-            return {"result": True, "media_id": new_media.id}
+        upload = await receive_upload(request, DOWNLOADS)
+        # Одинаковые файлы хранятся один раз под именем sha256
+        media_id, file_name = await store_media(
+            session, upload, DOWNLOADS, user_id
+        )
+        await session.commit()
+        schedule_variants(
+            session_factory,
+            media_id,
+            file_name,
+            upload.checksum,
+            DOWNLOADS,
+        )
+        return {"result": True, "media_id": media_id}
     raise Exception("Can't add new media. Please check your data.")
 
 
-@app_api.delete("/tweets/{id}")
+@app_api.delete("/tweets/{id}", response_model=Result)
 async def delete_tweet(
         id: int,
         session: AsyncSession = Depends(get_db_session),
         user_id: int = Depends(check_api_key),
 ):
     """
-    Удалить свой твит вместе с вложенными файлами.
+    Удалить свой твит вместе с вложенными файлами. Картинки твита
+    только помечаются удалёнными, записи и файлы удаляет фоновая
+    очистка (api.reaper).
 
     ### Parameters:
     - **id**: `int` - ID твита, который нужно удалить.
@@ -212,32 +678,33 @@ async def delete_tweet(
     или неуспешным и сообщением об ошибке.
     """
 
-    attachments_ = await session.execute(
+    # Записи твита в лентах подписчиков (timeline) и его лайки вместе со
+    # счётчиком like_count удаляются каскадно
+    deleted_tweet = (
         delete(Tweets)
         .where((Tweets.author_id == user_id) & (id == Tweets.id))
         .returning(Tweets.id, Tweets.attachments)
+        .cte("deleted_tweet")
+    )
+    deleted_media = (
+        update(Media)
+        .where(Media.id == any_(deleted_tweet.c.attachments))
+        .values(deleted_at=func.now())
+        .returning(Media.id)
+        .cte("deleted_media")
+    )
+    deleted = await session.execute(
+        select(deleted_tweet.c.id, count_of(deleted_media))
     )
-    attachments = attachments_.all()
+    if deleted.first() is None:
+        raise Exception(
+            "Can't delete tweet. It's not yours or it's not exist."
+        )
     await session.commit()
-    if attachments[0][0]:
-        if attachments[0][1]:
-            names = await session.execute(
-                select(Media.file).where(Media.id.in_(attachments[0][1]))
-            )
-            await session.execute(
-                delete(Media).where(Media.id.in_(attachments[0][1]))
-            )
-            await session.commit()
-            for name in names.scalars():
-                if DOWNLOADS is not None:
-                    os.remove(os.path.join(DOWNLOADS, name))
-            return {"result": True}
-        return {"result": True}
-    else:
-        raise Exception("Can't delete tweet. " "It's not yours or it's not exist.")
+    return {"result": True}
 
 
-@app_api.post("/users/{id}/follow")
+@app_api.post("/users/{id}/follow", response_model=Result)
 async def follow(
         id: int,
         session: AsyncSession = Depends(get_db_session),
@@ -257,18 +724,68 @@ async def follow(
         - `Response` объект с успешным статусом
         или неуспешным и сообщением об ошибке.
     """
-    check_id = await session.execute(select(User).where(User.id == id))
-    if check_id.fetchall() and id != user_id:
-        insert_into_followers = insert(Followers).values(
-            followers_id=user_id, following_id=id
+    if id == user_id or id not in await lock_users(session, [id, user_id]):
+        raise Exception("Can't add new follow. Please check your data.")
+    followed = (
+        pg_insert(Followers)
+        .values(
+            followers_id=user_id,
+            following_id=id,
+            backfilled_from=backfill_boundary(id),
         )
-        await session.execute(insert_into_followers)
-        await session.commit()
-        return {"result": True}
-    raise Exception("Can't add new follow. Please check your data.")
+        .on_conflict_do_nothing()
+        .returning(Followers.following_id)
+        .cte("followed")
+    )
+    counted = (
+        update(User)
+        .where(User.id.in_([id, user_id]))
+        .where(exists(select(followed.c.following_id)))
+        .values(
+            followers_count=User.followers_count
+            + case((User.id == id, 1), else_=0),
+            following_count=User.following_count
+            + case((User.id == user_id, 1), else_=0),
+        )
+        .returning(User.id)
+        .cte("counted")
+    )
+    # Добавляем в ленту последние FOLLOW_BACKFILL_LIMIT разосланных
+    # твитов нового автора, более старые подмешиваются в ленту при
+    # чтении (Followers.backfilled_from)
+    backfilled = (
+        pg_insert(Timeline)
+        .from_select(
+            ["user_id", "tweet_id", "author_id"],
+            select(literal(user_id), Tweets.id, Tweets.author_id)
+            .join(followed, followed.c.following_id == Tweets.author_id)
+            .where(Tweets.fanned_out.is_(True))
+            .order_by(Tweets.id.desc())
+            .limit(FOLLOW_BACKFILL_LIMIT),
+        )
+        .on_conflict_do_nothing()
+        .returning(Timeline.tweet_id)
+        .cte("backfilled")
+    )
+    result = await session.execute(
+        select(
+            count_of(followed),
+            count_of(counted),
+            count_of(backfilled),
+            notify_profiles(id, user_id),
+        )
+    )
+    created, *_ = result.first()
+    if not created:
+        raise Exception(
+            "Can't add new follow. You're already following this user."
+        )
+    await session.commit()
+    invalidate_profiles(f"{id},{user_id}")
+    return {"result": True}
 
 
-@app_api.delete("/users/{id}/follow")
+@app_api.delete("/users/{id}/follow", response_model=Result)
 async def unfollow(
         id: int,
         session: AsyncSession = Depends(get_db_session),
@@ -289,17 +806,49 @@ async def unfollow(
     или неуспешным и сообщением об ошибке.
 
     """
-    await session.execute(
-        delete(Followers).where(
+    await lock_users(session, [id, user_id])
+    unfollowed = (
+        delete(Followers)
+        .where(
             (Followers.followers_id == user_id)
             & (Followers.following_id == id)
         )
+        .returning(Followers.following_id)
+        .cte("unfollowed")
+    )
+    counted = (
+        update(User)
+        .where(User.id.in_([id, user_id]))
+        .where(exists(select(unfollowed.c.following_id)))
+        .values(
+            followers_count=User.followers_count
+            - case((User.id == id, 1), else_=0),
+            following_count=User.following_count
+            - case((User.id == user_id, 1), else_=0),
+        )
+        .returning(User.id)
+        .cte("counted")
+    )
+    trimmed = (
+        delete(Timeline)
+        .where((Timeline.user_id == user_id) & (Timeline.author_id == id))
+        .returning(Timeline.tweet_id)
+        .cte("trimmed")
+    )
+    await session.execute(
+        select(
+            count_of(unfollowed),
+            count_of(counted),
+            count_of(trimmed),
+            notify_profiles(id, user_id),
+        )
     )
     await session.commit()
+    invalidate_profiles(f"{id},{user_id}")
     return {"result": True}
 
 
-@app_api.post("/tweets/{id}/likes")
+@app_api.post("/tweets/{id}/likes", response_model=Result)
 async def like(
         id: int,
         session: AsyncSession = Depends(get_db_session),
@@ -318,28 +867,39 @@ async def like(
         - `Response` объект с успешным статусом
         или неуспешным и сообщением об ошибке.
     """
-    result = await session.execute(
-        select(Tweets, Likes)
-        .outerjoin(
-            Likes,
-            and_(Likes.tweet_id == Tweets.id, Likes.likers_id == user_id),
+    target = select(Tweets.id).where(Tweets.id == id).cte("target")
+    liked = (
+        pg_insert(Likes)
+        .from_select(
+            ["tweet_id", "likers_id"], select(target.c.id, literal(user_id))
         )
-        .where(Tweets.id == id)
+        .on_conflict_do_nothing()
+        .returning(Likes.tweet_id)
+        .cte("liked")
     )
-    tweet, likes = result.first() or (None, None)
-
-    if tweet is None:
+    counted = (
+        update(Tweets)
+        .where(Tweets.id == liked.c.tweet_id)
+        .values(like_count=Tweets.like_count + 1)
+        .returning(Tweets.id, Tweets.author_id)
+        .cte("counted")
+    )
+    notified = select(
+        feed_event("like", counted.c.id, counted.c.author_id, user_id)
+    ).cte("notified")
+    result = await session.execute(
+        select(count_of(target), count_of(notified))
+    )
+    found, created = result.first()
+    if not found:
         raise Exception("Can't add like. Please check your data.")
-    if likes is not None:
+    if not created:
         raise Exception("Can't add like. You're already liked this tweet.")
-
-    insert_into_likes = insert(Likes).values(tweet_id=id, likers_id=user_id)
-    await session.execute(insert_into_likes)
     await session.commit()
     return {"result": True}
 
 
-@app_api.delete("/tweets/{id}/likes")
+@app_api.delete("/tweets/{id}/likes", response_model=Result)
 async def delete_like(
         id: int,
         session: AsyncSession = Depends(get_db_session),
@@ -357,180 +917,1000 @@ async def delete_like(
         - `Response` объект с успешным статусом
         или неуспешным и сообщением об ошибке.
     """
-    await session.execute(
-        delete(Likes).where(
-            (Likes.likers_id == user_id) & (Likes.tweet_id == id)
-        )
+    unliked = (
+        delete(Likes)
+        .where((Likes.likers_id == user_id) & (Likes.tweet_id == id))
+        .returning(Likes.tweet_id)
+        .cte("unliked")
+    )
+    counted = (
+        update(Tweets)
+        .where(Tweets.id == unliked.c.tweet_id)
+        .values(like_count=Tweets.like_count - 1)
+        .returning(Tweets.id)
+        .cte("counted")
     )
+    await session.execute(select(count_of(counted)))
     await session.commit()
     return {"result": True}
 
 
-@app_api.get("/tweets")
-async def feed(
+def check_batch_size(items: list):
+    if len(items) > BATCH_MAX_SIZE:
+        raise Exception(
+            f"Can't process batch. No more than {BATCH_MAX_SIZE} items."
+        )
+
+
+LIKE_EXISTS = "Can't add like. You're already liked this tweet."
+FOLLOW_EXISTS = "Can't add new follow. You're already following this user."
+
+
+def batch_results(
+        key: str, ids: list, created: set, errors: dict[int, str], exists: str
+) -> list:
+    """
+    Результаты пакетной операции в порядке запроса. Повторы одного id
+    в пакете обрабатываются один раз, остальные получают ошибку exists.
+
+    ### Parameters:
+        - **key**: `str` - имя поля с id в результате.
+        - **ids**: `list` - id из запроса.
+        - **created**: `set` - id, для которых запись создана.
+        - **errors**: `dict[int, str]` - ошибки по id.
+        - **exists**: `str` - ошибка для остальных id: запись уже есть.
+    """
+    results = []
+    done = set()
+    for item_id in ids:
+        if item_id in created and item_id not in done:
+            results.append({key: item_id, "result": True})
+        else:
+            error = errors.get(item_id, exists)
+            results.append(
+                {key: item_id, "result": False, "error_message": error}
+            )
+        done.add(item_id)
+    return results
+
+
+@app_api.post(
+    "/likes:batch",
+    response_model=LikesBatchResult,
+    response_model_exclude_unset=True,
+)
+async def like_batch(
+        data: LikesBatch,
         session: AsyncSession = Depends(get_db_session),
         user_id: int = Depends(check_api_key),
 ):
     """
-    Получить ленту из твитов отсортированных в
-    порядке убывания по популярности от пользователей, которых он
-    фоловит.
+    Лайкнуть несколько твитов за один запрос. Лайки вставляются одним
+    INSERT ... ON CONFLICT DO NOTHING вместе с обновлением like_count,
+    все изменения выполняются в одной транзакции.
 
+    ### Parameters:
+        - **data**: `LikesBatch` - ID твитов, не больше BATCH_MAX_SIZE.
+        - **session**: `AsyncSession` - Сессия с текущей базой данных.
+        - **user_id**: `int` - id текущего пользователя,
+        возвращёный из check_api_key
+
+    ### Returns:
+        - `Response` объект с успешным статусом и результатом для
+        каждого твита в порядке запроса, или неуспешным и сообщением
+        об ошибке.
+    """
+    check_batch_size(data.tweet_ids)
+    created: set = set()
+    if data.tweet_ids:
+        inserted = (
+            pg_insert(Likes)
+            .from_select(
+                ["tweet_id", "likers_id"],
+                select(Tweets.id, literal(user_id)).where(
+                    Tweets.id.in_(data.tweet_ids)
+                ),
+            )
+            .on_conflict_do_nothing()
+            .returning(Likes.tweet_id)
+            .cte("inserted")
+        )
+        counted = (
+            update(Tweets)
+            .where(Tweets.id == inserted.c.tweet_id)
+            .values(like_count=Tweets.like_count + 1)
+            .returning(Tweets.id, Tweets.author_id)
+            .cte("counted")
+        )
+        result = await session.execute(
+            select(
+                counted.c.id,
+                feed_event(
+                    "like", counted.c.id, counted.c.author_id, user_id
+                ),
+            )
+        )
+        created = set(result.scalars())
+    errors: dict[int, str] = {}
+    rest = set(data.tweet_ids) - created
+    if rest:
+        existing = await session.execute(
+            select(Tweets.id).where(Tweets.id.in_(rest))
+        )
+        for tweet_id in rest - set(existing.scalars()):
+            errors[tweet_id] = "Can't add like. Please check your data."
+    await session.commit()
+    return {
+        "result": True,
+        "results": batch_results(
+            "tweet_id", data.tweet_ids, created, errors, LIKE_EXISTS
+        ),
+    }
+
+
+@app_api.post(
+    "/follows:batch",
+    response_model=FollowsBatchResult,
+    response_model_exclude_unset=True,
+)
+async def follow_batch(
+        data: FollowsBatch,
+        session: AsyncSession = Depends(get_db_session),
+        user_id: int = Depends(check_api_key),
+):
+    """
+    Подписаться на несколько пользователей за один запрос. Подписки
+    вставляются одним INSERT ... ON CONFLICT DO NOTHING вместе с
+    обновлением счётчиков, потом в ленту добавляются разосланные твиты
+    новых авторов. Все изменения выполняются в одной транзакции.
 
     ### Parameters:
+        - **data**: `FollowsBatch` - ID пользователей, не больше
+        BATCH_MAX_SIZE.
         - **session**: `AsyncSession` - Сессия с текущей базой данных.
         - **user_id**: `int` - id текущего пользователя,
         возвращёный из check_api_key
 
     ### Returns:
-        - `Response` объект с успешным статусом и
-        json со списком твитов для ленты этого пользователя,
+        - `Response` объект с успешным статусом и результатом для
+        каждого пользователя в порядке запроса, или неуспешным и
+        сообщением об ошибке.
+    """
+    check_batch_size(data.user_ids)
+    created: set = set()
+    if data.user_ids:
+        await lock_users(session, [user_id, *data.user_ids])
+        inserted = (
+            pg_insert(Followers)
+            .from_select(
+                ["followers_id", "following_id", "backfilled_from"],
+                select(
+                    literal(user_id), User.id, backfill_boundary(User.id)
+                ).where(User.id.in_(data.user_ids), User.id != user_id),
+            )
+            .on_conflict_do_nothing()
+            .returning(Followers.following_id)
+            .cte("inserted")
+        )
+        counted = (
+            update(User)
+            .where(User.id == inserted.c.following_id)
+            .values(followers_count=User.followers_count + 1)
+            .returning(User.id)
+            .cte("counted")
+        )
+        result = await session.execute(select(counted.c.id))
+        created = set(result.scalars())
+    if created:
+        await session.execute(
+            update(User)
+            .where(User.id == user_id)
+            .values(following_count=User.following_count + len(created))
+        )
+        await session.execute(select(notify_profiles(user_id, *created)))
+        authors = select(User.id).where(User.id.in_(created)).subquery()
+        recent = (
+            select(Tweets.id, Tweets.author_id)
+            .where(
+                Tweets.author_id == authors.c.id, Tweets.fanned_out.is_(True)
+            )
+            .order_by(Tweets.id.desc())
+            .limit(FOLLOW_BACKFILL_LIMIT)
+            .lateral("recent")
+        )
+        await session.execute(
+            pg_insert(Timeline)
+            .from_select(
+                ["user_id", "tweet_id", "author_id"],
+                select(literal(user_id), recent.c.id, recent.c.author_id)
+                .select_from(authors)
+                .join(recent, true()),
+            )
+            .on_conflict_do_nothing()
+        )
+    errors: dict[int, str] = {}
+    rest = set(data.user_ids) - created
+    if rest:
+        existing = await session.execute(
+            select(User.id).where(User.id.in_(rest), User.id != user_id)
+        )
+        for following_id in rest - set(existing.scalars()):
+            errors[following_id] = (
+                "Can't add new follow. Please check your data."
+            )
+    await session.commit()
+    if created:
+        invalidate_profiles(",".join(map(str, [user_id, *created])))
+    return {
+        "result": True,
+        "results": batch_results(
+            "user_id", data.user_ids, created, errors, FOLLOW_EXISTS
+        ),
+    }
+
+
+@app_api.post(
+    "/tweets:batch",
+    response_model=TweetsBatchResult,
+    response_model_exclude_unset=True,
+)
+async def add_new_tweet_batch(
+        data: TweetsBatch,
+        session: AsyncSession = Depends(get_db_session),
+        user_id: int = Depends(check_api_key),
+):
+    """
+    Добавить несколько твитов за один запрос. Твиты вставляются одним
+    многострочным INSERT, рассылка по лентам подписчиков - одним
+    INSERT ... SELECT, все изменения выполняются в одной транзакции.
+    Твит, у которого есть чужие или несуществующие картинки, не
+    добавляется, остальные твиты пакета добавляются.
+
+    ### Parameters:
+        - **data**: `TweetsBatch` - твиты, не больше BATCH_MAX_SIZE.
+        - **session**: `AsyncSession` - Сессия с текущей базой данных.
+        - **user_id**: `int` - id текущего пользователя,
+        возвращёный из check_api_key
+
+    ### Returns:
+        - `Response` объект с успешным статусом и результатом для
+        каждого твита в порядке запроса (с tweet_id добавленного твита),
         или неуспешным и сообщением об ошибке.
     """
+    check_batch_size(data.tweets)
+    media_ids = {
+        media_id
+        for tweet in data.tweets
+        for media_id in tweet.tweet_media_ids or []
+    }
+    valid_media: set = set()
+    if media_ids:
+        # Блокируем картинки, чтобы фоновая очистка не удалила их до
+        # commit
+        result = await session.execute(
+            select(Media.id)
+            .where(
+                Media.id.in_(media_ids),
+                Media.uploader_id == user_id,
+                Media.deleted_at.is_(None),
+            )
+            .with_for_update()
+        )
+        valid_media = set(result.scalars())
+    valid = [
+        tweet
+        for tweet in data.tweets
+        if valid_media.issuperset(tweet.tweet_media_ids or [])
+    ]
+    tweet_ids: list = []
+    if valid:
+        attached = {m for tweet in valid for m in tweet.tweet_media_ids or []}
+        if attached:
+            await session.execute(
+                update(Media)
+                .where(Media.id.in_(attached))
+                .values(attached=True)
+                .execution_options(synchronize_session=False)
+            )
+        followers_count = (
+            await lock_users(session, [user_id], share=True)
+        )[user_id]
+        # Порядок строк RETURNING не гарантирован, поэтому id выдаются
+        # заранее (nextval) рядом с номером твита в пакете, и результат
+        # сопоставляется с пакетом по этому номеру. Типы параметров
+        # VALUES указаны явно: без них asyncpg считает их текстом
+        batch = values(
+            column("ord", Integer),
+            column("content", String),
+            column("attachments", ARRAY(Integer)),
+            name="batch",
+        ).data(
+            [
+                (
+                    cast(literal(index), Integer),
+                    tweet.tweet_data,
+                    cast(literal(tweet.tweet_media_ids or []), ARRAY(Integer)),
+                )
+                for index, tweet in enumerate(valid)
+            ]
+        )
+        numbered = select(
+            batch.c.ord,
+            func.nextval(func.pg_get_serial_sequence("tweets", "id")).label(
+                "id"
+            ),
+            batch.c.content,
+            batch.c.attachments,
+        ).cte("numbered")
+        inserted = (
+            insert(Tweets)
+            .from_select(
+                [
+                    "id",
+                    "content",
+                    "attachments",
+                    "author_id",
+                    "fanned_out",
+                    "author_rank",
+                ],
+                select(
+                    numbered.c.id,
+                    numbered.c.content,
+                    numbered.c.attachments,
+                    literal(user_id),
+                    literal(followers_count < FANOUT_THRESHOLD),
+                    literal(followers_count),
+                ),
+            )
+            .returning(Tweets.id, Tweets.fanned_out)
+            .cte("inserted")
+        )
+        result = await session.execute(
+            select(numbered.c.ord, inserted.c.id, inserted.c.fanned_out)
+            .join(numbered, numbered.c.id == inserted.c.id)
+            .order_by(numbered.c.ord)
+        )
+        rows = result.all()
+        tweet_ids = [row.id for row in rows]
+        if rows[0].fanned_out:
+            await session.execute(
+                insert(Timeline).from_select(
+                    ["user_id", "tweet_id", "author_id"],
+                    select(Followers.followers_id, Tweets.id, Tweets.author_id)
+                    .join(Tweets, Tweets.id.in_(tweet_ids))
+                    .where(Followers.following_id == user_id),
+                )
+            )
+        await session.execute(
+            select(
+                feed_event("tweet", Tweets.id, Tweets.author_id)
+            ).where(Tweets.id.in_(tweet_ids))
+        )
+    await session.commit()
+
+    new_ids = iter(tweet_ids)
+    results = []
+    for tweet in data.tweets:
+        if valid_media.issuperset(tweet.tweet_media_ids or []):
+            results.append({"result": True, "tweet_id": next(new_ids)})
+        else:
+            results.append(
+                {
+                    "result": False,
+                    "error_message": (
+                        "Can't add new tweet. Please check your data."
+                    ),
+                }
+            )
+    return {"result": True, "results": results}
+
+
+def attachment_variants(
+        file: str, checksum: str | None, status: str | None, downloads: str
+) -> dict:
+    """
+    Пути к уменьшенным копиям вложения по ширинам. Пока копии не готовы
+    или если их не удалось сделать, для всех ширин отдаётся исходный
+    файл. downloads - папка с файлами (DOWNLOADS).
+    """
+    if status == VARIANTS_READY and checksum is not None:
+        names = variant_files(checksum)
+    else:
+        names = dict.fromkeys(variant_files(""), file)
+    return {
+        str(width): os.path.join(downloads, name)
+        for width, name in names.items()
+    }
+
+
+async def tweets_by_ids(session: AsyncSession, tweet_ids: list) -> list:
+    """
+    Собирает твиты для выдачи клиенту в том порядке, в котором
+    переданы их id. Вложения и лайки агрегируются в базе (LATERAL
+    подзапросы с array_agg/json_agg), поэтому на каждый твит приходит
+    ровно одна строка. Для каждого вложения в attachment_variants
+    отдаются пути к его уменьшенным копиям.
+
+    ### Parameters:
+        - **session**: `AsyncSession` - Сессия с текущей базой данных.
+        - **tweet_ids**: `list` - id твитов.
+
+    ### Returns:
+        - `list` со словарями твитов.
+    """
+    if DOWNLOADS is None:
+        raise Exception('Check DOWNLOADS in .env')
+    if not tweet_ids:
+        return []
     author = aliased(User, name="user_1")
     liker = aliased(User, name="user_2")
 
-    followers_count = func.count(Followers.followers_id).over(
-        partition_by=Tweets.author_id
+    def media_array(column):
+        return func.array_agg(aggregate_order_by(column, Media.id))
+
+    files = (
+        select(
+            media_array(Media.file).label("files"),
+            media_array(Media.checksum).label("checksums"),
+            media_array(Media.variants_status).label("statuses"),
+        )
+        .where(Media.id == any_(Tweets.attachments))
+        .lateral("tweet_media")
     )
-    is_author_subscriber = and_(
-        Tweets.author_id == Followers.following_id,
-        user_id == Followers.followers_id,
+    like = func.json_build_object(
+        "user_id", Likes.likers_id, "name", liker.name
     )
-    sort_condition = case([(is_author_subscriber, followers_count)], else_=0)
-
-    secondary_sort_condition = case(
-        [(is_author_subscriber, Tweets.id)], else_=0
+    like_list = func.json_agg(
+        aggregate_order_by(like, Likes.likers_id), type_=JSON
     )
-
-    third_sort_condition = case(
-        [(is_author_subscriber, 0)], else_=Tweets.id
+    likes = (
+        select(like_list.label("likes"))
+        .join(liker, liker.id == Likes.likers_id)
+        .where(Likes.tweet_id == Tweets.id)
+        .lateral("tweet_likes")
     )
-
-    complex_query = await session.execute(
+    rows = await session.execute(
         select(
             Tweets.id,
             Tweets.content,
-            Tweets.attachments,
             Tweets.author_id,
             author.name.label("author_name"),
-            Media.file,
-            Likes.likers_id,
-            liker.name.label("liker_name"),
-            followers_count,
-        )
-        .outerjoin(Media, Media.id == any_(Tweets.attachments))
-        .outerjoin(Likes, Likes.tweet_id == Tweets.id)
-        .outerjoin(author, author.id == Tweets.author_id)
-        .outerjoin(liker, liker.id == Likes.likers_id)
-        .outerjoin(Followers, Followers.following_id == Tweets.author_id)
-        .group_by(
-            Tweets.id,
-            author.name,
-            Media.file,
-            Likes.likers_id,
-            liker.name,
-            Followers.followers_id,
-            Followers.following_id,
-            Media.id,
-        )
-        .order_by(
-            sort_condition.desc(),
-            secondary_sort_condition.desc(),
-            third_sort_condition.desc(),
-            Media.id.asc(),
-        )
-    )
-    complex_data = complex_query.fetchall()
-
-    tweets_result = {}
-    for data in complex_data:
-        tweet_id = data[0]
-        if tweet_id not in tweets_result:
-            tweets_result[tweet_id] = {
-                "id": tweet_id,
-                "content": data[1],
-                "attachments": set(),
-                "author": {"id": data[3], "name": data[4]},
-                "likes": set(),
-            }
-        if DOWNLOADS is not None:
-            if data[5]:
-                tweets_result[tweet_id]["attachments"].add(
-                    os.path.join(DOWNLOADS, data[5])
+            files.c.files,
+            files.c.checksums,
+            files.c.statuses,
+            likes.c.likes,
+        )
+        .join(author, author.id == Tweets.author_id)
+        .join(files, true())
+        .join(likes, true())
+        .where(Tweets.id.in_(tweet_ids))
+    )
+    tweets = {
+        row.id: {
+            "id": row.id,
+            "content": row.content,
+            "attachments": [
+                os.path.join(DOWNLOADS, file) for file in row.files or []
+            ],
+            "attachment_variants": [
+                attachment_variants(file, checksum, status, DOWNLOADS)
+                for file, checksum, status in zip(
+                    row.files or [], row.checksums or [], row.statuses or []
                 )
-        else:
-            raise Exception('Check DOWNLOADS in .env')
-        if data[6]:
-            tweets_result[tweet_id]["likes"].add((data[6], data[7]))
-    for tweet_id, tweet_data in tweets_result.items():
-        tweet_data["attachments"] = list(tweet_data["attachments"])
-        tweet_data["likes"] = [
-            {"user_id": user_id, "name": name}
-            for user_id, name in tweet_data["likes"]
-        ]
-
-    result = {"result": True, "tweets": list(tweets_result.values())}
+            ],
+            "author": {"id": row.author_id, "name": row.author_name},
+            "likes": row.likes or [],
+        }
+        for row in rows
+    }
+    return [tweets[tweet_id] for tweet_id in tweet_ids if tweet_id in tweets]
+
+
+def feed_page_query(user_id: int, limit: int, position: tuple | None):
+    """
+    Строит запрос страницы ленты из твитов авторов, на которых подписан
+    пользователь: id твитов и их ранг.
+
+    ### Parameters:
+        - **user_id**: `int` - id пользователя, для которого строится лента.
+        - **limit**: `int` - сколько твитов выбрать.
+        - **position**: `tuple | None` - ключ (rank, id) последнего твита
+        предыдущей страницы.
+
+    ### Returns:
+        - `Select` запрос.
+    """
+    # Твиты авторов, на которых подписан пользователь, ранжируются по
+    # количеству подписчиков автора на момент публикации
+    # (Tweets.author_rank). Ранг твита не меняется при подписках и
+    # отписках, поэтому пара (rank, id) однозначно задаёт порядок между
+    # запросами страниц и служит ключом курсора.
+    # Разосланные твиты берутся из timeline. Из tweets подмешиваются
+    # твиты популярных авторов, которые не рассылались, и разосланные
+    # до подписки твиты, которые не добавлялись в ленту при подписке
+    home = union_all(
+        select(Tweets.id, Tweets.author_rank)
+        .join(Timeline, Timeline.tweet_id == Tweets.id)
+        .where(Timeline.user_id == user_id),
+        select(Tweets.id, Tweets.author_rank)
+        .join(Followers, Followers.following_id == Tweets.author_id)
+        .where(
+            Followers.followers_id == user_id,
+            or_(
+                Tweets.fanned_out.is_(False),
+                Tweets.id < Followers.backfilled_from,
+            ),
+        ),
+    ).subquery()
+
+    page_query = select(home.c.id, home.c.author_rank.label("rank"))
+    if position is not None:
+        page_query = page_query.where(
+            tuple_(home.c.author_rank, home.c.id) < tuple_(*position)
+        )
+    return page_query.order_by(
+        home.c.author_rank.desc(), home.c.id.desc()
+    ).limit(limit)
+
+
+def feed_rest_query(user_id: int, limit: int, before_id: int | None):
+    """
+    Строит запрос страницы остальных твитов ленты (ранг FEED_REST_RANK),
+    которые идут после твитов подписок: твиты авторов, на которых
+    пользователь не подписан, от новых к старым.
+
+    ### Parameters:
+        - **user_id**: `int` - id пользователя, для которого строится лента.
+        - **limit**: `int` - сколько твитов выбрать.
+        - **before_id**: `int | None` - id последнего из остальных твитов
+        предыдущей страницы.
+
+    ### Returns:
+        - `Select` запрос.
+    """
+    # Твиты читаются с конца первичного ключа, и чтение заканчивается
+    # на limit подходящих твитах, а не сортирует всю таблицу
+    is_author_subscriber = exists().where(
+        Followers.following_id == Tweets.author_id,
+        Followers.followers_id == user_id,
+    )
+    page_query = select(
+        Tweets.id, literal(FEED_REST_RANK).label("rank")
+    ).where(~is_author_subscriber)
+    if before_id is not None:
+        page_query = page_query.where(Tweets.id < before_id)
+    return page_query.order_by(Tweets.id.desc()).limit(limit)
+
+
+@app_api.get("/tweets", response_model=Feed)
+async def feed(
+        limit: int = Query(FEED_PAGE_SIZE, ge=1, le=FEED_MAX_PAGE_SIZE),
+        cursor: str | None = None,
+        session: AsyncSession = Depends(get_read_session),
+        user_id: int = Depends(check_api_key),
+):
+    """
+    Получить ленту из твитов отсортированных в
+    порядке убывания по популярности от пользователей, которых он
+    фоловит.
+
+
+    ### Parameters:
+        - **limit**: `int` - максимальное количество твитов на странице.
+        - **cursor**: `str | None` - курсор из `next_cursor` предыдущей
+        страницы, без него возвращается первая страница.
+        - **session**: `AsyncSession` - Сессия с текущей базой данных.
+        - **user_id**: `int` - id текущего пользователя,
+        возвращёный из check_api_key
+
+    ### Returns:
+        - `Response` объект с успешным статусом,
+        json со списком твитов для ленты этого пользователя и курсором
+        следующей страницы (`None`, если страница последняя),
+        или неуспешным и сообщением об ошибке.
+    """
+    if DOWNLOADS is None:
+        raise Exception('Check DOWNLOADS in .env')
+
+    position = decode_cursor(cursor, 2) if cursor is not None else None
+    # Сначала страница твитов подписок, а когда они заканчиваются -
+    # остальные твиты (ранг FEED_REST_RANK) отдельным запросом
+    page: list = []
+    if position is None or position[0] > FEED_REST_RANK:
+        page_query = feed_page_query(user_id, limit + 1, position)
+        page = (await session.execute(page_query)).fetchall()
+    if len(page) <= limit:
+        before_id = None
+        if position is not None and position[0] <= FEED_REST_RANK:
+            before_id = position[1]
+        rest_query = feed_rest_query(user_id, limit + 1 - len(page), before_id)
+        page += (await session.execute(rest_query)).fetchall()
+
+    next_cursor = None
+    if len(page) > limit:
+        page = page[:limit]
+        next_cursor = encode_cursor(page[-1].rank, page[-1].id)
+    page_ids = [row.id for row in page]
+
+    result = {
+        "result": True,
+        "tweets": await tweets_by_ids(session, page_ids),
+        "next_cursor": next_cursor,
+    }
     return result
 
 
-async def info_user(user_id: int, session: AsyncSession):
+def follows_page_query(
+        user_id: int,
+        direction: str,
+        limit: int,
+        position: tuple | None,
+):
+    """
+    Строит запрос страницы подписчиков или подписок пользователя.
+
+    ### Parameters:
+        - **user_id**: `int` - id пользователя, чей профиль запрошен.
+        - **direction**: `str` - "followers" или "following".
+        - **limit**: `int` - сколько пользователей выбрать.
+        - **position**: `tuple | None` - ключ (id,) последнего
+        пользователя предыдущей страницы.
+
+    ### Returns:
+        - `Select` запрос.
+    """
+    # Подписчики берутся по индексу ix_followers_following
+    # (following_id, followers_id), подписки - по первичному ключу
+    # (followers_id, following_id), страницы идут по возрастанию id
+    if direction == "followers":
+        owner, other = Followers.following_id, Followers.followers_id
+    else:
+        owner, other = Followers.followers_id, Followers.following_id
+    page_query = (
+        select(other.label("id"), User.name)
+        .join(User, User.id == other)
+        .where(owner == user_id)
+    )
+    if position is not None:
+        page_query = page_query.where(other > position[0])
+    return page_query.order_by(other).limit(limit)
+
+
+def profile_query(
+        user_id: int,
+        followers_limit: int,
+        followers_position: tuple | None,
+        following_limit: int,
+        following_position: tuple | None,
+):
+    """
+    Строит запрос профиля: строку пользователя со счётчиками и страницы
+    его подписчиков и подписок, соединённые UNION ALL. Так профиль
+    выбирается одним запросом в соединении запроса и не занимает
+    дополнительные соединения из пула.
+
+    ### Returns:
+        - `Select` запрос со строками (kind, id, name, followers_count,
+        following_count), kind - "user", "followers" или "following".
+    """
+    parts = [
+        select(
+            literal("user").label("kind"),
+            User.id,
+            User.name,
+            User.followers_count,
+            User.following_count,
+        ).where(User.id == user_id)
+    ]
+    for direction, limit, position in (
+            ("followers", followers_limit, followers_position),
+            ("following", following_limit, following_position),
+    ):
+        page = follows_page_query(
+            user_id, direction, limit, position
+        ).subquery(direction)
+        parts.append(
+            select(
+                literal(direction), page.c.id, page.c.name, null(), null()
+            )
+        )
+    return union_all(*parts)
+
+
+def follows_page(rows: list, limit: int) -> tuple:
+    """
+    ### Returns:
+        - `tuple` со страницей пользователей из строк profile_query
+        и курсором следующей страницы (`None`, если страница последняя).
+    """
+    # UNION ALL не обязан сохранять порядок строк частей
+    page = sorted(rows, key=lambda row: row.id)
+    next_cursor = None
+    if len(page) > limit:
+        page = page[:limit]
+        next_cursor = encode_cursor(page[-1].id)
+    return [{"id": row.id, "name": row.name} for row in page], next_cursor
+
+
+async def info_user(
+        user_id: int,
+        session: AsyncSession,
+        followers_cursor: str | None = None,
+        following_cursor: str | None = None,
+        followers_limit: int = FOLLOWS_PAGE_SIZE,
+        following_limit: int = FOLLOWS_PAGE_SIZE,
+):
     """
     т.к /users/me и /users/{id} запрашивают примерно одни и те же данные,
     просто /me запрашивает по id текущего пользователя, а  /{id} по id
     другого пльзователя, то можно использовать одну функцию
-    для обработки таких запросов.
+    для обработки таких запросов. Профиль, подписчики и подписки
+    выбираются одним запросом (profile_query), списки отдаются
+    страницами, а полное количество берётся из счётчиков. Первая страница
+    с размером по умолчанию кэшируется в profile_cache.
     """
-    User_ = aliased(User, name="user_3")
-    Follower = aliased(User, name="user_4")
-    Following = aliased(User, name="user_5")
+    first_page = (
+        followers_cursor is None
+        and following_cursor is None
+        and followers_limit == following_limit == FOLLOWS_PAGE_SIZE
+    )
+    if first_page:
+        cached = profile_cache.get(user_id)
+        if cached is not MISSING:
+            return cached
+    # Если профиль сбросили, пока шёл запрос, результат может быть
+    # устаревшим, и в кэш он не попадает
+    generation = profile_generation[0]
+    followers_position = following_position = None
+    if followers_cursor is not None:
+        followers_position = decode_cursor(followers_cursor, 1)
+    if following_cursor is not None:
+        following_position = decode_cursor(following_cursor, 1)
     result = await session.execute(
-        select(
-            User_.name.label("user_name"),
-            Followers.following_id,
-            Follower.name.label("following_name"),
-            Followers.followers_id,
-            Following.name.label("followers_name"),
-        )
-        .select_from(User_)
-        .outerjoin(
-            Followers,
-            or_(
-                User_.id == Followers.followers_id,
-                User_.id == Followers.following_id,
-            ),
+        profile_query(
+            user_id,
+            followers_limit + 1,
+            followers_position,
+            following_limit + 1,
+            following_position,
         )
-        .outerjoin(Follower, Followers.following_id == Follower.id)
-        .outerjoin(Following, Followers.followers_id == Following.id)
-        .where(User_.id == user_id)
-    )
-    rows = result.fetchall()
-    if rows:
-        user_info_def: dict = {
-            "result": True,
-            "user": {
-                "id": user_id,
-                "name": rows[0]["user_name"],
-                "followers": [],
-                "following": [],
-            },
-        }
-        for row in rows:
-            if row["following_id"] and row["following_id"] != user_id:
-                user_info_def["user"]["following"].append(
-                    {"id": row["following_id"], "name": row["following_name"]}
-                )
-            if row["followers_id"] and row["followers_id"] != user_id:
-                user_info_def["user"]["followers"].append(
-                    {"id": row["followers_id"], "name": row["followers_name"]}
-                )
-        return user_info_def
-    return False
+    )
+    rows: dict = {"user": [], "followers": [], "following": []}
+    for row in result:
+        rows[row.kind].append(row)
+    if not rows["user"]:
+        return False
+    row = rows["user"][0]
+    followers, followers_next = follows_page(
+        rows["followers"], followers_limit
+    )
+    following, following_next = follows_page(
+        rows["following"], following_limit
+    )
+    user_info_def: dict = {
+        "result": True,
+        "user": {
+            "id": user_id,
+            "name": row.name,
+            "followers": followers,
+            "following": following,
+            "followers_count": row.followers_count,
+            "following_count": row.following_count,
+        },
+        "followers_next_cursor": followers_next,
+        "following_next_cursor": following_next,
+    }
+    # Реплика может ещё не получить изменение, из-за которого профиль
+    # сбросили, поэтому в кэш попадают только чтения с основной базы
+    if (
+        first_page
+        and not session.info.get("replica")
+        and generation == profile_generation[0]
+    ):
+        profile_cache.set(user_id, user_info_def)
+    return user_info_def
+
+
+def search_condition(query: str):
+    """Условие WHERE: текст твита подходит под запрос query
+    в синтаксисе websearch_to_tsquery."""
+    ts_query = func.websearch_to_tsquery(
+        literal_column(f"'{SEARCH_CONFIG}'::regconfig"), query
+    )
+    return Tweets.search.op("@@")(ts_query)
+
+
+def search_page_query(
+        query: str,
+        limit: int,
+        position: tuple | None,
+        window: int = SEARCH_RANK_WINDOW,
+):
+    """
+    Строит запрос страницы поиска по тексту твитов: id найденных твитов
+    и их релевантность.
+
+    ### Parameters:
+        - **query**: `str` - поисковый запрос в синтаксисе
+        websearch_to_tsquery: слова, "фраза в кавычках", -исключение, or.
+        - **limit**: `int` - сколько твитов выбрать.
+        - **position**: `tuple | None` - ключ (rank, id) последнего твита
+        предыдущей страницы.
+        - **window**: `int` - среди скольких самых новых найденных твитов
+        ранжировать.
+
+    ### Returns:
+        - `Select` запрос.
+    """
+    # Редкие слова находятся по GIN-индексу ix_tweets_search. Слово,
+    # которое есть в большой доле твитов, дешевле искать, читая твиты
+    # с конца первичного ключа. В обоих случаях ts_rank считается только
+    # для window самых новых найденных твитов, а не для всех. Пара
+    # (rank, id) задаёт порядок и служит ключом курсора.
+    ts_query = func.websearch_to_tsquery(
+        literal_column(f"'{SEARCH_CONFIG}'::regconfig"), query
+    )
+    matches = (
+        select(Tweets.id, Tweets.search)
+        .where(search_condition(query))
+        .order_by(Tweets.id.desc())
+        .limit(window)
+        .subquery("matches")
+    )
+    rank = func.ts_rank(matches.c.search, ts_query)
+    page_query = select(matches.c.id, rank.label("rank"))
+    if position is not None:
+        page_query = page_query.where(
+            tuple_(rank, matches.c.id) < tuple_(*position)
+        )
+    return page_query.order_by(rank.desc(), matches.c.id.desc()).limit(
+        limit
+    )
+
 
+def search_truncated_query(query: str, window: int = SEARCH_RANK_WINDOW):
+    """
+    Строит запрос, который проверяет, есть ли совпадения старше window
+    самых новых, то есть не попавшие в выдачу search_page_query.
+
+    ### Returns:
+        - `Select` запрос, который возвращает строку, если такие
+        совпадения есть.
+    """
+    return (
+        select(Tweets.id)
+        .where(search_condition(query))
+        .order_by(Tweets.id.desc())
+        .offset(window)
+        .limit(1)
+    )
+
+
+@app_api.get("/tweets/search", response_model=SearchFeed)
+async def search_tweets(
+        q: str = Query(..., min_length=1, max_length=SEARCH_MAX_LENGTH),
+        limit: int = Query(FEED_PAGE_SIZE, ge=1, le=FEED_MAX_PAGE_SIZE),
+        cursor: str | None = None,
+        session: AsyncSession = Depends(get_read_session),
+        user_id: int = Depends(check_api_key),
+):
+    """
+    Найти твиты по тексту. Твиты отсортированы по убыванию
+    релевантности и отдаются в том же виде, что и в ленте. Ранжируются
+    и выдаются только SEARCH_RANK_WINDOW самых новых совпадений: если
+    совпадений больше, на последней странице truncated - `True`.
+
+    ### Parameters:
+        - **q**: `str` - поисковый запрос: слова, "фраза в кавычках",
+        -слово для исключения, or между вариантами.
+        - **limit**: `int` - размер страницы.
+        - **cursor**: `str | None` - курсор из `next_cursor`
+        предыдущего ответа.
+        - **session**: `AsyncSession` - Сессия с текущей базой данных.
+        - **user_id**: `int` - id текущего пользователя,
+        возвращёный из check_api_key
+
+    ### Returns:
+        - `Response` объект с успешным статусом,
+        json со списком найденных твитов, курсором следующей страницы
+        (`None`, если страница последняя) и признаком truncated,
+        или неуспешным и сообщением об ошибке.
+    """
+    if DOWNLOADS is None:
+        raise Exception('Check DOWNLOADS in .env')
+
+    position = decode_cursor(cursor, 2) if cursor is not None else None
+    page_query = search_page_query(
+        q, limit + 1, position, SEARCH_RANK_WINDOW
+    )
+    page = (await session.execute(page_query)).fetchall()
+
+    next_cursor = None
+    truncated = False
+    if len(page) > limit:
+        page = page[:limit]
+        next_cursor = encode_cursor(page[-1].rank, page[-1].id)
+    else:
+        # Страниц в окне больше нет: проверяем, остались ли совпадения
+        # за окном. Запрос выполняется только на последней странице
+        older = await session.execute(
+            search_truncated_query(q, SEARCH_RANK_WINDOW)
+        )
+        truncated = older.first() is not None
 
-@app_api.get("/users/me")
+    return {
+        "result": True,
+        "tweets": await tweets_by_ids(session, [row.id for row in page]),
+        "next_cursor": next_cursor,
+        "truncated": truncated,
+    }
+
+
+async def following_of(session_factory, user_id: int) -> set:
+    async with session_factory() as session:
+        result = await session.execute(
+            select(Followers.following_id).where(
+                Followers.followers_id == user_id
+            )
+        )
+        return set(result.scalars())
+
+
+@app_api.get("/tweets/stream", response_class=StreamingResponse)
+async def feed_stream(
+        last_event_id: str | None = Header(None),
+        user_id: int = Depends(check_api_key),
+        session_factory=Depends(get_session_factory),
+):
+    """
+    Поток новых событий ленты (Server-Sent Events): твиты и лайки твитов
+    авторов, на которых подписан пользователь, и его собственных.
+    События приходят из NOTIFY в FEED_CHANNEL, соединение с базой
+    на время потока не занимается.
+
+    ### Parameters:
+        - **last_event_id**: `str | None` - заголовок Last-Event-ID,
+        который браузер отправляет при переподключении. События после
+        него отправляются сразу, если воркер их помнит, иначе клиент
+        получает событие reset и должен перечитать ленту.
+        - **user_id**: `int` - id текущего пользователя,
+        возвращёный из check_api_key
+        - **session_factory** - фабрика сессий для чтения подписок.
+
+    ### Returns:
+        - `StreamingResponse` с событиями tweet, like и reset
+        и комментариями-пингами.
+    """
+    following = await following_of(session_factory, user_id)
+    # Подписка и выборка пропущенных событий без await между ними,
+    # чтобы событие не попало ни туда, ни туда или в оба места
+    subscriber = feed_broker.subscribe(user_id, following)
+    missed: list | None = []
+    if last_event_id is not None:
+        missed = feed_broker.replay(subscriber, last_event_id)
+    return StreamingResponse(
+        event_stream(
+            feed_broker,
+            subscriber,
+            missed,
+            lambda: following_of(session_factory, user_id),
+        ),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app_api.get("/users/me", response_model=Profile)
 async def user_info(
-        session: AsyncSession = Depends(get_db_session),
+        followers_cursor: str | None = None,
+        following_cursor: str | None = None,
+        followers_limit: int = Query(
+            FOLLOWS_PAGE_SIZE, ge=1, le=FOLLOWS_MAX_PAGE_SIZE
+        ),
+        following_limit: int = Query(
+            FOLLOWS_PAGE_SIZE, ge=1, le=FOLLOWS_MAX_PAGE_SIZE
+        ),
+        session: AsyncSession = Depends(get_read_session),
         user_id: int = Depends(check_api_key),
 ):
     """
@@ -538,22 +1918,44 @@ async def user_info(
 
 
     ### Parameters:
+        - **followers_cursor**: `str | None` - курсор из
+        `followers_next_cursor` предыдущего ответа.
+        - **following_cursor**: `str | None` - курсор из
+        `following_next_cursor` предыдущего ответа.
+        - **followers_limit**: `int` - размер страницы подписчиков.
+        - **following_limit**: `int` - размер страницы подписок.
         - **session**: `AsyncSession` - Сессия с текущей базой данных.
         - **user_id**: `int` - id текущего пользователя,
         возвращёный из check_api_key
 
     ### Returns:
         - `Response` объект с успешным статусом и
-        json с информацией о текущем пользователе,
+        json с информацией о текущем пользователе и курсорами следующих
+        страниц подписчиков и подписок,
         или неуспешным и сообщением об ошибке.
     """
-    return await info_user(user_id, session)
+    return await info_user(
+        user_id,
+        session,
+        followers_cursor,
+        following_cursor,
+        followers_limit,
+        following_limit,
+    )
 
 
-@app_api.get("/users/{id}")
+@app_api.get("/users/{id}", response_model=Profile)
 async def other_user_info(
         id: int,
-        session: AsyncSession = Depends(get_db_session),
+        followers_cursor: str | None = None,
+        following_cursor: str | None = None,
+        followers_limit: int = Query(
+            FOLLOWS_PAGE_SIZE, ge=1, le=FOLLOWS_MAX_PAGE_SIZE
+        ),
+        following_limit: int = Query(
+            FOLLOWS_PAGE_SIZE, ge=1, le=FOLLOWS_MAX_PAGE_SIZE
+        ),
+        session: AsyncSession = Depends(get_read_session),
         user_id: int = Depends(check_api_key),
 ):
     """
@@ -563,16 +1965,30 @@ async def other_user_info(
     ### Parameters:
          - **id**: `int` - ID пользователя, информацию о котором
          текущий пользователь хочет просмотреть.
+        - **followers_cursor**: `str | None` - курсор из
+        `followers_next_cursor` предыдущего ответа.
+        - **following_cursor**: `str | None` - курсор из
+        `following_next_cursor` предыдущего ответа.
+        - **followers_limit**: `int` - размер страницы подписчиков.
+        - **following_limit**: `int` - размер страницы подписок.
         - **session**: `AsyncSession` - Сессия с текущей базой данных.
         - **user_id**: `int` - id текущего пользователя,
         возвращёный из check_api_key
 
     ### Returns:
         - `Response` объект с успешным статусом и
-        json с информацией о другом пользователе,
+        json с информацией о другом пользователе и курсорами следующих
+        страниц подписчиков и подписок,
         или неуспешным и сообщением об ошибке.
     """
-    res = await info_user(id, session)
+    res = await info_user(
+        id,
+        session,
+        followers_cursor,
+        following_cursor,
+        followers_limit,
+        following_limit,
+    )
     if res:
         return res
     raise Exception("Can't show users info. Please check your data.")
@@ -0,0 +1,127 @@
+import os
+from typing import Any
+
+from pydantic import BaseModel, ConfigDict, Field, ValidationError
+from sqlalchemy.engine import URL
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.pool import NullPool
+
+
+class DatabaseSettings(BaseModel):
+    """
+    Настройки подключения к базе и пула соединений. Значения берутся
+    из переменных окружения с префиксом (DB_, TEST_DB_) и проверяются
+    при импорте models, то есть до запуска воркера.
+
+    ### Parameters:
+        - **user**, **password**, **host**, **port**, **name** - адрес
+        базы данных.
+        - **echo**: `bool` - логировать каждый SQL-запрос. Логирование
+        синхронное, в production его лучше не включать.
+        - **pool_size**: `int` - сколько соединений держит пул.
+        - **max_overflow**: `int` - сколько соединений можно открыть
+        сверх pool_size при пиковой нагрузке.
+        - **pool_recycle**: `int` - через сколько секунд соединение
+        переоткрывается, -1 - никогда.
+        - **pool_timeout**: `float` - сколько секунд ждать свободного
+        соединения из пула.
+        - **pool_pre_ping**: `bool` - проверять соединение перед выдачей.
+        - **null_pool**: `bool` - не держать пул, открывать соединение
+        на каждую сессию (тесты, pgbouncer).
+        - **connect_timeout**: `float` - таймаут подключения в секундах.
+        - **statement_cache_size**: `int` - размер кэша подготовленных
+        запросов asyncpg на соединение, 0 - без кэша (pgbouncer
+        в режиме transaction).
+        - **command_timeout**: `float | None` - сколько секунд asyncpg
+        ждёт ответа на запрос.
+        - **statement_timeout**: `int` - statement_timeout Postgres
+        в миллисекундах, 0 - без ограничения.
+    """
+
+    model_config = ConfigDict(frozen=True)
+
+    user: str = "postgres"
+    password: str = ""
+    host: str = "db"
+    port: int = Field(default=5432, ge=1, le=65535)
+    name: str = "postgres"
+    echo: bool = False
+    pool_size: int = Field(default=5, ge=1)
+    max_overflow: int = Field(default=10, ge=0)
+    pool_recycle: int = Field(default=1800, ge=-1)
+    pool_timeout: float = Field(default=30, gt=0)
+    pool_pre_ping: bool = True
+    null_pool: bool = False
+    connect_timeout: float = Field(default=10, gt=0)
+    statement_cache_size: int = Field(default=100, ge=0)
+    command_timeout: float | None = Field(default=None, gt=0)
+    statement_timeout: int = Field(default=0, ge=0)
+
+    @classmethod
+    def from_env(cls, prefix: str = "DB_", **overrides) -> "DatabaseSettings":
+        """
+        Читает настройки из переменных окружения {prefix}{ИМЯ_ПОЛЯ},
+        например DB_POOL_SIZE. Пустые переменные не учитываются.
+
+        ### Parameters:
+            - **prefix**: `str` - префикс переменных.
+            - **overrides** - значения, которые важнее окружения.
+
+        ### Returns:
+            - `DatabaseSettings` или исключение, если значение неверное.
+        """
+        values: dict[str, Any] = {}
+        for field in cls.model_fields:
+            value = os.getenv(f"{prefix}{field.upper()}")
+            if value:
+                values[field] = value
+        values.update(overrides)
+        try:
+            return cls(**values)
+        except ValidationError as e:
+            raise Exception(f"Check {prefix}* in .env. {e}")
+
+    @property
+    def url(self) -> URL:
+        return URL.create(
+            "postgresql+asyncpg",
+            username=self.user,
+            password=self.password,
+            host=self.host,
+            port=self.port,
+            database=self.name,
+        )
+
+    def engine_options(self) -> dict:
+        """Аргументы create_async_engine для этих настроек."""
+        connect_args: dict = {
+            "timeout": self.connect_timeout,
+            "command_timeout": self.command_timeout,
+            # Кэш подготовленных запросов есть и в asyncpg, и в адаптере
+            # SQLAlchemy, размер задаётся обоим
+            "statement_cache_size": self.statement_cache_size,
+            "prepared_statement_cache_size": self.statement_cache_size,
+        }
+        if self.statement_timeout:
+            connect_args["server_settings"] = {
+                "statement_timeout": str(self.statement_timeout)
+            }
+        options: dict = {
+            "echo": self.echo,
+            "pool_pre_ping": self.pool_pre_ping,
+            "connect_args": connect_args,
+        }
+        if self.null_pool:
+            options["poolclass"] = NullPool
+        else:
+            options.update(
+                pool_size=self.pool_size,
+                max_overflow=self.max_overflow,
+                pool_recycle=self.pool_recycle,
+                pool_timeout=self.pool_timeout,
+            )
+        return options
+
+
+def create_engine(settings: DatabaseSettings) -> AsyncEngine:
+    return create_async_engine(settings.url, **settings.engine_options())
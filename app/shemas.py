@@ -1,4 +1,4 @@
-from typing import List, Optional
+from typing import Dict, List, Optional
 
 from pydantic import BaseModel
 
@@ -6,3 +6,106 @@ from pydantic import BaseModel
 class TweetCreate(BaseModel):
     tweet_data: str
     tweet_media_ids: Optional[List[int]] = []
+
+
+class LikesBatch(BaseModel):
+    tweet_ids: List[int]
+
+
+class FollowsBatch(BaseModel):
+    user_ids: List[int]
+
+
+class TweetsBatch(BaseModel):
+    tweets: List[TweetCreate]
+
+
+class Result(BaseModel):
+    result: bool = True
+
+
+class TweetCreated(Result):
+    tweet_id: int
+
+
+class MediaCreated(Result):
+    media_id: int
+
+
+class UserRef(BaseModel):
+    id: int
+    name: str
+
+
+class TweetLike(BaseModel):
+    user_id: int
+    name: str
+
+
+class Tweet(BaseModel):
+    id: int
+    content: str
+    attachments: List[str]
+    # Пути к уменьшенным копиям вложений по ширинам
+    attachment_variants: List[Dict[str, str]]
+    author: UserRef
+    likes: List[TweetLike]
+
+
+class Feed(Result):
+    tweets: List[Tweet]
+    next_cursor: Optional[str]
+
+
+class SearchFeed(Feed):
+    # Последняя страница, но совпадений больше, чем SEARCH_RANK_WINDOW:
+    # более старые совпадения не выдаются
+    truncated: bool
+
+
+class UserProfile(BaseModel):
+    id: int
+    name: str
+    followers: List[UserRef]
+    following: List[UserRef]
+    followers_count: int
+    following_count: int
+
+
+class Profile(Result):
+    user: UserProfile
+    followers_next_cursor: Optional[str]
+    following_next_cursor: Optional[str]
+
+
+# Результаты пакетных запросов отдаются с response_model_exclude_unset,
+# поэтому error_message есть только у неуспешных записей
+
+
+class BatchItem(BaseModel):
+    result: bool
+    error_message: Optional[str] = None
+
+
+class LikesBatchItem(BatchItem):
+    tweet_id: int
+
+
+class FollowsBatchItem(BatchItem):
+    user_id: int
+
+
+class TweetsBatchItem(BatchItem):
+    tweet_id: Optional[int] = None
+
+
+class LikesBatchResult(Result):
+    results: List[LikesBatchItem]
+
+
+class FollowsBatchResult(Result):
+    results: List[FollowsBatchItem]
+
+
+class TweetsBatchResult(Result):
+    results: List[TweetsBatchItem]
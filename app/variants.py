@@ -0,0 +1,62 @@
+import os
+import tempfile
+
+from PIL import Image
+
+# Ширины уменьшенных копий картинок для карточек в ленте
+VARIANT_WIDTHS = tuple(
+    int(width)
+    for width in os.getenv("VARIANT_WIDTHS", "320,640,1280").split(",")
+)
+VARIANT_QUALITY = int(os.getenv("VARIANT_QUALITY", 80))
+
+
+def variant_files(checksum: str) -> dict:
+    """
+    Имена файлов уменьшенных копий картинки.
+
+    ### Parameters:
+        - **checksum**: `str` - sha256 содержимого исходного файла.
+
+    ### Returns:
+        - `dict` ширина -> имя файла.
+    """
+    return {width: f"{checksum}_{width}.webp" for width in VARIANT_WIDTHS}
+
+
+def make_variants(source: str, directory: str, checksum: str) -> list:
+    """
+    Делает уменьшенные копии картинки в формате WebP. Выполняется
+    в отдельном процессе (ProcessPoolExecutor), поэтому не должна
+    зависеть от состояния приложения. Картинки меньше нужной ширины
+    не увеличиваются.
+
+    ### Parameters:
+        - **source**: `str` - путь к исходному файлу.
+        - **directory**: `str` - папка для уменьшенных копий.
+        - **checksum**: `str` - sha256 содержимого исходного файла.
+
+    ### Returns:
+        - `list` с именами созданных файлов.
+    """
+    created = []
+    with Image.open(source) as image:
+        image.load()
+        if image.mode not in ("RGB", "RGBA"):
+            transparent = (
+                "A" in image.getbands() or "transparency" in image.info
+            )
+            image = image.convert("RGBA" if transparent else "RGB")
+        for width, name in variant_files(checksum).items():
+            variant = image.copy()
+            variant.thumbnail((width, variant.height))
+            fd, path = tempfile.mkstemp(dir=directory, prefix=".variant-")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    variant.save(f, "WEBP", quality=VARIANT_QUALITY)
+                os.replace(path, os.path.join(directory, name))
+            except BaseException:
+                os.remove(path)
+                raise
+            created.append(name)
+    return created
@@ -0,0 +1,113 @@
+"""
+Сравнение сборки ленты: JOIN всех таблиц с дедупликацией в Python
+(как было) против агрегации в базе через LATERAL подзапросы (как стало).
+
+Запуск из корня проекта на заполненной базе:
+
+    python -m bench.feed_aggregation --tweets 100 --repeat 5
+"""
+import argparse
+import asyncio
+import os
+import time
+
+os.environ.setdefault("DOWNLOADS", "static/images")
+
+from sqlalchemy import select  # noqa: E402
+from sqlalchemy.ext.asyncio import AsyncSession  # noqa: E402
+from sqlalchemy.orm import aliased  # noqa: E402
+from sqlalchemy.sql.expression import any_  # noqa: E402
+
+from app.models import (  # noqa: E402
+    Followers,
+    Likes,
+    Media,
+    Tweets,
+    User,
+    async_session,
+    engine,
+)
+from app.routes import tweets_by_ids  # noqa: E402
+
+
+async def legacy_feed(session: AsyncSession, tweet_ids: list) -> tuple:
+    author = aliased(User, name="user_1")
+    liker = aliased(User, name="user_2")
+    result = await session.execute(
+        select(
+            Tweets.id,
+            Tweets.content,
+            Tweets.author_id,
+            author.name,
+            Media.file,
+            Likes.likers_id,
+            liker.name,
+        )
+        .outerjoin(Media, Media.id == any_(Tweets.attachments))
+        .outerjoin(Likes, Likes.tweet_id == Tweets.id)
+        .outerjoin(author, author.id == Tweets.author_id)
+        .outerjoin(liker, liker.id == Likes.likers_id)
+        .outerjoin(Followers, Followers.following_id == Tweets.author_id)
+        .where(Tweets.id.in_(tweet_ids))
+        .group_by(
+            Tweets.id,
+            author.name,
+            Media.file,
+            Likes.likers_id,
+            liker.name,
+            Followers.followers_id,
+            Followers.following_id,
+            Media.id,
+        )
+    )
+    rows = result.fetchall()
+    tweets: dict = {}
+    for row in rows:
+        tweet = tweets.setdefault(
+            row[0], {"attachments": set(), "likes": set()}
+        )
+        if row[4]:
+            tweet["attachments"].add(row[4])
+        if row[5]:
+            tweet["likes"].add((row[5], row[6]))
+    return len(rows), tweets
+
+
+async def aggregated_feed(session: AsyncSession, tweet_ids: list) -> tuple:
+    tweets = await tweets_by_ids(session, tweet_ids)
+    return len(tweets), tweets
+
+
+async def measure(func, tweet_ids: list, repeat: int) -> dict:
+    timings = []
+    rows = 0
+    for _ in range(repeat):
+        async with async_session() as session:
+            started = time.perf_counter()
+            rows, _ = await func(session, tweet_ids)
+            timings.append(time.perf_counter() - started)
+    return {"rows": rows, "best_ms": round(min(timings) * 1000, 2)}
+
+
+async def main(args):
+    async with async_session() as session:
+        result = await session.execute(
+            select(Tweets.id)
+            .order_by(Tweets.like_count.desc(), Tweets.id.desc())
+            .limit(args.tweets)
+        )
+        tweet_ids = result.scalars().all()
+    for name, func in (("legacy", legacy_feed), ("lateral", aggregated_feed)):
+        stats = await measure(func, tweet_ids, args.repeat)
+        print(f"{name:8} tweets={len(tweet_ids)} rows={stats['rows']} "
+              f"best={stats['best_ms']} ms")
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--tweets", type=int, default=20, help="самые популярные твиты"
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,411 @@
+"""
+Генератор синтетических данных для нагрузочных замеров: пользователи,
+граф подписок со степенным распределением, твиты с картинками и лайки,
+которые тоже сосредоточены на небольшой доле популярных твитов. Частота
+слов в тексте твитов тоже подчиняется закону Ципфа (см. vocabulary).
+Данные пишутся через COPY (asyncpg copy_records_to_table) одной
+транзакцией, одинаковый --seed даёт одинаковые данные.
+
+Запуск из корня проекта на базе после миграций (python -m api.migrations):
+
+    python -m bench.generate --users 100000 --tweets 1000000 \\
+        --likes 10000000 --truncate
+
+Файлы картинок не создаются, в media и media_blobs пишутся только
+записи. Без --fanout твиты не рассылаются по timeline и подмешиваются
+в ленту при чтении, как твиты популярных авторов.
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import time
+from array import array
+from hashlib import sha256
+
+os.environ.setdefault("DOWNLOADS", "static/images")
+
+import asyncpg  # noqa: E402
+
+from app.models import (  # noqa: E402
+    Followers,
+    Likes,
+    Media,
+    MediaBlob,
+    Tweets,
+    User,
+    engine,
+)
+from app.notify import asyncpg_dsn  # noqa: E402
+from app.routes import FANOUT_THRESHOLD  # noqa: E402
+
+WORDS = (
+    "python postgres async index cache query feed tweet like follow "
+    "photo cat dog coffee morning weekend release deploy bug fix "
+    "music movie travel city sun rain news sport game book"
+).split()
+
+
+def vocabulary(size: int) -> list:
+    """Словарь для текста твитов в порядке убывания частоты: сначала
+    WORDS, затем искусственные слова w<номер>."""
+    return WORDS[:size] + [f"w{rank}" for rank in range(len(WORDS), size)]
+
+
+def word_weights(size: int, skew: float) -> list:
+    """Накопленные веса слов словаря по закону Ципфа, как в живом
+    тексте: несколько слов встречаются почти везде, большинство - редко."""
+    return list(
+        itertools.accumulate(1 / rank ** skew for rank in range(1, size + 1))
+    )
+
+
+def zipf_weights(size: int, skew: float, rng: random.Random) -> list:
+    """Накопленные веса закона Ципфа для size элементов: у элемента
+    ранга r вес 1 / r ** skew. Ранги перемешаны, чтобы популярность
+    не совпадала с порядком id."""
+    ranks = list(range(1, size + 1))
+    rng.shuffle(ranks)
+    return list(itertools.accumulate(1 / rank ** skew for rank in ranks))
+
+
+def weighted_sample(
+        rng: random.Random, cum_weights: list, k: int, exclude: int = -1
+) -> set:
+    """Выбирает до k разных индексов с вероятностью по весам."""
+    population = range(len(cum_weights))
+    chosen: set = set()
+    for _ in range(20):
+        need = k - len(chosen)
+        if need <= 0:
+            break
+        for index in rng.choices(population, cum_weights=cum_weights, k=need):
+            if index != exclude:
+                chosen.add(index)
+    return chosen
+
+
+def batched(records, size: int):
+    iterator = iter(records)
+    while batch := list(itertools.islice(iterator, size)):
+        yield batch
+
+
+async def copy(conn, columns: tuple, records, batch_size: int) -> int:
+    """
+    Пишет записи в таблицу модели через COPY пачками по batch_size.
+
+    ### Parameters:
+        - **conn**: `asyncpg.Connection` - соединение с базой.
+        - **columns**: `tuple` - колонки модели в порядке полей записи.
+        - **records** - итератор кортежей.
+        - **batch_size**: `int` - сколько записей в одном COPY.
+
+    ### Returns:
+        - `int` - количество записанных строк.
+    """
+    table = columns[0].table.name
+    names = [column.name for column in columns]
+    total = 0
+    started = time.perf_counter()
+    for batch in batched(records, batch_size):
+        await conn.copy_records_to_table(table, records=batch, columns=names)
+        total += len(batch)
+    print(f"{table:12} {total:>10} rows {time.perf_counter() - started:.1f} s")
+    return total
+
+
+async def next_id(conn, column) -> int:
+    table = column.table.name
+    return await conn.fetchval(
+        f'SELECT coalesce(max({column.name}), 0) + 1 FROM "{table}"'
+    )
+
+
+async def generate(
+        conn,
+        users: int,
+        tweets: int,
+        likes: int,
+        follows: int = 50,
+        max_follows: int = 5000,
+        media_ratio: float = 0.1,
+        skew: float = 1.0,
+        seed: int = 0,
+        batch_size: int = 50000,
+        fanout: bool = False,
+        words: int = 20000,
+) -> dict:
+    """
+    Генерирует данные и пишет их в базу через COPY. Новые записи
+    добавляются после существующих, счётчики заполняются сразу.
+
+    ### Parameters:
+        - **conn**: `asyncpg.Connection` - соединение с базой.
+        - **users**: `int` - сколько создать пользователей.
+        - **tweets**: `int` - сколько создать твитов.
+        - **likes**: `int` - сколько примерно создать лайков.
+        - **follows**: `int` - среднее количество подписок пользователя.
+        - **max_follows**: `int` - максимум подписок одного пользователя.
+        - **media_ratio**: `float` - доля твитов с картинками.
+        - **skew**: `float` - показатель закона Ципфа для популярности
+        пользователей и твитов.
+        - **seed**: `int` - зерно генератора случайных чисел.
+        - **batch_size**: `int` - сколько записей в одном COPY.
+        - **fanout**: `bool` - разослать твиты авторов, у которых меньше
+        FANOUT_THRESHOLD подписчиков, по timeline.
+        - **words**: `int` - размер словаря текста твитов (см. vocabulary).
+
+    ### Returns:
+        - `dict` с количеством записанных строк по таблицам.
+    """
+    rng = random.Random(seed)
+    first_user = await next_id(conn, User.id)
+    first_tweet = await next_id(conn, Tweets.id)
+    first_media = await next_id(conn, Media.id)
+    written = {}
+
+    # Количество подписок - распределение Парето со средним follows,
+    # на кого подписаться - по популярности пользователя. Рёбра нужно
+    # сгенерировать до записи пользователей, чтобы сразу записать
+    # счётчики, поэтому они держатся в памяти компактно
+    popularity = zipf_weights(users, skew, rng)
+    following_count = array("i")
+    followers_count = array("i", bytes(4 * users))
+    edges = array("i")
+    for user in range(users):
+        wanted = int(rng.paretovariate(2) * follows / 2)
+        targets = weighted_sample(
+            rng, popularity, min(users - 1, max_follows, wanted), user
+        )
+        following_count.append(len(targets))
+        for target in sorted(targets):
+            followers_count[target] += 1
+            edges.extend((first_user + user, first_user + target))
+    del popularity
+
+    written["user"] = await copy(
+        conn,
+        (
+            User.id,
+            User.api_key,
+            User.name,
+            User.followers_count,
+            User.following_count,
+        ),
+        (
+            (
+                first_user + user,
+                f"key{first_user + user}",
+                f"user{first_user + user}",
+                followers_count[user],
+                following_count[user],
+            )
+            for user in range(users)
+        ),
+        batch_size,
+    )
+    written["followers"] = await copy(
+        conn,
+        (Followers.followers_id, Followers.following_id),
+        zip(edges[::2], edges[1::2]),
+        batch_size,
+    )
+    del edges
+
+    # Лайки: ожидаемое количество у твита пропорционально его весу
+    # по закону Ципфа, лайкают случайные пользователи
+    tweet_weights = zipf_weights(tweets, skew, rng)
+    total_weight = tweet_weights[-1] if tweets else 1
+    like_count = array("i")
+    previous = 0.0
+    for weight in tweet_weights:
+        expected = likes * (weight - previous) / total_weight
+        previous = weight
+        count = int(expected) + (rng.random() < expected % 1)
+        like_count.append(min(users, count))
+    del tweet_weights
+    activity = zipf_weights(users, skew, rng)
+    authors = array(
+        "i", rng.choices(range(users), cum_weights=activity, k=tweets)
+    )
+    del activity
+
+    media_rows = []
+    attachments = []
+    media_id = first_media
+    for tweet in range(tweets):
+        files = []
+        if rng.random() < media_ratio:
+            for _ in range(rng.randint(1, 4)):
+                checksum = sha256(f"{seed}:{media_id}".encode()).hexdigest()
+                media_rows.append(
+                    (media_id, checksum, first_user + authors[tweet])
+                )
+                files.append(media_id)
+                media_id += 1
+        attachments.append(files)
+
+    written["media_blobs"] = await copy(
+        conn,
+        (MediaBlob.checksum, MediaBlob.file, MediaBlob.size),
+        (
+            (checksum, f"{checksum}.jpg", rng.randint(20_000, 2_000_000))
+            for _, checksum, _ in media_rows
+        ),
+        batch_size,
+    )
+    written["media"] = await copy(
+        conn,
+        (Media.id, Media.file, Media.checksum, Media.uploader_id,
+         Media.attached),
+        (
+            (media, f"{checksum}.jpg", checksum, uploader, True)
+            for media, checksum, uploader in media_rows
+        ),
+        batch_size,
+    )
+    del media_rows
+    dictionary = vocabulary(words)
+    dictionary_weights = word_weights(len(dictionary), skew)
+    written["tweets"] = await copy(
+        conn,
+        (Tweets.id, Tweets.content, Tweets.attachments, Tweets.author_id,
+         Tweets.like_count, Tweets.author_rank),
+        (
+            (
+                first_tweet + tweet,
+                " ".join(
+                    rng.choices(
+                        dictionary,
+                        cum_weights=dictionary_weights,
+                        k=rng.randint(3, 30),
+                    )
+                ),
+                attachments[tweet],
+                first_user + authors[tweet],
+                like_count[tweet],
+                followers_count[authors[tweet]],
+            )
+            for tweet in range(tweets)
+        ),
+        batch_size,
+    )
+    del attachments, authors
+
+    def like_rows():
+        for tweet in range(tweets):
+            for liker in sorted(rng.sample(range(users), like_count[tweet])):
+                yield first_tweet + tweet, first_user + liker
+
+    written["likes"] = await copy(
+        conn, (Likes.tweet_id, Likes.likers_id), like_rows(), batch_size
+    )
+
+    # id писались явно, последовательности нужно сдвинуть за них
+    for column in (User.id, Tweets.id, Media.id):
+        table = column.table.name
+        await conn.execute(
+            f"""
+            SELECT setval(
+                pg_get_serial_sequence('"{table}"', '{column.name}'),
+                (SELECT max({column.name}) FROM "{table}")
+            )
+            """
+        )
+
+    if fanout:
+        started = time.perf_counter()
+        status = await conn.execute(
+            """
+            INSERT INTO timeline (user_id, tweet_id, author_id)
+            SELECT f.followers_id, t.id, t.author_id
+            FROM tweets t
+            JOIN "user" u ON u.id = t.author_id
+            JOIN followers f ON f.following_id = t.author_id
+            WHERE t.id >= $1 AND u.followers_count < $2
+            """,
+            first_tweet,
+            FANOUT_THRESHOLD,
+        )
+        await conn.execute(
+            """
+            UPDATE tweets t SET fanned_out = true
+            FROM "user" u
+            WHERE u.id = t.author_id
+                AND t.id >= $1 AND u.followers_count < $2
+            """,
+            first_tweet,
+            FANOUT_THRESHOLD,
+        )
+        written["timeline"] = int(status.split()[-1])
+        print(
+            f"{'timeline':12} {written['timeline']:>10} rows "
+            f"{time.perf_counter() - started:.1f} s"
+        )
+    return written
+
+
+async def main(args):
+    conn = await asyncpg.connect(args.dsn or asyncpg_dsn(engine.url))
+    try:
+        async with conn.transaction():
+            if args.truncate:
+                await conn.execute(
+                    'TRUNCATE "user", media_blobs RESTART IDENTITY CASCADE'
+                )
+            await generate(
+                conn,
+                users=args.users,
+                tweets=args.tweets,
+                likes=args.likes,
+                follows=args.follows,
+                max_follows=args.max_follows,
+                media_ratio=args.media_ratio,
+                skew=args.skew,
+                seed=args.seed,
+                batch_size=args.batch_size,
+                fanout=args.fanout,
+                words=args.words,
+            )
+        await conn.execute("ANALYZE")
+    finally:
+        await conn.close()
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--tweets", type=int, default=100000)
+    parser.add_argument("--likes", type=int, default=1000000)
+    parser.add_argument(
+        "--follows", type=int, default=50, help="среднее число подписок"
+    )
+    parser.add_argument("--max-follows", type=int, default=5000)
+    parser.add_argument(
+        "--media-ratio", type=float, default=0.1,
+        help="доля твитов с картинками",
+    )
+    parser.add_argument(
+        "--skew", type=float, default=1.0, help="показатель закона Ципфа"
+    )
+    parser.add_argument(
+        "--words", type=int, default=20000, help="размер словаря твитов"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--batch-size", type=int, default=50000)
+    parser.add_argument(
+        "--fanout", action="store_true", help="заполнить timeline"
+    )
+    parser.add_argument(
+        "--truncate", action="store_true",
+        help="удалить все данные перед загрузкой",
+    )
+    parser.add_argument(
+        "--dsn", help="строка подключения, по умолчанию из DB_* в .env"
+    )
+    asyncio.run(main(parser.parse_args()))
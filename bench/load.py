@@ -0,0 +1,303 @@
+"""
+Нагрузочный замер маршрутов API на заполненной базе (см. bench.generate).
+По умолчанию запросы идут в app_api внутри процесса через ASGITransport,
+с --url - в запущенный сервер (uvicorn, gunicorn). Маршруты замеряются
+по очереди, у каждого своя конкурентность. Результат (запросов в секунду
+и задержки p50/p95/p99) пишется в JSON, два результата можно сравнить.
+
+Запуск из корня проекта:
+
+    python -m bench.load run --requests 1000 --concurrency 16 \\
+        --endpoint-concurrency feed=64,medias=4 --output new.json
+    python -m bench.load compare old.json new.json --threshold 0.1
+
+compare завершается с кодом 1, если есть регрессии.
+"""
+import argparse
+import asyncio
+import io
+import json
+import math
+import os
+import random
+import sys
+import time
+from datetime import datetime, timezone
+
+os.environ.setdefault("DOWNLOADS", "static/images")
+
+from httpx import ASGITransport, AsyncClient  # noqa: E402
+from PIL import Image  # noqa: E402
+from sqlalchemy import func, select  # noqa: E402
+
+from app.media import shutdown_executor, wait_for_variants  # noqa: E402
+from app.models import Tweets, User, async_session, engine  # noqa: E402
+from app.routes import app_api  # noqa: E402
+
+
+async def sample_data(session_factory, size: int = 1000) -> dict:
+    """Случайные пользователи (id, api-key) и id твитов для запросов."""
+    async with session_factory() as session:
+        users = (
+            await session.execute(
+                select(User.id, User.api_key)
+                .order_by(func.random())
+                .limit(size)
+            )
+        ).all()
+        tweets = (
+            await session.execute(
+                select(Tweets.id).order_by(func.random()).limit(size)
+            )
+        ).scalars().all()
+    if not users or not tweets:
+        raise Exception("Database is empty. Run python -m bench.generate.")
+    return {"users": [tuple(user) for user in users], "tweets": list(tweets)}
+
+
+def jpeg() -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (640, 480), (200, 120, 40)).save(buffer, "JPEG")
+    return buffer.getvalue()
+
+
+def endpoints(data: dict, rng: random.Random) -> dict:
+    """
+    Запросы маршрутов: функция принимает клиента и делает один запрос.
+    Лайки и подписки идут к случайным твитам и пользователям, повторная
+    попытка (400) считается ошибкой.
+    """
+    image = jpeg()
+
+    def user():
+        return rng.choice(data["users"])
+
+    def headers():
+        return {"api-key": user()[1]}
+
+    return {
+        "feed": lambda client: client.get("/tweets", headers=headers()),
+        "users": lambda client: client.get(
+            f"/users/{user()[0]}", headers=headers()
+        ),
+        "users_me": lambda client: client.get("/users/me", headers=headers()),
+        "like": lambda client: client.post(
+            f"/tweets/{rng.choice(data['tweets'])}/likes", headers=headers()
+        ),
+        "follow": lambda client: client.post(
+            f"/users/{user()[0]}/follow", headers=headers()
+        ),
+        "tweets": lambda client: client.post(
+            "/tweets",
+            json={"tweet_data": f"load test {rng.random()}"},
+            headers=headers(),
+        ),
+        "medias": lambda client: client.post(
+            "/medias",
+            files={"file": ("image.jpg", image, "image/jpeg")},
+            headers=headers(),
+        ),
+    }
+
+
+def percentile(timings: list, q: float) -> float:
+    """Перцентиль по методу ближайшего ранга, timings отсортированы."""
+    if not timings:
+        return 0.0
+    rank = max(1, math.ceil(q / 100 * len(timings)))
+    return timings[rank - 1]
+
+
+async def run_endpoint(
+        client: AsyncClient, request, requests: int, concurrency: int
+) -> dict:
+    """
+    Делает requests запросов, не больше concurrency одновременно.
+
+    ### Returns:
+        - `dict` со статистикой: запросов в секунду, ошибок и задержек
+        в миллисекундах.
+    """
+    timings = []
+    errors = 0
+    remaining = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for _ in remaining:
+            started = time.perf_counter()
+            try:
+                response = await request(client)
+                failed = response.status_code >= 400
+            except Exception:
+                failed = True
+            timings.append((time.perf_counter() - started) * 1000)
+            errors += failed
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    timings.sort()
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "rps": round(requests / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(timings, 50), 2),
+        "p95_ms": round(percentile(timings, 95), 2),
+        "p99_ms": round(percentile(timings, 99), 2),
+        "max_ms": round(timings[-1], 2) if timings else 0.0,
+    }
+
+
+async def run(
+        client: AsyncClient,
+        data: dict,
+        names: list,
+        requests: int,
+        concurrency: int,
+        endpoint_concurrency: dict,
+        seed: int = 0,
+) -> dict:
+    """Замеряет маршруты names по очереди, каждому предшествует
+    короткий прогрев."""
+    rng = random.Random(seed)
+    requests_by_name = endpoints(data, rng)
+    results = {}
+    for name in names:
+        request = requests_by_name[name]
+        workers = endpoint_concurrency.get(name, concurrency)
+        warmup = min(requests, workers * 2)
+        await run_endpoint(client, request, warmup, workers)
+        stats = results[name] = await run_endpoint(
+            client, request, requests, workers
+        )
+        print(
+            f"{name:9} rps={stats['rps']:<8} p50={stats['p50_ms']} "
+            f"p95={stats['p95_ms']} p99={stats['p99_ms']} ms "
+            f"errors={stats['errors']}"
+        )
+    return results
+
+
+def compare(old: dict, new: dict, threshold: float) -> list:
+    """
+    Сравнивает два результата run.
+
+    ### Parameters:
+        - **old**, **new**: `dict` - содержимое JSON-файлов с результатами.
+        - **threshold**: `float` - допустимое ухудшение, 0.1 - 10%.
+
+    ### Returns:
+        - `list` регрессий: (маршрут, метрика, было, стало).
+    """
+    regressions = []
+    for name, before in old["endpoints"].items():
+        after = new["endpoints"].get(name)
+        if after is None:
+            continue
+        if after["rps"] < before["rps"] * (1 - threshold):
+            regressions.append((name, "rps", before["rps"], after["rps"]))
+        for metric in ("p50_ms", "p95_ms", "p99_ms"):
+            if after[metric] > before[metric] * (1 + threshold):
+                regressions.append(
+                    (name, metric, before[metric], after[metric])
+                )
+        if after["errors"] > before["errors"]:
+            regressions.append(
+                (name, "errors", before["errors"], after["errors"])
+            )
+    return regressions
+
+
+def parse_concurrency(value: str) -> dict:
+    result = {}
+    for item in filter(None, value.split(",")):
+        name, _, workers = item.partition("=")
+        result[name.strip()] = int(workers)
+    return result
+
+
+async def main_run(args):
+    data = await sample_data(async_session)
+    if args.url:
+        client = AsyncClient(base_url=args.url, timeout=60)
+        mode = "server"
+    else:
+        client = AsyncClient(
+            transport=ASGITransport(app=app_api),
+            base_url="http://bench",
+            timeout=60,
+        )
+        mode = "asgi"
+    try:
+        async with client:
+            results = await run(
+                client,
+                data,
+                args.endpoints.split(","),
+                args.requests,
+                args.concurrency,
+                parse_concurrency(args.endpoint_concurrency),
+                args.seed,
+            )
+    finally:
+        await wait_for_variants()
+        shutdown_executor()
+        await engine.dispose()
+    report = {
+        "mode": mode,
+        "url": args.url,
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "endpoints": results,
+    }
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=2)
+    print(f"Saved to {args.output}")
+
+
+def main_compare(args) -> int:
+    with open(args.old) as old, open(args.new) as new:
+        regressions = compare(json.load(old), json.load(new), args.threshold)
+    for name, metric, before, after in regressions:
+        print(f"REGRESSION {name:9} {metric:7} {before} -> {after}")
+    if not regressions:
+        print("No regressions")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run")
+    run_parser.add_argument(
+        "--endpoints", default="feed,users,users_me,like,follow,tweets,medias"
+    )
+    run_parser.add_argument(
+        "--requests", type=int, default=500, help="запросов на маршрут"
+    )
+    run_parser.add_argument("--concurrency", type=int, default=16)
+    run_parser.add_argument(
+        "--endpoint-concurrency", default="",
+        help="конкурентность отдельных маршрутов: feed=64,medias=4",
+    )
+    run_parser.add_argument(
+        "--url", help="адрес API сервера, например http://localhost/api"
+    )
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--output", default="bench-results.json")
+    compare_parser = commands.add_parser("compare")
+    compare_parser.add_argument("old")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument(
+        "--threshold", type=float, default=0.1,
+        help="допустимое ухудшение, 0.1 - 10%%",
+    )
+    args = parser.parse_args()
+    if args.command == "run":
+        asyncio.run(main_run(args))
+    else:
+        sys.exit(main_compare(args))
@@ -0,0 +1,157 @@
+"""
+Замер поиска по тексту твитов (/tweets/search) на заполненной базе:
+для запросов с частыми, средними и редкими словами (словарь
+bench.generate) - сколько твитов найдено и задержка первой и следующих
+страниц: выборка id по GIN-индексу с ранжированием и сборка твитов.
+С --like для сравнения замеряется поиск через ILIKE.
+
+Запуск из корня проекта:
+
+    python -m bench.generate --users 100000 --tweets 10000000 \\
+        --likes 10000000 --truncate
+    python -m bench.search --repeat 10 --pages 3
+"""
+import argparse
+import asyncio
+import os
+import time
+
+os.environ.setdefault("DOWNLOADS", "static/images")
+
+from sqlalchemy import func, select  # noqa: E402
+
+from app.models import Tweets, async_session, engine  # noqa: E402
+from app.routes import (  # noqa: E402
+    search_condition,
+    search_page_query,
+    tweets_by_ids,
+)
+from bench.generate import vocabulary  # noqa: E402
+from bench.load import percentile  # noqa: E402
+
+
+def queries(words: int) -> dict:
+    """Запросы по словам разной частоты: словарь vocabulary упорядочен
+    по убыванию частоты."""
+    dictionary = vocabulary(words)
+    frequent, second = dictionary[0], dictionary[1]
+    medium = dictionary[min(len(dictionary) - 1, 300)]
+    rare = dictionary[-1]
+    return {
+        "frequent": frequent,
+        "two_words": f"{frequent} {second}",
+        "phrase": f'"{frequent} {second}"',
+        "exclude": f"{medium} -{frequent}",
+        "medium": medium,
+        "or": f"{medium} or {rare}",
+        "rare": rare,
+    }
+
+
+async def search_page(
+        session_factory, query: str, limit: int, position
+) -> tuple:
+    async with session_factory() as session:
+        page = (
+            await session.execute(
+                search_page_query(query, limit + 1, position)
+            )
+        ).fetchall()
+        next_position = None
+        if len(page) > limit:
+            page = page[:limit]
+            next_position = (page[-1].rank, page[-1].id)
+        await tweets_by_ids(session, [row.id for row in page])
+    return len(page), next_position
+
+
+async def measure(
+        session_factory, query: str, limit: int, pages: int, repeat: int
+) -> dict:
+    """Задержка страниц 1..pages в миллисекундах (p50 и p95). Если
+    страниц меньше, статистики для остальных нет."""
+    timings: list = [[] for _ in range(pages)]
+    for _ in range(repeat):
+        position = None
+        for page in range(pages):
+            started = time.perf_counter()
+            _, position = await search_page(
+                session_factory, query, limit, position
+            )
+            timings[page].append((time.perf_counter() - started) * 1000)
+            if position is None:
+                break
+    stats = {}
+    for page, page_timings in enumerate(timings, start=1):
+        if page_timings:
+            page_timings.sort()
+            stats[f"page{page}_p50_ms"] = round(
+                percentile(page_timings, 50), 2
+            )
+            stats[f"page{page}_p95_ms"] = round(
+                percentile(page_timings, 95), 2
+            )
+    return stats
+
+
+async def count_matches(session_factory, query: str) -> int:
+    async with session_factory() as session:
+        result = await session.execute(
+            select(func.count()).where(search_condition(query))
+        )
+        return result.scalar()
+
+
+async def measure_like(word: str, limit: int) -> float:
+    """Первая страница поиска через ILIKE без индекса, в миллисекундах."""
+    async with async_session() as session:
+        started = time.perf_counter()
+        await session.execute(
+            select(Tweets.id)
+            .where(Tweets.content.ilike(f"%{word}%"))
+            .order_by(Tweets.id.desc())
+            .limit(limit)
+        )
+        return round((time.perf_counter() - started) * 1000, 2)
+
+
+async def main(args):
+    try:
+        async with async_session() as session:
+            total = (
+                await session.execute(select(func.count(Tweets.id)))
+            ).scalar()
+        print(f"tweets={total}")
+        for name, query in queries(args.words).items():
+            stats = await measure(
+                async_session, query, args.limit, args.pages, args.repeat
+            )
+            line = f"{name:10} {query!r:24}"
+            if args.count:
+                line += f" matches={await count_matches(async_session, query)}"
+            line += " " + " ".join(f"{k}={v}" for k, v in stats.items())
+            if args.like and " " not in query:
+                line += f" ilike_ms={await measure_like(query, args.limit)}"
+            print(line)
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--pages", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument(
+        "--words", type=int, default=20000,
+        help="размер словаря, как у bench.generate",
+    )
+    parser.add_argument(
+        "--count", action="store_true", help="посчитать найденные твиты"
+    )
+    parser.add_argument(
+        "--like", action="store_true", help="сравнить с ILIKE"
+    )
+    asyncio.run(main(parser.parse_args()))
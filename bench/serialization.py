@@ -0,0 +1,96 @@
+"""
+Сравнение сериализации ленты: словарь через jsonable_encoder и json
+(как было) против модели ответа Feed через pydantic-core и orjson
+(как стало, см. app_api.default_response_class). База не нужна, лента
+собирается из синтетических твитов.
+
+Запуск из корня проекта:
+
+    python -m bench.serialization --tweets 1000 --repeat 20
+"""
+import argparse
+import json
+import os
+import time
+
+os.environ.setdefault("DOWNLOADS", "static/images")
+
+import orjson  # noqa: E402
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+
+from app.routes import attachment_variants  # noqa: E402
+from app.shemas import Feed  # noqa: E402
+
+
+def make_feed(tweets: int) -> dict:
+    return {
+        "result": True,
+        "tweets": [
+            {
+                "id": tweet_id,
+                "content": f"tweet {tweet_id} " * 10,
+                "attachments": [
+                    os.path.join(os.environ["DOWNLOADS"], f"{n:064x}.jpg")
+                    for n in range(tweet_id % 3)
+                ],
+                "attachment_variants": [
+                    attachment_variants(
+                        f"{n:064x}.jpg", None, None,
+                        os.environ["DOWNLOADS"],
+                    )
+                    for n in range(tweet_id % 3)
+                ],
+                "author": {"id": tweet_id % 100, "name": f"user{tweet_id}"},
+                "likes": [
+                    {"user_id": user_id, "name": f"user{user_id}"}
+                    for user_id in range(tweet_id % 10)
+                ],
+            }
+            for tweet_id in range(tweets)
+        ],
+        "next_cursor": "WzEwLDk5OV0",
+    }
+
+
+def legacy(feed: dict) -> bytes:
+    # Так JSONResponse кодирует ответ без response_model
+    return json.dumps(
+        jsonable_encoder(feed),
+        ensure_ascii=False,
+        allow_nan=False,
+        indent=None,
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+
+def typed(feed: dict) -> bytes:
+    # FastAPI проверяет ответ моделью, сериализует его pydantic-core,
+    # а ORJSONResponse кодирует результат
+    content = Feed.model_validate(feed).model_dump(mode="json")
+    return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
+
+def measure(func, feed: dict, repeat: int) -> dict:
+    timings = []
+    size = 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        size = len(func(feed))
+        timings.append(time.perf_counter() - started)
+    return {"bytes": size, "best_ms": round(min(timings) * 1000, 2)}
+
+
+def main(args):
+    feed = make_feed(args.tweets)
+    assert json.loads(legacy(feed)) == json.loads(typed(feed))
+    for name, func in (("legacy", legacy), ("orjson", typed)):
+        stats = measure(func, feed, args.repeat)
+        print(f"{name:8} tweets={args.tweets} bytes={stats['bytes']} "
+              f"best={stats['best_ms']} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--tweets", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=20)
+    main(parser.parse_args())
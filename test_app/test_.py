@@ -1,19 +1,47 @@
+import asyncio
 import os
 
 import aiofiles
 import pytest
-
-from app.routes import DOWNLOADS
+import pytest_asyncio
+from httpx import ASGITransport, AsyncClient
+from PIL import Image
+from sqlalchemy import select
+from sqlalchemy.orm import aliased
+from sqlalchemy.sql.expression import any_
+from starlette.requests import Request
+
+from app import media, routes
+from app.media import wait_for_variants
+from app.cache import MISSING
+from app.counters import repair_counters
+from app.models import MediaBlob
+from app.notify import NotifyListener, asyncpg_dsn
+from app.reaper import ReapResult, reap_media
+from app.routes import (
+    DOWNLOADS,
+    Followers,
+    Likes,
+    Media,
+    Timeline,
+    Tweets,
+    User,
+)
+from app.routes import get_db_session
+from app.shemas import TweetCreate
+from test_app.conftest import engine
+from test_app.conftest import test_async_session as session_factory
 
 pytestmark = pytest.mark.asyncio
 
 
-async def add_media(async_app_client):
+async def add_media(async_app_client, extra=b""):
     f = await aiofiles.open(
         os.path.join(os.path.dirname(os.path.realpath(__file__)), "image.jpg"),
         "rb",
     )
-    image_data = await f.read()
+    # Дописанные в конец байты дают картинку с другим содержимым
+    image_data = await f.read() + extra
     files = {"file": ("image.jpg", image_data, "image/jpeg")}
     resp = await async_app_client.post(
         "/medias", files=files, headers={"api-key": "123a"}
@@ -50,6 +78,202 @@ async def test_add_new_media_fail_api_key(async_app_client) -> None:
     }
 
 
+async def test_add_new_media_unsupported_type(async_app_client) -> None:
+    files = {"file": ("image.jpg", b"<html></html>", "image/jpeg")}
+    resp = await async_app_client.post(
+        "/medias", files=files, headers={"api-key": "123a"}
+    )
+    data = resp.json()
+    assert resp.status_code == 400
+    assert data == {
+        "result": False,
+        "error_type": "Exception",
+        "error_message": "Can't add new media. Unsupported file type.",
+    }
+    assert os.listdir(DOWNLOADS) == []
+
+
+async def test_add_new_media_too_large(async_app_client, monkeypatch) -> None:
+    monkeypatch.setattr(media, "MAX_UPLOAD_SIZE", 1000)
+    resp = await add_media(async_app_client)
+    data = resp.json()
+    assert resp.status_code == 400
+    assert data == {
+        "result": False,
+        "error_type": "Exception",
+        "error_message": "Can't add new media. File is too large.",
+    }
+    assert os.listdir(DOWNLOADS) == []
+
+
+BOUNDARY = "test-boundary"
+
+
+def multipart_head(filename="image.jpg"):
+    """Начало тела multipart/form-data с полем file."""
+    return (
+        f"--{BOUNDARY}\r\n"
+        f'Content-Disposition: form-data; name="file"; '
+        f'filename="{filename}"\r\n'
+        "Content-Type: image/jpeg\r\n\r\n"
+    ).encode()
+
+
+async def post_media_stream(async_app_client, body):
+    return await async_app_client.post(
+        "/medias",
+        content=body,
+        headers={
+            "api-key": "123a",
+            "content-type": f"multipart/form-data; boundary={BOUNDARY}",
+        },
+    )
+
+
+async def test_add_new_media_streamed_in_chunks(async_app_client) -> None:
+    path = os.path.join(
+        os.path.dirname(os.path.realpath(__file__)), "image.jpg"
+    )
+    with open(path, "rb") as original:
+        image_data = original.read()
+    body = (
+        multipart_head()
+        + image_data
+        + f"\r\n--{BOUNDARY}--\r\n".encode()
+    )
+
+    async def chunks():
+        for i in range(0, len(body), 100):
+            yield body[i:i + 100]
+
+    resp = await post_media_stream(async_app_client, chunks())
+    assert resp.status_code == 200
+    [file_name] = os.listdir(DOWNLOADS)
+    assert file_name.endswith(".jpg")
+    with open(os.path.join(DOWNLOADS, file_name), "rb") as saved:
+        assert saved.read() == image_data
+
+
+async def test_add_new_media_stops_reading_over_cap(
+    async_app_client, monkeypatch
+) -> None:
+    monkeypatch.setattr(media, "MAX_UPLOAD_SIZE", 1000)
+    sent = 0
+
+    async def endless():
+        # Тело без конца: чтение должно прекратиться на лимите
+        nonlocal sent
+        chunk = multipart_head() + b"\xff\xd8\xff" + b"0" * 97
+        while True:
+            sent += len(chunk)
+            yield chunk
+            chunk = b"0" * 100
+
+    resp = await post_media_stream(async_app_client, endless())
+    assert resp.status_code == 400
+    assert resp.json()["error_message"] == (
+        "Can't add new media. File is too large."
+    )
+    assert sent < 1000 + 1000
+    assert os.listdir(DOWNLOADS) == []
+
+
+async def test_add_new_media_rejected_by_content_length(
+    monkeypatch, tmp_path
+) -> None:
+    monkeypatch.setattr(media, "MAX_UPLOAD_SIZE", 1000)
+
+    async def receive():
+        raise AssertionError("Body must not be read")
+
+    request = Request(
+        {
+            "type": "http",
+            "method": "POST",
+            "path": "/api/medias",
+            "headers": [
+                (
+                    b"content-type",
+                    f"multipart/form-data; boundary={BOUNDARY}".encode(),
+                ),
+                (b"content-length", str(10 ** 9).encode()),
+            ],
+        },
+        receive,
+    )
+    with pytest.raises(Exception, match="File is too large"):
+        await media.receive_upload(request, str(tmp_path))
+    assert os.listdir(tmp_path) == []
+
+
+async def test_add_new_media_without_file(async_app_client) -> None:
+    body = (
+        f"--{BOUNDARY}\r\n"
+        'Content-Disposition: form-data; name="other"\r\n\r\n'
+        f"value\r\n--{BOUNDARY}--\r\n"
+    ).encode()
+    resp = await post_media_stream(async_app_client, body)
+    assert resp.status_code == 400
+    assert resp.json()["error_message"] == (
+        "Can't add new media. Please check your data."
+    )
+    assert os.listdir(DOWNLOADS) == []
+
+
+def stored_originals():
+    """Загруженные файлы без их уменьшенных копий и временных файлов."""
+    return sorted(
+        name
+        for name in os.listdir(DOWNLOADS)
+        if "_" not in name and not name.startswith(".")
+    )
+
+
+async def blobs_of(session_test):
+    result = await session_test.execute(
+        select(MediaBlob.file, MediaBlob.refcount).order_by(MediaBlob.file)
+    )
+    return [tuple(row) for row in result]
+
+
+async def test_add_new_media_deduplicated(
+    async_app_client, session_test
+) -> None:
+    await add_media(async_app_client)
+    await add_media(async_app_client)
+    await add_media(async_app_client, extra=b"1")
+    await wait_for_variants()
+    refcounts = dict(await blobs_of(session_test))
+    assert sorted(refcounts.values()) == [1, 2]
+    assert sorted(refcounts) == stored_originals()
+
+
+async def test_delete_tweet_keeps_shared_blob(
+    async_app_client, session_test
+) -> None:
+    await add_media(async_app_client)
+    await add_media(async_app_client)
+    for media_id in (1, 2):
+        await async_app_client.post(
+            "/tweets",
+            json={"tweet_data": "123", "tweet_media_ids": [media_id]},
+            headers={"api-key": "123a"},
+        )
+    await wait_for_variants()
+    [file_name] = stored_originals()
+    stored = sorted(os.listdir(DOWNLOADS))
+
+    await async_app_client.delete("/tweets/2", headers={"api-key": "123a"})
+    await reap_media(session_test, DOWNLOADS)
+    assert sorted(os.listdir(DOWNLOADS)) == stored
+    assert await blobs_of(session_test) == [(file_name, 1)]
+
+    await async_app_client.delete("/tweets/3", headers={"api-key": "123a"})
+    await reap_media(session_test, DOWNLOADS)
+    assert os.listdir(DOWNLOADS) == []
+    assert await blobs_of(session_test) == []
+
+
 @pytest.mark.parametrize("api_key", ["123a", "124a"])
 async def test_add_new_tweet_without_files(async_app_client, api_key) -> None:
     data = {"tweet_data": "data"}
@@ -172,9 +396,13 @@ async def test_delete_tweet_with_fail_user(async_app_client) -> None:
     )
     data = resp.json()
     assert resp.status_code == 400
-    assert data == {'result': False,
-                    'error_type': 'IndexError',
-                    'error_message': 'list index out of range'}
+    assert data == {
+        "result": False,
+        "error_type": "Exception",
+        "error_message": (
+            "Can't delete tweet. It's not yours or it's not exist."
+        ),
+    }
 
 
 async def test_delete_tweet_with_file(async_app_client) -> None:
@@ -195,6 +423,71 @@ async def test_delete_tweet_with_file(async_app_client) -> None:
     assert data == {"result": True}
 
 
+async def test_delete_tweet_marks_media(
+    async_app_client, session_test
+) -> None:
+    await add_media(async_app_client)
+    await async_app_client.post(
+        "/tweets",
+        json={"tweet_data": "123", "tweet_media_ids": [1]},
+        headers={"api-key": "123a"},
+    )
+    await wait_for_variants()
+    stored = sorted(os.listdir(DOWNLOADS))
+    sizes = sum(os.path.getsize(os.path.join(DOWNLOADS, n)) for n in stored)
+
+    await async_app_client.delete("/tweets/2", headers={"api-key": "123a"})
+    # Файлы остаются на месте до фоновой очистки
+    assert sorted(os.listdir(DOWNLOADS)) == stored
+    result = await session_test.execute(
+        select(Media.id).where(Media.deleted_at.isnot(None))
+    )
+    assert result.scalars().all() == [1]
+
+    result = await reap_media(session_test, DOWNLOADS)
+    assert result == ReapResult(media=1, files=len(stored), bytes=sizes)
+    assert os.listdir(DOWNLOADS) == []
+    assert (await session_test.execute(select(Media.id))).all() == []
+
+
+async def test_reap_orphaned_media(async_app_client, session_test) -> None:
+    await add_media(async_app_client)
+    await add_media(async_app_client, extra=b"1")
+    await async_app_client.post(
+        "/tweets",
+        json={"tweet_data": "123", "tweet_media_ids": [1]},
+        headers={"api-key": "123a"},
+    )
+    await wait_for_variants()
+
+    assert await reap_media(session_test, DOWNLOADS) == ReapResult()
+    result = await reap_media(
+        session_test, DOWNLOADS, orphan_ttl=0, batch_size=1
+    )
+    assert result.media == 1
+    remaining = await session_test.execute(select(Media.id, Media.attached))
+    assert remaining.all() == [(1, True)]
+    [(file_name, _)] = await blobs_of(session_test)
+    assert stored_originals() == [file_name]
+
+
+async def test_add_new_tweet_with_deleted_media(
+    async_app_client, media_client
+) -> None:
+    await add_media(async_app_client)
+    data = {"tweet_data": "123", "tweet_media_ids": [1]}
+    await async_app_client.post(
+        "/tweets", json=data, headers={"api-key": "123a"}
+    )
+    await async_app_client.delete("/tweets/2", headers={"api-key": "123a"})
+    resp = await async_app_client.post(
+        "/tweets", json=data, headers={"api-key": "123a"}
+    )
+    assert resp.status_code == 400
+    resp = await media_client.get("/media/1")
+    assert resp.status_code == 404
+
+
 async def test_follow(async_app_client) -> None:
     resp = await async_app_client.post(
         "/users/1/follow", headers={"api-key": "124a"}
@@ -212,24 +505,10 @@ async def test_follow_exists(async_app_client) -> None:
     assert resp.status_code == 400
     assert data == {
         "result": False,
-        "error_type": "IntegrityError",
-        "error_message": "(sqlalchemy.dialects"
-        ".postgresql.asyncpg"
-        ".IntegrityError) <class "
-        "'asyncpg.exceptions"
-        ".UniqueViolationError'>: "
-        "duplicate key value violates "
-        "unique constraint "
-        '"uix_1"\nDETAIL:  Key ('
-        "followers_id, following_id)=("
-        "1, 2) already exists.\n[SQL: "
-        "INSERT INTO followers ("
-        "followers_id, following_id) "
-        "VALUES (%s, %s) RETURNING "
-        "followers.id]\n[parameters: ("
-        "1, 2)]\n(Background on this "
-        "error at: "
-        "https://sqlalche.me/e/14/gkpj)",
+        "error_type": "Exception",
+        "error_message": (
+            "Can't add new follow. You're already following this user."
+        ),
     }
 
 
@@ -337,13 +616,373 @@ async def test_feed(async_app_client) -> None:
                 "id": 1,
                 "content": "content",
                 "attachments": [],
+                "attachment_variants": [],
                 "author": {"id": 2, "name": "name2"},
                 "likes": [{"user_id": 1, "name": "name"}],
             }
         ],
+        "next_cursor": None,
     }
 
 
+async def timeline_of(session_test, user_id):
+    result = await session_test.execute(
+        select(Timeline.tweet_id)
+        .where(Timeline.user_id == user_id)
+        .order_by(Timeline.tweet_id)
+    )
+    return result.scalars().all()
+
+
+async def test_new_tweet_fanned_out_to_followers(
+    async_app_client, session_test
+) -> None:
+    await add_tweets(async_app_client, "124a", 2)
+    assert await timeline_of(session_test, 1) == [2, 3]
+    assert await timeline_of(session_test, 2) == []
+
+
+async def test_follow_backfills_timeline(
+    async_app_client, session_test
+) -> None:
+    await add_tweets(async_app_client, "123a", 2)
+    await async_app_client.post("/users/1/follow", headers={"api-key": "124a"})
+    assert await timeline_of(session_test, 2) == [2, 3]
+
+
+async def test_follow_backfill_is_limited(
+    async_app_client, session_test, monkeypatch
+) -> None:
+    monkeypatch.setattr(routes, "FOLLOW_BACKFILL_LIMIT", 2)
+    await add_tweets(async_app_client, "123a", 3)
+    await async_app_client.post("/users/1/follow", headers={"api-key": "124a"})
+    # Только последние твиты автора, более старый подмешивается при чтении
+    assert await timeline_of(session_test, 2) == [3, 4]
+    assert await walk_feed(async_app_client, "124a") == [4, 3, 2, 1]
+    await async_app_client.delete(
+        "/users/1/follow", headers={"api-key": "124a"}
+    )
+    await async_app_client.post(
+        "/follows:batch", json={"user_ids": [1]}, headers={"api-key": "124a"}
+    )
+    assert await timeline_of(session_test, 2) == [3, 4]
+    assert await walk_feed(async_app_client, "124a") == [4, 3, 2, 1]
+
+
+@pytest.mark.parametrize("tweet_first", [False, True])
+async def test_follow_and_tweet_race(session_test, tweet_first) -> None:
+    # Подписка 2 на 1 и твит 1 в параллельных транзакциях: кто бы ни
+    # заблокировал автора первым, твит оказывается в ленте подписчика
+    async with session_factory() as first, session_factory() as second:
+        if tweet_first:
+            await routes.lock_users(first, [1], share=True)
+            waiting = asyncio.create_task(
+                routes.follow(1, session=second, user_id=2)
+            )
+        else:
+            await routes.lock_users(first, [1, 2])
+            waiting = asyncio.create_task(
+                routes.add_new_tweet(
+                    TweetCreate(tweet_data="race"), session=second, user_id=1
+                )
+            )
+        await asyncio.sleep(0.2)
+        assert not waiting.done()
+        if tweet_first:
+            created = await routes.add_new_tweet(
+                TweetCreate(tweet_data="race"), session=first, user_id=1
+            )
+        else:
+            created = await routes.follow(1, session=first, user_id=2)
+        done = await waiting
+    tweet = created if tweet_first else done
+    assert tweet["tweet_id"] in await timeline_of(session_test, 2)
+
+
+async def test_unfollow_trims_timeline(async_app_client, session_test) -> None:
+    await add_tweets(async_app_client, "124a", 2)
+    await async_app_client.delete(
+        "/users/2/follow", headers={"api-key": "123a"}
+    )
+    assert await timeline_of(session_test, 1) == []
+    resp = await async_app_client.get("/tweets", headers={"api-key": "123a"})
+    assert [tweet["id"] for tweet in resp.json()["tweets"]] == [3, 2, 1]
+
+
+async def test_feed_merges_heavy_authors_at_read_time(
+    async_app_client, session_test, monkeypatch
+) -> None:
+    monkeypatch.setattr(routes, "FANOUT_THRESHOLD", 1)
+    await add_tweets(async_app_client, "124a", 1)
+    await add_tweets(async_app_client, "123a", 1)
+    assert await timeline_of(session_test, 1) == []
+    resp = await async_app_client.get("/tweets", headers={"api-key": "123a"})
+    assert [tweet["id"] for tweet in resp.json()["tweets"]] == [2, 1, 3]
+
+
+async def counters_of(session_test):
+    users = await session_test.execute(
+        select(User.id, User.followers_count, User.following_count)
+        .order_by(User.id)
+    )
+    tweets = await session_test.execute(
+        select(Tweets.id, Tweets.like_count).order_by(Tweets.id)
+    )
+    return [tuple(row) for row in users], [tuple(row) for row in tweets]
+
+
+async def test_like_counters(async_app_client, session_test) -> None:
+    await async_app_client.post("/tweets/1/likes", headers={"api-key": "124a"})
+    assert await counters_of(session_test) == (
+        [(1, 0, 1), (2, 1, 0)],
+        [(1, 2)],
+    )
+    await async_app_client.delete(
+        "/tweets/1/likes", headers={"api-key": "123a"}
+    )
+    await async_app_client.delete(
+        "/tweets/1/likes", headers={"api-key": "123a"}
+    )
+    assert await counters_of(session_test) == (
+        [(1, 0, 1), (2, 1, 0)],
+        [(1, 1)],
+    )
+
+
+async def test_follow_counters(async_app_client, session_test) -> None:
+    await async_app_client.post("/users/1/follow", headers={"api-key": "124a"})
+    assert await counters_of(session_test) == (
+        [(1, 1, 1), (2, 1, 1)],
+        [(1, 1)],
+    )
+    await async_app_client.delete(
+        "/users/2/follow", headers={"api-key": "123a"}
+    )
+    await async_app_client.delete(
+        "/users/2/follow", headers={"api-key": "123a"}
+    )
+    assert await counters_of(session_test) == (
+        [(1, 1, 0), (2, 0, 1)],
+        [(1, 1)],
+    )
+
+
+async def test_repair_counters(async_app_client, session_test) -> None:
+    session_test.add(Likes(tweet_id=1, likers_id=2))
+    await session_test.commit()
+    await repair_counters(session_test)
+    assert await counters_of(session_test) == (
+        [(1, 0, 1), (2, 1, 0)],
+        [(1, 2)],
+    )
+
+
+async def test_like_batch(async_app_client, session_test) -> None:
+    await add_tweets(async_app_client, "123a", 1)
+    resp = await async_app_client.post(
+        "/likes:batch",
+        json={"tweet_ids": [2, 1, 100, 2]},
+        headers={"api-key": "123a"},
+    )
+    assert resp.status_code == 200
+    exists = "Can't add like. You're already liked this tweet."
+    assert resp.json() == {
+        "result": True,
+        "results": [
+            {"tweet_id": 2, "result": True},
+            {"tweet_id": 1, "result": False, "error_message": exists},
+            {
+                "tweet_id": 100,
+                "result": False,
+                "error_message": "Can't add like. Please check your data.",
+            },
+            {"tweet_id": 2, "result": False, "error_message": exists},
+        ],
+    }
+    _, tweets = await counters_of(session_test)
+    assert tweets == [(1, 1), (2, 1)]
+
+
+async def test_follow_batch(async_app_client, session_test) -> None:
+    session_test.add(User(api_key="125a", name="name3"))
+    await session_test.commit()
+    await add_tweets(async_app_client, "125a", 2)
+    resp = await async_app_client.post(
+        "/follows:batch",
+        json={"user_ids": [3, 2, 1, 100]},
+        headers={"api-key": "123a"},
+    )
+    assert resp.status_code == 200
+    wrong = "Can't add new follow. Please check your data."
+    assert resp.json()["results"] == [
+        {"user_id": 3, "result": True},
+        {
+            "user_id": 2,
+            "result": False,
+            "error_message": (
+                "Can't add new follow. You're already following this user."
+            ),
+        },
+        {"user_id": 1, "result": False, "error_message": wrong},
+        {"user_id": 100, "result": False, "error_message": wrong},
+    ]
+    users, _ = await counters_of(session_test)
+    assert users == [(1, 0, 2), (2, 1, 0), (3, 1, 0)]
+    assert await timeline_of(session_test, 1) == [2, 3]
+
+
+async def test_add_new_tweet_batch(async_app_client, session_test) -> None:
+    await add_media(async_app_client)
+    resp = await async_app_client.post(
+        "/tweets:batch",
+        json={
+            "tweets": [
+                {"tweet_data": "first", "tweet_media_ids": [1]},
+                {"tweet_data": "wrong", "tweet_media_ids": [1, 100]},
+                {"tweet_data": "second"},
+            ]
+        },
+        headers={"api-key": "124a"},
+    )
+    assert resp.status_code == 200
+    assert resp.json()["results"] == [
+        {"result": False, "error_message": (
+            "Can't add new tweet. Please check your data."
+        )},
+        {"result": False, "error_message": (
+            "Can't add new tweet. Please check your data."
+        )},
+        {"result": True, "tweet_id": 2},
+    ]
+
+    resp = await async_app_client.post(
+        "/tweets:batch",
+        json={
+            "tweets": [
+                {"tweet_data": "first", "tweet_media_ids": [1]},
+                {"tweet_data": "second"},
+            ]
+        },
+        headers={"api-key": "123a"},
+    )
+    assert resp.json()["results"] == [
+        {"result": True, "tweet_id": 3},
+        {"result": True, "tweet_id": 4},
+    ]
+    contents = await session_test.execute(
+        select(Tweets.content, Tweets.attachments).order_by(Tweets.id)
+    )
+    assert contents.all() == [
+        ("content", None),
+        ("second", []),
+        ("first", [1]),
+        ("second", []),
+    ]
+    attached = await session_test.execute(select(Media.attached))
+    assert attached.scalars().all() == [True]
+    assert await timeline_of(session_test, 1) == [2]
+
+
+async def test_batch_too_large(async_app_client, monkeypatch) -> None:
+    monkeypatch.setattr(routes, "BATCH_MAX_SIZE", 2)
+    resp = await async_app_client.post(
+        "/likes:batch",
+        json={"tweet_ids": [1, 2, 3]},
+        headers={"api-key": "123a"},
+    )
+    assert resp.status_code == 400
+    assert resp.json()["error_message"] == (
+        "Can't process batch. No more than 2 items."
+    )
+
+
+@pytest.mark.parametrize(
+    "api_key, method, url, payload, max_statements",
+    [
+        # Блокировка автора (lock_users) и сам твит
+        ("124a", "post", "/tweets", {"tweet_data": "data"}, 2),
+        (
+            "123a",
+            "post",
+            "/tweets",
+            {"tweet_data": "data", "tweet_media_ids": [1, 2]},
+            2,
+        ),
+        ("124a", "delete", "/tweets/1", None, 1),
+        # Блокировка обоих пользователей и сама подписка
+        ("124a", "post", "/users/1/follow", None, 2),
+        ("123a", "delete", "/users/2/follow", None, 2),
+        ("124a", "post", "/tweets/1/likes", None, 1),
+        ("123a", "delete", "/tweets/1/likes", None, 1),
+    ],
+)
+async def test_mutation_statements(
+    async_app_client,
+    query_budget,
+    api_key,
+    method,
+    url,
+    payload,
+    max_statements,
+) -> None:
+    await add_media(async_app_client, extra=b"1")
+    await add_media(async_app_client, extra=b"2")
+    # Первый запрос с ключом кэширует его, дальше ключ не проверяется
+    await async_app_client.get("/users/me", headers={"api-key": api_key})
+    kwargs = {"json": payload} if payload is not None else {}
+    with query_budget(max_statements=max_statements):
+        resp = await async_app_client.request(
+            method, url, headers={"api-key": api_key}, **kwargs
+        )
+    assert resp.status_code == 200, resp.json()
+
+
+async def test_add_new_media_is_single_statement(
+    async_app_client, query_budget
+) -> None:
+    await add_media(async_app_client)
+    with query_budget(max_statements=1):
+        resp = await add_media(async_app_client)
+    assert resp.status_code == 200
+
+
+@pytest.mark.parametrize(
+    "url, max_statements",
+    [
+        # api-key уже в кэше после запросов теста. Id твитов подписок,
+        # id остальных твитов, твиты с картинками и лайками
+        ("/tweets", 3),
+        # Профиль вместе с подписчиками и подписками
+        ("/users/me", 1),
+        ("/users/2", 1),
+    ],
+)
+async def test_read_query_budget(
+    async_app_client, query_budget, url, max_statements
+) -> None:
+    # Количество запросов не зависит от количества твитов, лайков
+    # и подписок
+    for index in range(5):
+        media = await add_media(async_app_client, extra=str(index).encode())
+        await async_app_client.post(
+            "/tweets",
+            json={
+                "tweet_data": f"tweet {index}",
+                "tweet_media_ids": [media.json()["media_id"]],
+            },
+            headers={"api-key": "123a"},
+        )
+    for tweet_id in range(2, 7):
+        await async_app_client.post(
+            f"/tweets/{tweet_id}/likes", headers={"api-key": "123a"}
+        )
+    await async_app_client.post("/users/1/follow", headers={"api-key": "124a"})
+    routes.clear_profiles()
+    with query_budget(max_statements=max_statements):
+        resp = await async_app_client.get(url, headers={"api-key": "123a"})
+    assert resp.status_code == 200, resp.json()
+
+
 def extract_filename(filename):
     if filename in os.listdir(DOWNLOADS):
         return filename
@@ -360,6 +999,7 @@ async def test_feed_with_media(async_app_client) -> None:
     await async_app_client.post(
         "/tweets", json=data, headers={"api-key": "123a"}
     )
+    await wait_for_variants()
     resp = await async_app_client.get("/tweets", headers={"api-key": "123a"})
     data = resp.json()
     my_data = {
@@ -367,6 +1007,7 @@ async def test_feed_with_media(async_app_client) -> None:
         "tweets": [
             {
                 "attachments": [],
+                "attachment_variants": [],
                 "author": {
                     "id": 2,
                     "name": "name2",
@@ -382,6 +1023,7 @@ async def test_feed_with_media(async_app_client) -> None:
             },
             {
                 "attachments": [],
+                "attachment_variants": [],
                 "author": {
                     "id": 1,
                     "name": "name",
@@ -391,15 +1033,509 @@ async def test_feed_with_media(async_app_client) -> None:
                 "likes": [],
             },
         ],
+        "next_cursor": None,
     }
     for filename in data["tweets"][1]["attachments"]:
         my_data["tweets"][1]["attachments"].append(
             "static/images/" + extract_filename(filename.split("/")[-1])
         )
+        checksum = filename.split("/")[-1].split(".")[0]
+        my_data["tweets"][1]["attachment_variants"].append(
+            {
+                width: "static/images/"
+                + extract_filename(f"{checksum}_{width}.webp")
+                for width in ("320", "640", "1280")
+            }
+        )
     assert resp.status_code == 200
     assert data == my_data
 
 
+async def add_tweets(async_app_client, api_key, count):
+    for i in range(count):
+        await async_app_client.post(
+            "/tweets",
+            json={"tweet_data": str(i)},
+            headers={"api-key": api_key},
+        )
+
+
+async def test_feed_pagination(async_app_client) -> None:
+    await add_tweets(async_app_client, "123a", 4)
+    await add_tweets(async_app_client, "124a", 3)
+    resp = await async_app_client.get(
+        "/tweets", params={"limit": 3}, headers={"api-key": "123a"}
+    )
+    data = resp.json()
+    assert resp.status_code == 200
+    # Сначала твиты автора, на которого подписан пользователь,
+    # затем остальные в порядке убывания id
+    assert [tweet["id"] for tweet in data["tweets"]] == [8, 7, 6]
+    assert data["next_cursor"] is not None
+
+
+async def walk_feed(async_app_client, api_key, limit=2, cursor=None):
+    """id твитов ленты по всем страницам, начиная с cursor, каждый
+    твит - один раз."""
+    seen: list = []
+    while True:
+        params = {"limit": limit}
+        if cursor is not None:
+            params["cursor"] = cursor
+        resp = await async_app_client.get(
+            "/tweets", params=params, headers={"api-key": api_key}
+        )
+        data = resp.json()
+        assert resp.status_code == 200
+        seen.extend(tweet["id"] for tweet in data["tweets"])
+        cursor = data["next_cursor"]
+        if cursor is None:
+            break
+    assert len(seen) == len(set(seen))
+    return seen
+
+
+async def test_feed_pagination_walk_all_pages(async_app_client) -> None:
+    await add_tweets(async_app_client, "123a", 5)
+    await add_tweets(async_app_client, "124a", 6)
+    resp = await async_app_client.get(
+        "/tweets", params={"limit": 100}, headers={"api-key": "123a"}
+    )
+    expected = [tweet["id"] for tweet in resp.json()["tweets"]]
+
+    seen = await walk_feed(async_app_client, "123a")
+    assert seen == expected
+    assert sorted(seen) == list(range(1, 13))
+
+
+async def test_feed_walk_with_follow_between_pages(
+    async_app_client, session_test
+) -> None:
+    session_test.add(User(api_key="125a", name="name3"))
+    await session_test.commit()
+    # У автора 2 два подписчика, у автора 3 - один (пользователь 1)
+    await async_app_client.post("/users/2/follow", headers={"api-key": "125a"})
+    await async_app_client.post("/users/3/follow", headers={"api-key": "123a"})
+    await add_tweets(async_app_client, "124a", 3)
+    await add_tweets(async_app_client, "125a", 3)
+    await add_tweets(async_app_client, "123a", 2)
+
+    resp = await async_app_client.get(
+        "/tweets", params={"limit": 2}, headers={"api-key": "123a"}
+    )
+    first = [tweet["id"] for tweet in resp.json()["tweets"]]
+    assert first == [4, 3]
+    # Между страницами у автора 3 становится столько же подписчиков,
+    # сколько у автора 2: его твиты не должны пропасть или повториться
+    await async_app_client.post("/users/3/follow", headers={"api-key": "124a"})
+    rest = await walk_feed(
+        async_app_client, "123a", cursor=resp.json()["next_cursor"]
+    )
+    assert first + rest == [4, 3, 2, 7, 6, 5, 1, 9, 8]
+
+
+async def test_feed_fail_cursor(async_app_client) -> None:
+    resp = await async_app_client.get(
+        "/tweets", params={"cursor": "abc"}, headers={"api-key": "123a"}
+    )
+    data = resp.json()
+    assert resp.status_code == 400
+    assert data == {
+        "result": False,
+        "error_type": "Exception",
+        "error_message": "Wrong cursor. Please check your data.",
+    }
+
+
+async def search(async_app_client, q, **params):
+    resp = await async_app_client.get(
+        "/tweets/search",
+        params={"q": q, **params},
+        headers={"api-key": "123a"},
+    )
+    assert resp.status_code == 200, resp.json()
+    return resp.json()
+
+
+async def add_texts(async_app_client, texts):
+    for text in texts:
+        await async_app_client.post(
+            "/tweets", json={"tweet_data": text}, headers={"api-key": "124a"}
+        )
+
+
+async def test_search_tweets_ranked(async_app_client) -> None:
+    await add_texts(
+        async_app_client,
+        ["Cats and dogs", "cats, cats and more cats", "only dogs", "birds"],
+    )
+    data = await search(async_app_client, "cats")
+    # Твит, где слово встречается чаще, выше
+    assert [tweet["id"] for tweet in data["tweets"]] == [3, 2]
+    assert data["next_cursor"] is None
+
+    data = await search(async_app_client, "dogs -cats")
+    assert [tweet["id"] for tweet in data["tweets"]] == [4]
+    data = await search(async_app_client, '"and more"')
+    assert [tweet["id"] for tweet in data["tweets"]] == [3]
+    data = await search(async_app_client, "birds or only")
+    assert sorted(tweet["id"] for tweet in data["tweets"]) == [4, 5]
+    data = await search(async_app_client, "elephants")
+    assert data == {
+        "result": True,
+        "tweets": [],
+        "next_cursor": None,
+        "truncated": False,
+    }
+
+
+async def test_search_tweets_same_items_as_feed(async_app_client) -> None:
+    media = await add_media(async_app_client)
+    await async_app_client.post(
+        "/tweets",
+        json={
+            "tweet_data": "a photo of my cat",
+            "tweet_media_ids": [media.json()["media_id"]],
+        },
+        headers={"api-key": "123a"},
+    )
+    await async_app_client.post("/tweets/2/likes", headers={"api-key": "124a"})
+    [found] = (await search(async_app_client, "cat photo"))["tweets"]
+    resp = await async_app_client.get("/tweets", headers={"api-key": "123a"})
+    [in_feed] = [
+        tweet for tweet in resp.json()["tweets"] if tweet["id"] == found["id"]
+    ]
+    assert found == in_feed
+    assert found["likes"] == [{"user_id": 2, "name": "name2"}]
+
+
+async def test_search_tweets_walk_all_pages(async_app_client) -> None:
+    # Одинаковая релевантность у многих твитов: порядок задаёт id
+    await add_texts(
+        async_app_client,
+        ["news " * (i % 3 + 1) + str(i) for i in range(9)],
+    )
+    expected = [
+        tweet["id"]
+        for tweet in (await search(async_app_client, "news"))["tweets"]
+    ]
+    seen = []
+    cursor = None
+    while True:
+        params = {"limit": 2}
+        if cursor is not None:
+            params["cursor"] = cursor
+        data = await search(async_app_client, "news", **params)
+        seen.extend(tweet["id"] for tweet in data["tweets"])
+        cursor = data["next_cursor"]
+        if cursor is None:
+            break
+    assert seen == expected
+    assert sorted(seen) == list(range(2, 11))
+
+
+async def test_search_ranks_newest_matches(
+    async_app_client, session_test
+) -> None:
+    await add_texts(
+        async_app_client, ["cats cats cats", "cats", "cats and dogs"]
+    )
+    page = await session_test.execute(
+        routes.search_page_query("cats", 10, None, window=2)
+    )
+    # Самый релевантный, но самый старый твит 2 не попал в окно,
+    # у остальных релевантность одинаковая
+    assert [row.id for row in page] == [4, 3]
+
+
+async def test_search_tweets_truncated(
+    async_app_client, monkeypatch
+) -> None:
+    await add_texts(
+        async_app_client, ["cats cats cats", "cats", "cats and dogs"]
+    )
+    monkeypatch.setattr(routes, "SEARCH_RANK_WINDOW", 2)
+    pages = []
+    cursor = None
+    while True:
+        params = {"limit": 1}
+        if cursor is not None:
+            params["cursor"] = cursor
+        data = await search(async_app_client, "cats", **params)
+        pages.append(
+            ([tweet["id"] for tweet in data["tweets"]], data["truncated"])
+        )
+        cursor = data["next_cursor"]
+        if cursor is None:
+            break
+    # Выдача заканчивается на окне из двух самых новых совпадений,
+    # и последняя страница сообщает, что совпадения за окном есть
+    assert pages == [([4], False), ([3], True)]
+
+    monkeypatch.setattr(routes, "SEARCH_RANK_WINDOW", 3)
+    data = await search(async_app_client, "cats")
+    assert [tweet["id"] for tweet in data["tweets"]] == [2, 4, 3]
+    assert data["truncated"] is False
+
+
+async def test_search_tweets_fail(async_app_client) -> None:
+    resp = await async_app_client.get(
+        "/tweets/search",
+        params={"q": "cats", "cursor": "abc"},
+        headers={"api-key": "123a"},
+    )
+    assert resp.status_code == 400
+    assert resp.json()["error_message"] == (
+        "Wrong cursor. Please check your data."
+    )
+    resp = await async_app_client.get(
+        "/tweets/search", params={"q": ""}, headers={"api-key": "123a"}
+    )
+    assert resp.status_code == 422
+
+
+async def legacy_feed_items(session_test, tweet_ids):
+    """Сборка твитов через JOIN всех таблиц и дедупликацию в Python,
+    как это делала лента до агрегации в базе."""
+    author = aliased(User, name="user_1")
+    liker = aliased(User, name="user_2")
+    rows = await session_test.execute(
+        select(
+            Tweets.id,
+            Tweets.content,
+            Tweets.author_id,
+            author.name,
+            Media.file,
+            Likes.likers_id,
+            liker.name,
+        )
+        .outerjoin(Media, Media.id == any_(Tweets.attachments))
+        .outerjoin(Likes, Likes.tweet_id == Tweets.id)
+        .outerjoin(author, author.id == Tweets.author_id)
+        .outerjoin(liker, liker.id == Likes.likers_id)
+        .where(Tweets.id.in_(tweet_ids))
+    )
+    tweets: dict = {}
+    for row in rows:
+        tweet = tweets.setdefault(
+            row[0],
+            {
+                "id": row[0],
+                "content": row[1],
+                "attachments": set(),
+                "author": {"id": row[2], "name": row[3]},
+                "likes": set(),
+            },
+        )
+        if row[4]:
+            tweet["attachments"].add(os.path.join(DOWNLOADS, row[4]))
+        if row[5]:
+            tweet["likes"].add((row[5], row[6]))
+    return [
+        {
+            **tweets[tweet_id],
+            "attachments": sorted(tweets[tweet_id]["attachments"]),
+            "likes": sorted(tweets[tweet_id]["likes"]),
+        }
+        for tweet_id in tweet_ids
+    ]
+
+
+async def test_feed_matches_legacy_dedup(
+    async_app_client, session_test
+) -> None:
+    session_test.add(User(api_key="125a", name="name3"))
+    await session_test.commit()
+    for i in range(3):
+        await add_media(async_app_client, extra=bytes([i]))
+    for data in (
+        {"tweet_data": "a", "tweet_media_ids": [1, 2, 3]},
+        {"tweet_data": "b", "tweet_media_ids": [2]},
+        {"tweet_data": "c"},
+    ):
+        await async_app_client.post(
+            "/tweets", json=data, headers={"api-key": "123a"}
+        )
+    await add_tweets(async_app_client, "125a", 2)
+    for api_key in ("123a", "124a", "125a"):
+        await async_app_client.post(
+            "/users/1/follow", headers={"api-key": api_key}
+        )
+        for tweet_id in (1, 2, 3, 5):
+            await async_app_client.post(
+                f"/tweets/{tweet_id}/likes", headers={"api-key": api_key}
+            )
+
+    resp = await async_app_client.get("/tweets", headers={"api-key": "125a"})
+    tweets = resp.json()["tweets"]
+    assert len(tweets) == 6
+    expected = await legacy_feed_items(
+        session_test, [tweet["id"] for tweet in tweets]
+    )
+    for tweet in tweets:
+        del tweet["attachment_variants"]
+    assert [
+        {
+            **tweet,
+            "attachments": sorted(tweet["attachments"]),
+            "likes": sorted(
+                (like["user_id"], like["name"]) for like in tweet["likes"]
+            ),
+        }
+        for tweet in tweets
+    ] == expected
+
+
+async def test_media_variants_generated(
+    async_app_client, session_test
+) -> None:
+    await add_media(async_app_client)
+    await wait_for_variants()
+    result = await session_test.execute(
+        select(Media.checksum, Media.variants_status)
+    )
+    [(checksum, status)] = result.all()
+    assert status == "ready"
+    for width, expected in ((320, 320), (640, 435), (1280, 435)):
+        path = os.path.join(DOWNLOADS, f"{checksum}_{width}.webp")
+        with Image.open(path) as image:
+            assert image.format == "WEBP"
+            assert image.width == expected
+
+
+async def test_media_variants_fall_back_to_original(
+    async_app_client, session_test
+) -> None:
+    broken_image = b"\xff\xd8\xff" + b"0" * 100
+    files = {"file": ("image.jpg", broken_image, "image/jpeg")}
+    await async_app_client.post(
+        "/medias", files=files, headers={"api-key": "123a"}
+    )
+    await async_app_client.post(
+        "/tweets",
+        json={"tweet_data": "123", "tweet_media_ids": [1]},
+        headers={"api-key": "123a"},
+    )
+    await wait_for_variants()
+    result = await session_test.execute(select(Media.variants_status))
+    assert result.scalars().all() == ["failed"]
+    resp = await async_app_client.get("/tweets", headers={"api-key": "123a"})
+    [tweet] = [t for t in resp.json()["tweets"] if t["id"] == 2]
+    [original] = tweet["attachments"]
+    assert tweet["attachment_variants"] == [
+        {"320": original, "640": original, "1280": original}
+    ]
+
+
+@pytest_asyncio.fixture
+async def media_client(app, session_test):
+    routes.app.dependency_overrides[get_db_session] = lambda: session_test
+    transport = ASGITransport(app=routes.app)
+    async with AsyncClient(transport=transport, base_url="http://test") as c:
+        yield c
+    routes.app.dependency_overrides.clear()
+
+
+async def test_get_media(async_app_client, media_client, session_test) -> None:
+    await add_media(async_app_client)
+    [(file, checksum)] = (
+        await session_test.execute(select(Media.file, Media.checksum))
+    ).all()
+    with open(os.path.join(DOWNLOADS, file), "rb") as f:
+        content = f.read()
+    resp = await media_client.get("/media/1")
+    assert resp.status_code == 200
+    assert resp.content == content
+    assert resp.headers["content-type"] == "image/jpeg"
+    assert resp.headers["etag"] == f'"{checksum}"'
+    assert "immutable" in resp.headers["cache-control"]
+    assert resp.headers["accept-ranges"] == "bytes"
+
+    resp = await media_client.get(
+        "/media/1", headers={"if-none-match": f'W/"{checksum}"'}
+    )
+    assert resp.status_code == 304
+    assert resp.content == b""
+
+
+async def test_get_media_range(async_app_client, media_client) -> None:
+    await add_media(async_app_client)
+    full = (await media_client.get("/media/1")).content
+    size = len(full)
+    for header, start, end in (
+        ("bytes=0-9", 0, 9),
+        ("bytes=100-", 100, size - 1),
+        ("bytes=-50", size - 50, size - 1),
+        (f"bytes=10-{size * 2}", 10, size - 1),
+    ):
+        resp = await media_client.get("/media/1", headers={"range": header})
+        assert resp.status_code == 206
+        assert resp.content == full[start:end + 1]
+        assert resp.headers["content-range"] == f"bytes {start}-{end}/{size}"
+
+    resp = await media_client.get(
+        "/media/1", headers={"range": f"bytes={size}-"}
+    )
+    assert resp.status_code == 416
+    assert resp.headers["content-range"] == f"bytes */{size}"
+
+    # Несколько диапазонов и устаревший If-Range отдают файл целиком
+    for headers in (
+        {"range": "bytes=0-1,5-6"},
+        {"range": "bytes=0-9", "if-range": '"old"'},
+    ):
+        resp = await media_client.get("/media/1", headers=headers)
+        assert resp.status_code == 200
+        assert resp.content == full
+
+
+async def test_get_media_accel_redirect(
+    async_app_client, media_client, session_test, monkeypatch
+) -> None:
+    monkeypatch.setattr(routes, "MEDIA_ACCEL_PREFIX", "/internal-media/")
+    await add_media(async_app_client)
+    [(file, checksum)] = (
+        await session_test.execute(select(Media.file, Media.checksum))
+    ).all()
+    # Файл и диапазоны байт отдаёт nginx, приложение только указывает путь
+    for headers in ({}, {"range": "bytes=0-9"}):
+        resp = await media_client.get("/media/1", headers=headers)
+        assert resp.status_code == 200
+        assert resp.content == b""
+        assert resp.headers["x-accel-redirect"] == f"/internal-media/{file}"
+        assert resp.headers["content-type"] == "image/jpeg"
+        assert resp.headers["etag"] == f'"{checksum}"'
+        assert "immutable" in resp.headers["cache-control"]
+
+    resp = await media_client.get(
+        "/media/1", headers={"if-none-match": f'"{checksum}"'}
+    )
+    assert resp.status_code == 304
+    assert "x-accel-redirect" not in resp.headers
+
+
+async def test_get_media_variant(async_app_client, media_client) -> None:
+    await add_media(async_app_client)
+    await wait_for_variants()
+    resp = await media_client.get("/media/1", params={"width": 320})
+    assert resp.status_code == 200
+    assert resp.headers["content-type"] == "image/webp"
+    assert resp.headers["etag"].endswith('_320"')
+
+    resp = await media_client.get("/media/1", params={"width": 1})
+    assert resp.status_code == 400
+
+
+async def test_get_media_not_exists(media_client) -> None:
+    resp = await media_client.get("/media/100")
+    assert resp.status_code == 404
+    assert resp.json() == {
+        "result": False,
+        "error_type": "Exception",
+        "error_message": "Can't show media. Please check your data.",
+    }
+
+
 async def test_feed_fail_api_key(async_app_client) -> None:
     resp = await async_app_client.get("/tweets", headers={"api-key": "555"})
     data = resp.json()
@@ -422,10 +1558,31 @@ async def test_user_info_self(async_app_client) -> None:
             "name": "name",
             "followers": [],
             "following": [{"id": 2, "name": "name2"}],
+            "followers_count": 0,
+            "following_count": 1,
         },
+        "followers_next_cursor": None,
+        "following_next_cursor": None,
     }
 
 
+async def test_responses_are_typed(async_app_client) -> None:
+    schema = routes.app_api.openapi()
+    for path, method, model in (
+        ("/tweets", "get", "Feed"),
+        ("/users/me", "get", "Profile"),
+        ("/users/{id}", "get", "Profile"),
+        ("/tweets", "post", "TweetCreated"),
+        ("/likes:batch", "post", "LikesBatchResult"),
+    ):
+        response = schema["paths"][path][method]["responses"]["200"]
+        assert response["content"]["application/json"]["schema"] == {
+            "$ref": f"#/components/schemas/{model}"
+        }
+    resp = await async_app_client.get("/tweets", headers={"api-key": "123a"})
+    assert resp.headers["content-type"] == "application/json"
+
+
 async def test_user_info_self_fail_api_key(async_app_client) -> None:
     resp = await async_app_client.get("/users/me", headers={"api-key": "555"})
     data = resp.json()
@@ -448,10 +1605,61 @@ async def test_user_info_others(async_app_client) -> None:
             "name": "name2",
             "followers": [{"id": 1, "name": "name"}],
             "following": [],
+            "followers_count": 1,
+            "following_count": 0,
         },
+        "followers_next_cursor": None,
+        "following_next_cursor": None,
     }
 
 
+async def test_user_info_followers_pages(
+    async_app_client, session_test
+) -> None:
+    session_test.add_all(
+        [User(api_key=f"{i}k", name=f"user{i}") for i in range(3, 8)]
+    )
+    await session_test.commit()
+    session_test.add_all(
+        [Followers(followers_id=i, following_id=2) for i in range(3, 8)]
+    )
+    await session_test.commit()
+    await repair_counters(session_test)
+
+    followers, cursor = [], None
+    while True:
+        params = {"followers_limit": 2, "following_limit": 1}
+        if cursor is not None:
+            params["followers_cursor"] = cursor
+        resp = await async_app_client.get(
+            "/users/2", params=params, headers={"api-key": "123a"}
+        )
+        data = resp.json()
+        assert data["user"]["followers_count"] == 6
+        assert len(data["user"]["followers"]) <= 2
+        followers += data["user"]["followers"]
+        cursor = data["followers_next_cursor"]
+        if cursor is None:
+            break
+    assert [user["id"] for user in followers] == [1, 3, 4, 5, 6, 7]
+    assert data["following_next_cursor"] is None
+
+    # Страницы не по умолчанию не кэшируются
+    assert routes.profile_cache.get(2) is MISSING
+
+
+async def test_user_info_wrong_cursor(async_app_client) -> None:
+    resp = await async_app_client.get(
+        "/users/2",
+        params={"following_cursor": "bad"},
+        headers={"api-key": "123a"},
+    )
+    assert resp.status_code == 400
+    assert resp.json()["error_message"] == (
+        "Wrong cursor. Please check your data."
+    )
+
+
 async def test_user_info_others_fail_key(async_app_client) -> None:
     resp = await async_app_client.get("/users/1", headers={"api-key": "555"})
     data = resp.json()
@@ -472,3 +1680,53 @@ async def test_user_info_others_fail_id(async_app_client) -> None:
         "error_type": "Exception",
         "error_message": "Can't show users info. Please check your data.",
     }
+
+
+async def test_user_info_cached(async_app_client, query_budget) -> None:
+    await async_app_client.get("/users/me", headers={"api-key": "124a"})
+    await async_app_client.get("/users/1", headers={"api-key": "124a"})
+    with query_budget(max_statements=0):
+        resp = await async_app_client.get(
+            "/users/1", headers={"api-key": "124a"}
+        )
+    assert resp.json()["user"]["followers_count"] == 0
+
+    await async_app_client.post("/users/1/follow", headers={"api-key": "124a"})
+    resp = await async_app_client.get("/users/1", headers={"api-key": "124a"})
+    assert resp.json()["user"]["followers"] == [{"id": 2, "name": "name2"}]
+    resp = await async_app_client.get("/users/me", headers={"api-key": "124a"})
+    assert resp.json()["user"]["following"] == [{"id": 1, "name": "name"}]
+
+    await async_app_client.delete(
+        "/users/1/follow", headers={"api-key": "124a"}
+    )
+    resp = await async_app_client.get("/users/1", headers={"api-key": "124a"})
+    assert resp.json()["user"]["followers"] == []
+
+
+async def test_user_info_invalidated_by_notify(
+    async_app_client, session_test
+) -> None:
+    listener = NotifyListener(asyncpg_dsn(engine.url))
+    received = asyncio.Queue()
+
+    def on_notify(payload):
+        routes.invalidate_profiles(payload)
+        received.put_nowait(payload)
+
+    listener.subscribe(routes.PROFILE_CHANNEL, on_notify)
+    listener.start()
+    try:
+        await asyncio.wait_for(listener.connected.wait(), 5)
+        await async_app_client.get("/users/2", headers={"api-key": "123a"})
+        assert routes.profile_cache.get(2) is not MISSING
+
+        # Подписка в другом воркере: в этом процессе кэш сбрасывается
+        # только уведомлением
+        await session_test.execute(select(routes.notify_profiles(2, 3)))
+        assert routes.profile_cache.get(2) is not MISSING
+        await session_test.commit()
+        assert await asyncio.wait_for(received.get(), 5) == "2,3"
+        assert routes.profile_cache.get(2) is MISSING
+    finally:
+        await listener.stop()
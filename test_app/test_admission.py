@@ -0,0 +1,184 @@
+import asyncio
+
+import pytest
+from fastapi import FastAPI
+from httpx import ASGITransport, AsyncClient
+from prometheus_client import REGISTRY
+
+from app.admission import (
+    AdmissionMiddleware,
+    ConcurrencyLimit,
+    RateLimiter,
+    parse_limits,
+    parse_routes,
+)
+
+
+class FakeTimer:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def sample(name: str, route: str) -> float:
+    return REGISTRY.get_sample_value(name, {"route": route}) or 0.0
+
+
+def test_parse_limits() -> None:
+    assert parse_limits("GET /tweets=16, POST  /medias=4,") == {
+        "GET /tweets": 16,
+        "POST /medias": 4,
+    }
+    assert parse_routes("GET  /tweets/stream, ,POST /x") == {
+        "GET /tweets/stream",
+        "POST /x",
+    }
+
+
+def test_rate_limiter() -> None:
+    timer = FakeTimer()
+    limiter = RateLimiter(rate=2, burst=3, timer=timer)
+    assert [limiter.take("a") for _ in range(3)] == [0, 0, 0]
+    assert limiter.take("a") == pytest.approx(0.5)
+    # У другого ключа свой запас
+    assert limiter.take("b") == 0
+    timer.now = 0.5
+    assert limiter.take("a") == 0
+    assert limiter.take("a") > 0
+    timer.now = 100
+    assert [limiter.take("a") for _ in range(3)] == [0, 0, 0]
+
+
+@pytest.mark.asyncio
+async def test_concurrency_limit_queue() -> None:
+    limit = ConcurrencyLimit(limit=1, queue_size=1, timeout=0.05)
+    assert await limit.acquire()
+    waiter = asyncio.create_task(limit.acquire())
+    await asyncio.sleep(0)
+    assert limit.waiting == 1
+    # Очередь заполнена
+    assert not await limit.acquire()
+    limit.release()
+    assert await waiter
+    # Место в очереди есть, но время ожидания истекло
+    assert not await limit.acquire()
+    assert limit.waiting == 0
+    limit.release()
+    assert await limit.acquire()
+
+
+def limited_app(**options) -> tuple:
+    app = FastAPI()
+    app.add_middleware(AdmissionMiddleware, **options)
+    started = asyncio.Event()
+    finish = asyncio.Event()
+
+    @app.get("/slow")
+    async def slow():
+        started.set()
+        await finish.wait()
+        return {"result": True}
+
+    @app.get("/stream")
+    async def stream():
+        started.set()
+        await finish.wait()
+        return {"result": True}
+
+    @app.get("/fast")
+    async def fast():
+        return {"result": True}
+
+    return app, started, finish
+
+
+@pytest.mark.asyncio
+async def test_route_concurrency_shed() -> None:
+    app, started, finish = limited_app(
+        limits={"GET /slow": 1}, queue_size=0, queue_timeout=2
+    )
+    shed = sample("http_requests_shed_total", "/slow")
+    async with AsyncClient(
+        transport=ASGITransport(app=app), base_url="http://test"
+    ) as client:
+        first = asyncio.create_task(client.get("/slow"))
+        await started.wait()
+        resp = await client.get("/slow")
+        assert resp.status_code == 503
+        assert resp.headers["Retry-After"] == "2"
+        assert resp.json() == {
+            "result": False,
+            "error_type": "Exception",
+            "error_message": "Server is busy. Please retry later.",
+        }
+        # Лимит у каждого маршрута свой
+        assert (await client.get("/fast")).status_code == 200
+        finish.set()
+        assert (await first).status_code == 200
+        assert (await client.get("/slow")).status_code == 200
+    assert sample("http_requests_shed_total", "/slow") == shed + 1
+
+
+@pytest.mark.asyncio
+async def test_api_key_rate_limit() -> None:
+    app, _, _ = limited_app(rate=1, burst=2)
+    throttled = sample("http_requests_throttled_total", "/fast")
+    async with AsyncClient(
+        transport=ASGITransport(app=app), base_url="http://test"
+    ) as client:
+        statuses = [
+            (await client.get("/fast", headers={"api-key": "a"})).status_code
+            for _ in range(3)
+        ]
+        assert statuses == [200, 200, 429]
+        resp = await client.get("/fast", headers={"api-key": "a"})
+        assert resp.headers["Retry-After"] == "1"
+        assert resp.json()["error_message"] == (
+            "Too many requests. Please retry later."
+        )
+        # Другой ключ и запросы без ключа не ограничены
+        assert (
+            await client.get("/fast", headers={"api-key": "b"})
+        ).status_code == 200
+        assert (await client.get("/fast")).status_code == 200
+    assert sample("http_requests_throttled_total", "/fast") == throttled + 2
+
+
+@pytest.mark.asyncio
+async def test_stream_exempt_from_default_limit() -> None:
+    app, started, finish = limited_app(
+        default_limit=1,
+        exempt=frozenset({"GET /stream"}),
+        queue_size=0,
+        rate=1,
+        burst=2,
+    )
+    async with AsyncClient(
+        transport=ASGITransport(app=app), base_url="http://test"
+    ) as client:
+        # Открытый поток не занимает место в лимите: второй поток
+        # выполняется одновременно с первым
+        first = asyncio.create_task(client.get("/stream"))
+        await started.wait()
+        started.clear()
+        second = asyncio.create_task(client.get("/stream"))
+        await asyncio.wait_for(started.wait(), 1)
+        finish.set()
+        assert (await first).status_code == 200
+        assert (await second).status_code == 200
+        # Ограничение частоты на поток действует
+        statuses = [
+            (await client.get("/stream", headers={"api-key": "a"})).status_code
+            for _ in range(3)
+        ]
+        assert statuses == [200, 200, 429]
+        # Лимит по умолчанию на остальные маршруты действует
+        finish.clear()
+        started.clear()
+        slow = asyncio.create_task(client.get("/slow"))
+        await started.wait()
+        assert (await client.get("/slow")).status_code == 503
+        finish.set()
+        assert (await slow).status_code == 200
@@ -0,0 +1,75 @@
+import pytest
+
+from app.cache import MISSING, TTLCache
+from app.routes import api_key_cache, invalidate_api_key
+
+
+class FakeTimer:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_cache_expires_entries() -> None:
+    timer = FakeTimer()
+    cache = TTLCache(maxsize=10, ttl=10, timer=timer)
+    cache.set("a", 1)
+    cache.set("b", 2, ttl=1)
+    timer.now = 5
+    assert cache.get("a") == 1
+    assert cache.get("b") is MISSING
+    timer.now = 11
+    assert cache.get("a") is MISSING
+    assert cache.stats() == {"size": 0, "hits": 1, "misses": 2}
+
+
+def test_cache_evicts_least_recently_used() -> None:
+    cache = TTLCache(maxsize=2, ttl=10)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is MISSING
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+def test_cache_invalidate_value() -> None:
+    cache = TTLCache(maxsize=10, ttl=10)
+    cache.set("a", 1)
+    cache.set("b", 1)
+    cache.set("c", 2)
+    cache.invalidate_value(1)
+    assert len(cache) == 1
+
+
+@pytest.mark.asyncio
+async def test_api_key_cached(async_app_client) -> None:
+    await async_app_client.get("/users/me", headers={"api-key": "123a"})
+    hits = api_key_cache.hits
+    resp = await async_app_client.get(
+        "/users/me", headers={"api-key": "123a"}
+    )
+    assert resp.status_code == 200
+    assert api_key_cache.hits == hits + 1
+
+
+@pytest.mark.asyncio
+async def test_wrong_api_key_cached(async_app_client) -> None:
+    await async_app_client.get("/users/me", headers={"api-key": "555"})
+    assert api_key_cache.get("555") is None
+    resp = await async_app_client.get("/users/me", headers={"api-key": "555"})
+    assert resp.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_invalidate_api_key(async_app_client) -> None:
+    await async_app_client.get("/users/me", headers={"api-key": "123a"})
+    await async_app_client.get("/users/me", headers={"api-key": "124a"})
+    invalidate_api_key(user_id=1)
+    assert api_key_cache.get("123a") is MISSING
+    assert api_key_cache.get("124a") == 2
+    invalidate_api_key(api_key="124a")
+    assert api_key_cache.get("124a") is MISSING
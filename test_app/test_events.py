@@ -0,0 +1,226 @@
+import asyncio
+import json
+
+import pytest
+
+from app import routes
+from app.events import (
+    FEED_CHANNEL,
+    REFOLLOW,
+    RESET,
+    FeedBroker,
+    event_stream,
+)
+from app.notify import NotifyListener, asyncpg_dsn
+from test_app.conftest import engine
+
+
+def payload(event_id: str, author_id: int, event_type: str = "tweet"):
+    return json.dumps(
+        {"id": event_id, "type": event_type, "tweet_id": 1,
+         "author_id": author_id, "user_id": None}
+    )
+
+
+def drain(subscriber) -> list:
+    items = []
+    while not subscriber.queue.empty():
+        item = subscriber.queue.get_nowait()
+        items.append(item if isinstance(item, str) else item.id)
+    return items
+
+
+def test_broker_delivers_to_followers() -> None:
+    broker = FeedBroker()
+    reader = broker.subscribe(1, {2})
+    author = broker.subscribe(2, set())
+    broker.publish(payload("a", 2))
+    broker.publish(payload("b", 3))
+    assert drain(reader) == ["a"]
+    # Свои события пользователь тоже получает
+    assert drain(author) == ["a"]
+
+    broker.set_following(reader, {3})
+    broker.publish(payload("c", 2))
+    broker.publish(payload("d", 3))
+    assert drain(reader) == ["d"]
+
+    broker.unsubscribe(reader)
+    broker.unsubscribe(author)
+    assert len(broker) == 0
+    assert broker.by_author == {}
+
+
+def test_broker_slow_subscriber_reset() -> None:
+    broker = FeedBroker(queue_size=2)
+    subscriber = broker.subscribe(1, {2})
+    for event_id in "abc":
+        broker.publish(payload(event_id, 2))
+    assert drain(subscriber) == [RESET]
+
+
+def test_broker_replay() -> None:
+    broker = FeedBroker(replay_size=3)
+    subscriber = broker.subscribe(1, {2})
+    for event_id, author_id in (("a", 2), ("b", 3), ("c", 2), ("d", 2)):
+        broker.publish(payload(event_id, author_id))
+    assert [event.id for event in broker.replay(subscriber, "b")] == [
+        "c", "d"
+    ]
+    assert broker.replay(subscriber, "d") == []
+    # "a" вытеснено из памяти
+    assert broker.replay(subscriber, "a") is None
+
+    broker.reset()
+    assert broker.replay(subscriber, "d") is None
+
+
+def test_broker_following_changed() -> None:
+    broker = FeedBroker()
+    subscriber = broker.subscribe(1, {2})
+    other = broker.subscribe(5, set())
+    broker.following_changed("1,3")
+    assert subscriber.refollow
+    assert drain(subscriber) == [REFOLLOW]
+    assert not other.refollow
+
+
+@pytest.mark.asyncio
+async def test_event_stream_heartbeat_and_refollow() -> None:
+    broker = FeedBroker()
+    subscriber = broker.subscribe(1, {2})
+
+    async def load_following():
+        return {3}
+
+    stream = event_stream(
+        broker, subscriber, None, load_following, heartbeat=0.01
+    )
+    assert await stream.__anext__() == "retry: 3000\n\n"
+    assert await stream.__anext__() == "event: reset\ndata: {}\n\n"
+    assert await stream.__anext__() == ": ping\n\n"
+
+    # Подписки перечитываются, пока поток ждёт событий
+    broker.following_changed("1")
+    assert await stream.__anext__() == ": ping\n\n"
+    assert subscriber.authors == {1, 3}
+    broker.publish(payload("a", 3))
+    event = await stream.__anext__()
+    assert event.startswith("id: a\nevent: tweet\ndata: ")
+    await stream.aclose()
+    assert len(broker) == 0
+
+
+@pytest.mark.asyncio
+async def test_mutations_notify_feed_events(async_app_client) -> None:
+    broker = FeedBroker()
+    listener = NotifyListener(asyncpg_dsn(engine.url))
+    listener.subscribe(FEED_CHANNEL, broker.publish)
+    listener.start()
+    # Пользователь 1 подписан на пользователя 2
+    subscriber = broker.subscribe(1, {2})
+    headers = {"api-key": "124a"}
+    try:
+        await asyncio.wait_for(listener.connected.wait(), 5)
+        await async_app_client.post(
+            "/tweets", json={"tweet_data": "new"}, headers=headers
+        )
+        await async_app_client.post("/tweets/1/likes", headers=headers)
+        # Повторный лайк ничего не меняет и не рассылается
+        await async_app_client.post("/tweets/1/likes", headers=headers)
+        await async_app_client.post(
+            "/tweets:batch",
+            json={"tweets": [{"tweet_data": "a"}, {"tweet_data": "b"}]},
+            headers=headers,
+        )
+        await async_app_client.post(
+            "/likes:batch", json={"tweet_ids": [2, 3]}, headers=headers
+        )
+        events = []
+        for _ in range(6):
+            event = await asyncio.wait_for(subscriber.queue.get(), 5)
+            events.append(json.loads(event.data))
+    finally:
+        await listener.stop()
+    assert [
+        (event["type"], event["tweet_id"], event["user_id"])
+        for event in events
+    ] == [
+        ("tweet", 2, None),
+        ("like", 1, 2),
+        ("tweet", 3, None),
+        ("tweet", 4, None),
+        ("like", 2, 2),
+        ("like", 3, 2),
+    ]
+    assert {event["author_id"] for event in events} == {2}
+    assert len({event["id"] for event in events}) == 6
+    assert subscriber.queue.empty()
+
+
+async def stream_request(app, headers: list, until: str):
+    """Запрос к потоку событий через ASGI: читает тело, пока в нём
+    не появится until, затем закрывает соединение."""
+    disconnected = asyncio.Event()
+    body = ""
+    started = {}
+
+    async def receive():
+        if not started:
+            started["request"] = True
+            return {"type": "http.request", "body": b""}
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal body
+        if message["type"] == "http.response.start":
+            started["status"] = message["status"]
+            started["headers"] = dict(message["headers"])
+        elif message["type"] == "http.response.body":
+            body += message.get("body", b"").decode()
+            if until in body:
+                disconnected.set()
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": "/tweets/stream",
+        "raw_path": b"/tweets/stream",
+        "root_path": "",
+        "query_string": b"",
+        "headers": headers,
+        "server": ("test", 80),
+        "client": ("127.0.0.1", 1000),
+    }
+    task = asyncio.create_task(app(scope, receive, send))
+    return task, started, lambda: body
+
+
+@pytest.mark.asyncio
+async def test_feed_stream_endpoint(app) -> None:
+    broker = routes.feed_broker
+    broker.publish(payload("stream-1", 2))
+    broker.publish(payload("stream-2", 2))
+    broker.publish(payload("stream-3", 3))
+    task, started, body = await stream_request(
+        app,
+        [(b"api-key", b"123a"), (b"last-event-id", b"stream-1")],
+        "id: stream-4",
+    )
+    # Пропущенное событие приходит сразу, событие чужого автора - нет
+    while "stream-2" not in body():
+        await asyncio.sleep(0.01)
+    broker.publish(payload("stream-4", 2, "like"))
+    await asyncio.wait_for(task, 5)
+    assert started["status"] == 200
+    assert started["headers"][b"content-type"].startswith(
+        b"text/event-stream"
+    )
+    assert body().startswith("retry: 3000\n\nid: stream-2\nevent: tweet\n")
+    assert "stream-3" not in body()
+    assert "id: stream-4\nevent: like\n" in body()
+    assert len(broker) == 0
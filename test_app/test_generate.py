@@ -0,0 +1,104 @@
+import asyncpg
+import pytest
+from sqlalchemy import func, select
+
+from app.counters import repair_counters
+from app.notify import asyncpg_dsn
+from app.routes import Likes, Timeline, Tweets, User
+from bench.generate import generate
+from test_app.conftest import engine
+
+pytestmark = pytest.mark.asyncio
+
+
+async def load(seed: int, **options) -> tuple:
+    conn = await asyncpg.connect(asyncpg_dsn(engine.url))
+    # Данные не сохраняются, чтобы загрузки не мешали друг другу
+    transaction = conn.transaction()
+    await transaction.start()
+    try:
+        written = await generate(
+            conn,
+            users=200,
+            tweets=500,
+            likes=3000,
+            follows=10,
+            seed=seed,
+            batch_size=128,
+            **options,
+        )
+        likes = await conn.fetch(
+            "SELECT tweet_id, likers_id FROM likes ORDER BY 1, 2"
+        )
+    finally:
+        await transaction.rollback()
+        await conn.close()
+    return written, likes
+
+
+async def test_generate_is_reproducible() -> None:
+    first = await load(seed=1)
+    assert first == await load(seed=1)
+    assert first[1] != (await load(seed=2))[1]
+
+
+async def test_generate_keeps_data_consistent(session_test) -> None:
+    conn = await asyncpg.connect(asyncpg_dsn(engine.url))
+    try:
+        written = await generate(
+            conn,
+            users=200,
+            tweets=500,
+            likes=3000,
+            follows=10,
+            media_ratio=0.2,
+            batch_size=128,
+            fanout=True,
+        )
+    finally:
+        await conn.close()
+    assert written["user"] == 200
+    assert written["tweets"] == 500
+    assert 2500 < written["likes"] < 3500
+    assert written["media"] > 0
+    assert written["timeline"] > 0
+
+    # Лайки сосредоточены на популярных твитах
+    top = await session_test.execute(
+        select(func.sum(Tweets.like_count)).where(
+            Tweets.id.in_(
+                select(Tweets.id)
+                .order_by(Tweets.like_count.desc())
+                .limit(50)
+                .scalar_subquery()
+            )
+        )
+    )
+    assert top.scalar() > written["likes"] / 2
+
+    # Счётчики записаны сразу и не расходятся с данными
+    before = (
+        await session_test.execute(
+            select(User.id, User.followers_count, User.following_count)
+            .order_by(User.id)
+        )
+    ).all()
+    await repair_counters(session_test)
+    after = (
+        await session_test.execute(
+            select(User.id, User.followers_count, User.following_count)
+            .order_by(User.id)
+        )
+    ).all()
+    assert before == after
+    assert (
+        await session_test.scalar(select(func.count()).select_from(Likes))
+        == written["likes"] + 1
+    )
+    assert await session_test.scalar(
+        select(func.count()).select_from(Timeline)
+    ) == written["timeline"]
+
+    # Последовательности сдвинуты за загруженные id
+    session_test.add(User(api_key="new", name="new"))
+    await session_test.commit()
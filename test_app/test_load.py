@@ -0,0 +1,70 @@
+import pytest
+import pytest_asyncio
+
+from app.models import get_db_session
+from bench.load import compare, percentile, run, sample_data
+from test_app.conftest import test_async_session as session_factory
+
+
+def test_percentile() -> None:
+    timings = [float(value) for value in range(1, 101)]
+    assert percentile(timings, 50) == 50
+    assert percentile(timings, 99) == 99
+    assert percentile(timings, 100) == 100
+    assert percentile([7.0], 95) == 7
+    assert percentile([], 95) == 0
+
+
+def test_compare_flags_regressions() -> None:
+    def report(rps, p95, errors=0):
+        return {
+            "endpoints": {
+                "feed": {
+                    "rps": rps,
+                    "p50_ms": 5,
+                    "p95_ms": p95,
+                    "p99_ms": 20,
+                    "errors": errors,
+                }
+            }
+        }
+
+    assert compare(report(100, 10), report(95, 10.5), 0.1) == []
+    assert compare(report(100, 10), report(80, 12, errors=1), 0.1) == [
+        ("feed", "rps", 100, 80),
+        ("feed", "p95_ms", 10, 12),
+        ("feed", "errors", 0, 1),
+    ]
+
+
+@pytest_asyncio.fixture
+async def concurrent_app(app):
+    """Конкурентные запросы не могут делить одну сессию session_test,
+    поэтому каждый запрос получает свою."""
+
+    async def session_per_request():
+        async with session_factory() as session:
+            yield session
+            await session.commit()
+
+    app.dependency_overrides[get_db_session] = session_per_request
+    yield app
+
+
+@pytest.mark.asyncio
+async def test_run_over_asgi(async_app_client, concurrent_app) -> None:
+    data = await sample_data(session_factory)
+    assert sorted(data["users"]) == [(1, "123a"), (2, "124a")]
+    results = await run(
+        async_app_client,
+        data,
+        ["feed", "users", "tweets"],
+        requests=10,
+        concurrency=3,
+        endpoint_concurrency={"tweets": 2},
+    )
+    assert set(results) == {"feed", "users", "tweets"}
+    assert results["feed"]["requests"] == 10
+    assert results["feed"]["errors"] == 0
+    assert results["tweets"]["concurrency"] == 2
+    assert 0 < results["feed"]["p50_ms"] <= results["feed"]["p99_ms"]
@@ -0,0 +1,91 @@
+import asyncio
+import time
+
+import pytest
+import pytest_asyncio
+from httpx import ASGITransport, AsyncClient
+from prometheus_client import REGISTRY
+
+from app import routes
+from app.metrics import measure_loop_lag
+
+pytestmark = pytest.mark.asyncio
+
+
+@pytest_asyncio.fixture
+async def root_client(app):
+    """Клиент всего приложения: метрики считает middleware корневого
+    app, а /api смонтирован в него."""
+    transport = ASGITransport(app=routes.app)
+    async with AsyncClient(
+        transport=transport, base_url="http://test"
+    ) as client:
+        yield client
+
+
+def sample(name: str, **labels) -> float:
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+async def test_request_metrics(root_client) -> None:
+    route = {"route": "/api/users/{id}"}
+    requests = sample(
+        "http_requests_total", method="GET", status="200", **route
+    )
+    latency = sample(
+        "http_request_duration_seconds_count", method="GET", **route
+    )
+    statements = sample("http_request_db_statements_sum", **route)
+    db_time = sample("http_request_db_seconds_sum", **route)
+
+    resp = await root_client.get("/api/users/2", headers={"api-key": "123a"})
+    assert resp.status_code == 200
+
+    assert sample(
+        "http_requests_total", method="GET", status="200", **route
+    ) == requests + 1
+    assert sample(
+        "http_request_duration_seconds_count", method="GET", **route
+    ) == latency + 1
+    # Проверка api-key, профиль вместе с подписчиками и подписками
+    assert sample("http_request_db_statements_sum", **route) == (
+        statements + 2
+    )
+    assert sample("http_request_db_seconds_sum", **route) > db_time
+
+
+async def test_error_metrics(root_client) -> None:
+    labels = {"route": "/api/users/me", "error_type": "Exception"}
+    errors = sample("http_exceptions_total", **labels)
+    resp = await root_client.get("/api/users/me", headers={"api-key": "555"})
+    assert resp.status_code == 400
+    assert sample("http_exceptions_total", **labels) == errors + 1
+    assert sample(
+        "http_requests_total",
+        method="GET",
+        route="/api/users/me",
+        status="400",
+    ) >= 1
+
+
+async def test_metrics_endpoint(root_client) -> None:
+    await root_client.get("/api/tweets", headers={"api-key": "123a"})
+    resp = await root_client.get("/metrics")
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("text/plain")
+    assert (
+        'http_requests_total{method="GET",route="/api/tweets",status="200"}'
+        in resp.text
+    )
+    assert "db_pool_checked_out" in resp.text
+    assert "event_loop_lag_seconds" in resp.text
+
+
+async def test_loop_lag() -> None:
+    task = asyncio.create_task(measure_loop_lag(0.01))
+    await asyncio.sleep(0)
+    # Блокирующий вызов задерживает event loop
+    time.sleep(0.1)
+    lag = await task
+    assert lag >= 0.05
+    assert sample("event_loop_lag_seconds") == lag
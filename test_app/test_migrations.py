@@ -0,0 +1,147 @@
+import pytest
+from sqlalchemy import inspect, select, text
+from sqlalchemy.dialects import postgresql
+
+from app.migrations import MIGRATIONS, migrate
+from app.models import Base, Followers, Likes, Tweets
+from app.reaper import reapable_media
+from app.routes import (
+    feed_page_query,
+    feed_rest_query,
+    follows_page_query,
+    profile_query,
+    search_page_query,
+    search_truncated_query,
+)
+from test_app.conftest import engine
+
+pytestmark = pytest.mark.asyncio
+
+
+def describe(sync_conn) -> dict:
+    inspector = inspect(sync_conn)
+    schema = {}
+    for table in inspector.get_table_names():
+        if table == "schema_migrations":
+            continue
+        schema[table] = {
+            "columns": sorted(
+                (c["name"], str(c["type"]), c["nullable"], c["default"])
+                for c in inspector.get_columns(table)
+            ),
+            "pk": inspector.get_pk_constraint(table),
+            "indexes": sorted(
+                (i["name"], tuple(i["column_names"]), i["unique"])
+                for i in inspector.get_indexes(table)
+            ),
+            "unique": sorted(
+                tuple(u["column_names"])
+                for u in inspector.get_unique_constraints(table)
+            ),
+            "foreign_keys": sorted(
+                (
+                    tuple(f["constrained_columns"]),
+                    f["referred_table"],
+                    f["options"].get("ondelete"),
+                )
+                for f in inspector.get_foreign_keys(table)
+            ),
+        }
+    return schema
+
+
+async def reset_schema(conn):
+    await conn.run_sync(Base.metadata.drop_all)
+    await conn.execute(text("DROP TABLE IF EXISTS schema_migrations"))
+
+
+async def test_migrations_match_models() -> None:
+    async with engine.begin() as conn:
+        await reset_schema(conn)
+    assert await migrate(engine) == [m.version for m in MIGRATIONS]
+    assert await migrate(engine) == []
+    async with engine.connect() as conn:
+        migrated = await conn.run_sync(describe)
+
+    async with engine.begin() as conn:
+        await reset_schema(conn)
+        await conn.run_sync(Base.metadata.create_all)
+        created = await conn.run_sync(describe)
+    assert migrated == created
+
+
+async def explain(statement) -> str:
+    sql = statement.compile(
+        dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}
+    )
+    async with engine.connect() as conn:
+        await conn.execute(text("SET enable_seqscan = off"))
+        result = await conn.execute(text(f"EXPLAIN {sql}"))
+        return "\n".join(result.scalars())
+
+
+@pytest.mark.parametrize(
+    "statement",
+    [
+        pytest.param(feed_page_query(1, 21, None), id="feed"),
+        pytest.param(feed_page_query(1, 21, (1, 10)), id="feed_cursor"),
+        pytest.param(feed_rest_query(1, 21, None), id="feed_rest"),
+        pytest.param(feed_rest_query(1, 21, 10), id="feed_rest_cursor"),
+        pytest.param(
+            select(Likes).where(Likes.tweet_id == 1, Likes.likers_id == 1),
+            id="like",
+        ),
+        pytest.param(
+            select(Likes.tweet_id).where(Likes.likers_id == 1),
+            id="likes_of_user",
+        ),
+        pytest.param(
+            select(Followers).where(
+                Followers.followers_id == 1, Followers.following_id == 2
+            ),
+            id="follow",
+        ),
+        pytest.param(
+            select(Followers.followers_id).where(Followers.following_id == 2),
+            id="followers_of_user",
+        ),
+        pytest.param(
+            select(Tweets.id).where(
+                Tweets.author_id == 2, Tweets.fanned_out.is_(True)
+            ),
+            id="follow_backfill",
+        ),
+        pytest.param(
+            follows_page_query(2, "followers", 101, (10,)),
+            id="profile_followers",
+        ),
+        pytest.param(
+            follows_page_query(1, "following", 101, (10,)),
+            id="profile_following",
+        ),
+        pytest.param(profile_query(2, 21, None, 21, (10,)), id="profile"),
+        pytest.param(search_page_query("cat dog", 21, None), id="search"),
+        pytest.param(
+            search_page_query("cat", 21, (0.06, 10)), id="search_cursor"
+        ),
+        pytest.param(
+            search_truncated_query("cat dog", 2000), id="search_truncated"
+        ),
+        pytest.param(reapable_media(3600, 500)[0], id="reaper_deleted"),
+        pytest.param(reapable_media(3600, 500)[1], id="reaper_orphaned"),
+    ],
+)
+async def test_hot_queries_use_indexes(statement) -> None:
+    plan = await explain(statement)
+    assert "Seq Scan" not in plan, plan
+
+
+@pytest.mark.parametrize("before_id", [None, 10])
+async def test_feed_rest_stops_after_limit(before_id) -> None:
+    # Остальные твиты ленты читаются с конца первичного ключа прямо
+    # в LIMIT: без сортировки и hash join по всей таблице tweets
+    plan = await explain(feed_rest_query(1, 21, before_id))
+    assert plan.splitlines()[0].startswith("Limit"), plan
+    assert "Backward using tweets_pkey" in plan, plan
+    assert "Sort" not in plan, plan
+    assert "Hash" not in plan, plan
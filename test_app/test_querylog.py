@@ -0,0 +1,71 @@
+import logging
+
+import pytest
+from httpx import ASGITransport, AsyncClient
+from sqlalchemy import select, text
+
+from app.models import User
+from app.querylog import QueryLog, QueryLogMiddleware, statement_shape
+
+
+def test_statement_shape() -> None:
+    assert statement_shape(
+        "SELECT *\n  FROM t WHERE id IN (%s, %s, %s) AND name = 'it''s'"
+    ) == "SELECT * FROM t WHERE id IN (?) AND name = ?"
+    assert statement_shape(
+        "INSERT INTO likes VALUES ($1, $2), ($3, $4) LIMIT 10"
+    ) == "INSERT INTO likes VALUES (?), (?) LIMIT ?"
+
+
+@pytest.mark.asyncio
+async def test_repeated_statements(session_test) -> None:
+    with QueryLog(repeat_threshold=3, slow_ms=None) as log:
+        for user_id in (1, 2, 3):
+            await session_test.execute(
+                select(User.name).where(User.id == user_id)
+            )
+        await session_test.execute(select(User.id))
+    assert len(log.queries) == 4
+    assert list(log.repeated().values()) == [3]
+    assert len(log.problems()) == 1
+    assert len(log.problems(max_statements=3)) == 2
+
+
+@pytest.mark.asyncio
+async def test_slow_statement(session_test) -> None:
+    with QueryLog(slow_ms=50) as log:
+        await session_test.execute(text("SELECT pg_sleep(0.06)"))
+        await session_test.execute(text("SELECT 1"))
+    assert [query.shape for query in log.slow()] == [
+        "SELECT pg_sleep(?)"
+    ]
+
+
+@pytest.mark.asyncio
+async def test_outside_log_not_recorded(session_test) -> None:
+    with QueryLog() as log:
+        pass
+    await session_test.execute(select(User.id))
+    assert log.queries == []
+
+
+@pytest.mark.asyncio
+async def test_middleware_logs_problems(session_test, caplog) -> None:
+    async def endpoint(scope, receive, send):
+        # N+1: отдельный запрос на каждого пользователя
+        for user_id in (1, 2, 3):
+            await session_test.execute(
+                select(User.name).where(User.id == user_id)
+            )
+        await send({"type": "http.response.start", "status": 200})
+        await send({"type": "http.response.body", "body": b""})
+
+    transport = ASGITransport(app=QueryLogMiddleware(endpoint))
+    async with AsyncClient(
+        transport=transport, base_url="http://test"
+    ) as client:
+        with caplog.at_level(logging.WARNING, logger="app.querylog"):
+            resp = await client.get("/users")
+    assert resp.status_code == 200
+    [record] = caplog.records
+    assert record.getMessage().startswith("GET /users: 3 x SELECT")
@@ -0,0 +1,94 @@
+import math
+import os
+
+import pytest
+import pytest_asyncio
+
+from app import routes
+from app.cache import MISSING
+from app.models import Base, User, get_replica_set
+from app.replicas import ReplicaSet
+from app.settings import create_engine
+from test_app.conftest import test_db_settings
+
+pytestmark = pytest.mark.asyncio
+
+REPLICA_PORT = int(os.getenv("TEST_DB_REPLICA_PORT", 5430))
+
+
+@pytest_asyncio.fixture
+async def replica_set(app):
+    """Вторая тестовая база в роли реплики, пользователи в ней названы
+    иначе, чем в основной, чтобы было видно, откуда прочитаны данные."""
+    replica_engine = create_engine(
+        test_db_settings.model_copy(update={"port": REPLICA_PORT})
+    )
+    replica_set = ReplicaSet([replica_engine], max_lag=1, sticky_seconds=5)
+    await replica_set.check()
+    if replica_set.lags[0] == math.inf:
+        await replica_set.dispose()
+        pytest.skip("replica test database is not running")
+    async with replica_engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    async with replica_set.factories[0]() as session:
+        session.add_all(
+            [
+                User(api_key="123a", name="replica"),
+                User(api_key="124a", name="replica2"),
+            ]
+        )
+        await session.commit()
+    app.dependency_overrides[get_replica_set] = lambda: replica_set
+    try:
+        yield replica_set
+    finally:
+        del app.dependency_overrides[get_replica_set]
+        await replica_set.dispose()
+
+
+async def test_reads_go_to_replica(async_app_client, replica_set) -> None:
+    assert replica_set.lags == [0]
+    resp = await async_app_client.get("/users/1", headers={"api-key": "124a"})
+    assert resp.json()["user"]["name"] == "replica"
+    assert resp.json()["user"]["following"] == []
+    # Профиль с реплики не кэшируется
+    assert routes.profile_cache.get(1) is MISSING
+
+    resp = await async_app_client.get("/tweets", headers={"api-key": "124a"})
+    assert resp.json()["tweets"] == []
+
+
+async def test_read_your_writes(async_app_client, replica_set) -> None:
+    resp = await async_app_client.post(
+        "/users/1/follow", headers={"api-key": "124a"}
+    )
+    assert resp.json() == {"result": True}
+    assert "read_primary_until" in resp.cookies
+
+    resp = await async_app_client.get("/users/me", headers={"api-key": "124a"})
+    assert resp.json()["user"]["following"] == [{"id": 1, "name": "name"}]
+
+    # В другом воркере локальной отметки нет, остаётся cookie
+    replica_set.sticky.clear()
+    routes.clear_profiles()
+    resp = await async_app_client.get("/users/me", headers={"api-key": "124a"})
+    assert resp.json()["user"]["name"] == "name2"
+
+    async_app_client.cookies.clear()
+    routes.clear_profiles()
+    resp = await async_app_client.get("/users/me", headers={"api-key": "124a"})
+    assert resp.json()["user"]["name"] == "replica2"
+
+
+async def test_lagging_replica_is_skipped(
+    async_app_client, replica_set
+) -> None:
+    replica_set.lags[0] = 5
+    resp = await async_app_client.get("/users/1", headers={"api-key": "124a"})
+    assert resp.json()["user"]["name"] == "name"
+
+    await replica_set.check()
+    routes.clear_profiles()
+    resp = await async_app_client.get("/users/1", headers={"api-key": "124a"})
+    assert resp.json()["user"]["name"] == "replica"
@@ -0,0 +1,40 @@
+import pytest
+
+from bench.search import measure, queries, search_page
+from test_app.conftest import test_async_session as session_factory
+
+
+async def add_texts(async_app_client, texts):
+    for text in texts:
+        await async_app_client.post(
+            "/tweets", json={"tweet_data": text}, headers={"api-key": "124a"}
+        )
+
+
+def test_queries_by_frequency() -> None:
+    assert queries(1000) == {
+        "frequent": "python",
+        "two_words": "python postgres",
+        "phrase": '"python postgres"',
+        "exclude": "w300 -python",
+        "medium": "w300",
+        "or": "w300 or w999",
+        "rare": "w999",
+    }
+
+
+@pytest.mark.asyncio
+async def test_measure_pages(async_app_client) -> None:
+    await add_texts(async_app_client, [f"python {i}" for i in range(5)])
+    count, position = await search_page(session_factory, "python", 2, None)
+    assert count == 2
+    assert position is not None
+
+    stats = await measure(session_factory, "python", 2, 4, 3)
+    # Третья страница последняя
+    assert set(stats) == {
+        f"page{page}_{metric}_ms"
+        for page in (1, 2, 3)
+        for metric in ("p50", "p95")
+    }
+    assert all(value > 0 for value in stats.values())
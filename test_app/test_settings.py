@@ -0,0 +1,61 @@
+import pytest
+from sqlalchemy import text
+from sqlalchemy.pool import NullPool
+
+from app.settings import DatabaseSettings, create_engine
+from test_app.conftest import engine, test_db_settings
+
+
+def test_settings_from_env(monkeypatch) -> None:
+    monkeypatch.setenv("APP_DB_PORT", "6432")
+    monkeypatch.setenv("APP_DB_POOL_SIZE", "20")
+    monkeypatch.setenv("APP_DB_ECHO", "true")
+    monkeypatch.setenv("APP_DB_STATEMENT_TIMEOUT", "")
+    settings = DatabaseSettings.from_env("APP_DB_", max_overflow=0)
+    assert settings.port == 6432
+    assert settings.pool_size == 20
+    assert settings.echo is True
+    assert settings.statement_timeout == 0
+    assert settings.max_overflow == 0
+    assert settings.url.render_as_string() == (
+        "postgresql+asyncpg://postgres:***@db:6432/postgres"
+    )
+
+
+@pytest.mark.parametrize(
+    "name, value",
+    [("PORT", "port"), ("POOL_SIZE", "0"), ("POOL_TIMEOUT", "-1")],
+)
+def test_settings_are_validated(monkeypatch, name, value) -> None:
+    monkeypatch.setenv(f"APP_DB_{name}", value)
+    with pytest.raises(Exception, match=r"Check APP_DB_\* in .env"):
+        DatabaseSettings.from_env("APP_DB_")
+
+
+def test_engine_options() -> None:
+    options = DatabaseSettings(
+        pool_size=3, statement_cache_size=0, statement_timeout=500
+    ).engine_options()
+    assert options["pool_size"] == 3
+    assert options["connect_args"]["statement_cache_size"] == 0
+    assert options["connect_args"]["prepared_statement_cache_size"] == 0
+    assert options["connect_args"]["server_settings"] == {
+        "statement_timeout": "500"
+    }
+    assert "pool_size" not in DatabaseSettings(
+        null_pool=True
+    ).engine_options()
+    assert isinstance(engine.pool, NullPool)
+
+
+@pytest.mark.asyncio
+async def test_statement_timeout_applied() -> None:
+    timed = create_engine(
+        test_db_settings.model_copy(update={"statement_timeout": 1500})
+    )
+    try:
+        async with timed.connect() as conn:
+            result = await conn.execute(text("SHOW statement_timeout"))
+            assert result.scalar() == "1500ms"
+    finally:
+        await timed.dispose()